@@ -7,7 +7,8 @@ async def EmergencyNotificationFunction():
     logger.info("Emergency notification received")
     return {"status": 200}
 
-app.deploy(EmergencyNotificationFunction, "Emergency-Notification-Function", "EmergencyEvent")
+app.deploy(EmergencyNotificationFunction, "Emergency-Notification-Function", "EmergencyEvent",
+           priority="critical")
 
 
 async def class_test_handler():
@@ -28,5 +29,6 @@ async def emergency_notification_function():
     return {"status": 200, "message": "I passed the assignment."}
 
 
-app.deploy(emergency_notification_function, "emergency_notification_function()", "EmergencyEvent")
+app.deploy(emergency_notification_function, "emergency_notification_function()", "EmergencyEvent",
+           priority="critical")
 
@@ -1,6 +1,7 @@
 
 from .gateway import LocalGateway, logger as base_logger
+from .trace import TraceExporter
 from .trigger import PeriodicTrigger 
 from .event import BaseEventFabric, ExampleEventFabric
 
-__all__ = [ "LocalGateway", "base_logger", "PeriodicTrigger", "BaseEventFabric", "ExampleEventFabric" ]
+__all__ = [ "LocalGateway", "base_logger", "TraceExporter", "PeriodicTrigger", "BaseEventFabric", "ExampleEventFabric" ]
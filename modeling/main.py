@@ -150,7 +150,7 @@ from(bucket: "{bucket}")
 
 
 # Expose it as a SIF function / HTTP endpoint
-app.deploy(create_model_from_influx, "create_model_from_influx()", "TrainOccupancyModelEvent")
+app.deploy(create_model_from_influx, "create_model_from_influx()", "TrainOccupancyModelEvent", priority="low")
 
 
 # evt = ExampleEventFabric()
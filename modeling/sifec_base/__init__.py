@@ -1,6 +1,7 @@
 from .event import BaseEventFabric, ExampleEventFabric, ModelEventFabric
 from .gateway import LocalGateway, logger as base_logger
+from .trace import TraceExporter
 from .trigger import Trigger, OneShotTrigger, PeriodicTrigger
 
-__all__ = ["BaseEventFabric", "LocalGateway", "base_logger",
+__all__ = ["BaseEventFabric", "LocalGateway", "base_logger", "TraceExporter",
            "ExampleEventFabric", "Trigger", "OneShotTrigger", "PeriodicTrigger", "ModelEventFabric"]
@@ -1,9 +1,12 @@
 import os
+import time
 import socket
 import urllib3
 import logging
 from typing import Callable, Any, List
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+
+from .trace import TraceExporter, extract_trace
 
 logger = logging.getLogger("fastapi_cli")
 
@@ -24,21 +27,30 @@ class LocalGateway(FastAPI):
     app.deploy(fn, 'My-Func', 'My-Event', 'POST')
     ```
 
+    Requests dispatched by SIF-edge carry the trace of the event behind them.
+    The gateway appends the time the handler started and finished, then
+    exports the trace through a :class:`TraceExporter <trace.TraceExporter>`,
+    see `SIF_TRACE_EXPORT`. Handlers find the trace id in `request.state.trace_id`.
+
     :param mock: Indicates if remote calls must be mocked
+    :param tracer: Exporter of the traces, one honoring `SIF_TRACE_EXPORT` by default
     """
 
-    def __init__(self, mock: bool = False, *args, **kwargs):
+    def __init__(self, mock: bool = False, tracer: TraceExporter | None = None, *args, **kwargs):
         super(LocalGateway, self).__init__(*args, **kwargs)
         self.local_ip = None
         self.local_port = None
         self.mock = mock
+        self.tracer = tracer if tracer is not None else TraceExporter()
+        self.middleware("http")(self.__trace)
         self.scheduler = os.environ.get("SCH_SERVICE_NAME", "localhost:8080")
         if self.scheduler is None and not mock:
             raise ValueError(
                 "SCH_SERVICE_NAME should be given as an environment variable")
         self.__get_hostname()
 
-    def deploy(self, cb: Callable[..., Any], name: str, evts: List[str] | str,  method: str = "GET", path: str = None):
+    def deploy(self, cb: Callable[..., Any], name: str, evts: List[str] | str,  method: str = "GET", path: str = None,
+               priority: str = "normal"):
         """
         Handles dynamically registration of endpoints within the server and
         scheduler
@@ -48,6 +60,7 @@ class LocalGateway(FastAPI):
         :param evts: EventRequests the function must subscribe
         :param method: Type of HTTP Method the SIF-edge's dispatcher must use to invoke the cb
         :param path: By default, `/api/cb.__name__` is used, this method overrides the `cb.__name__`
+        :param priority: Priority of the invocations of the cb, i.e., `critical`, `high`, `normal` or `low`
         """
         endpoint = path or f"/api/{cb.__name__}"
         if not endpoint.startswith("/api"):
@@ -69,7 +82,8 @@ class LocalGateway(FastAPI):
             try:
                 http = urllib3.PoolManager()
                 res = http.request('POST', url, json=dict(
-                    name=name, url=endpoint, subs=evts, method=method.upper()), retries=urllib3.Retry(5))
+                    name=name, url=endpoint, subs=evts, method=method.upper(), priority=priority),
+                    retries=urllib3.Retry(5))
                 if res.status >= 300:
                     logger.error(
                         f"Failure registering function with the scheduler because {res.reason}")
@@ -79,6 +93,19 @@ class LocalGateway(FastAPI):
         logger.info(
             f"Registered endpoint {endpoint} for {cb.__name__}")
 
+    async def __trace(self, request: Request, call_next):
+        trace_id, stages = extract_trace(request.headers)
+        if trace_id is None:
+            return await call_next(request)
+
+        request.state.trace_id = trace_id
+        stages.append(("handler", time.time_ns()))
+        response = await call_next(request)
+        stages.append(("handled", time.time_ns()))
+        self.tracer.export(trace_id, stages, path=request.url.path,
+                           status=response.status_code)
+        return response
+
     def __get_hostname(self):
         is_k8s = os.environ.get("KUBERNETES_SERVICE_PORT", None) is not None
 
@@ -57,7 +57,7 @@ async def emergency_handler():
     return {"status": 200, "message": "Emergency detected."}
 
 
-app.deploy(emergency_handler, "emergency_handler()", "CheckEmergencyEvent")
+app.deploy(emergency_handler, "emergency_handler()", "CheckEmergencyEvent", priority="critical")
 
 
 evt = TrainOccupancyModelEventFabric()
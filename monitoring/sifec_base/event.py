@@ -1,14 +1,21 @@
 import os
+import time
 import urllib3
 import logging
 
 from abc import ABC, abstractmethod
 from typing import Tuple, Any
 
+from .trace import new_trace, trace_headers
+
 logger = logging.getLogger("fastapi_cli")
 
 
 class BaseEventFabric(ABC):
+    # Priority of the emitted events at the scheduler, i.e., `critical`,
+    # `high`, `normal` or `low`
+    priority = "normal"
+
     def __init__(self):
         self.scheduler = os.environ.get(
             "SCH_SERVICE_NAME", None)
@@ -37,15 +44,25 @@ class BaseEventFabric(ABC):
         raise NotImplementedError("Implement the 'call' method in your class")
 
     def __call__(self, *args, **kwargs):
+        # Every event starts a trace, whose stages are appended by the
+        # scheduler and dispatcher up to the gateway of the function
+        trace_id, stages = new_trace()
         evt_name, data = self.call(*args, **kwargs)
         try:
             if self.debugging_mode:
-                logger.info("Faux call to scheduler has happened!")
+                logger.info(f"Faux call to scheduler has happened! (trace {trace_id})")
                 return
 
+            # The scheduler answers 429 or 503 with a Retry-After header while
+            # it is overloaded, the event is sent again once that delay passed
+            retries = urllib3.Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 503],
+                                    allowed_methods=["POST"], respect_retry_after_header=True,
+                                    raise_on_status=False)
             http = urllib3.PoolManager()
+            stages.append(("sent", time.time_ns()))
             res = http.request('POST', f"{self.scheduler}/api/event",
-                               json=dict(name=evt_name, data=data), retries=urllib3.Retry(5))
+                               json=dict(name=evt_name, data=data, priority=self.priority),
+                               headers=trace_headers(trace_id, stages), retries=retries)
             if res.status >= 300:
                 print(
                     f"Failure to send EventRequest to the scheduler because {res.reason}")
@@ -65,6 +82,7 @@ class ExampleEventFabric(BaseEventFabric):
         return "GenEvent", None
 
 class TrainOccupancyModelEventFabric(BaseEventFabric):
+    priority = "low"
 
     def __init__(self):
         super(TrainOccupancyModelEventFabric, self).__init__()
@@ -75,6 +93,7 @@ class TrainOccupancyModelEventFabric(BaseEventFabric):
     
     
 class CheckEmergencyEventFabric(BaseEventFabric):
+    priority = "critical"
 
     def __init__(self):
         super(CheckEmergencyEventFabric, self).__init__()
@@ -85,6 +104,7 @@ class CheckEmergencyEventFabric(BaseEventFabric):
     
     
 class EmergencyEventFabric(BaseEventFabric):
+    priority = "critical"
 
     def __init__(self):
         super(EmergencyEventFabric, self).__init__()
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import uuid
+import queue
+import urllib3
+import logging
+
+from threading import Thread
+from typing import Any, Dict, List, Mapping, Tuple
+
+logger = logging.getLogger("fastapi_cli")
+
+# Headers carrying the trace of an event from its emission, through the
+# SIF-edge scheduler and dispatcher, to the function handling it
+TRACE_HEADER = "X-SIF-Trace-Id"
+STAGES_HEADER = "X-SIF-Trace-Stages"
+
+
+def new_trace() -> Tuple[str, List[Tuple[str, int]]]:
+    """
+    Starts the trace of an event being emitted
+
+    :returns: the trace id and its first stage
+    """
+    return uuid.uuid4().hex, [("emitted", time.time_ns())]
+
+
+def encode_stages(stages: List[Tuple[str, int]]) -> str:
+    return ",".join(f"{stage}={ts}" for stage, ts in stages)
+
+
+def decode_stages(value: str | None) -> List[Tuple[str, int]]:
+    stages = []
+    for pair in (value or "").split(","):
+        stage, _, ts = pair.partition("=")
+        if stage and ts.isdigit():
+            stages.append((stage.strip(), int(ts)))
+    return stages
+
+
+def trace_headers(trace_id: str, stages: List[Tuple[str, int]]) -> Dict[str, str]:
+    return {TRACE_HEADER: trace_id, STAGES_HEADER: encode_stages(stages)}
+
+
+def extract_trace(headers: Mapping[str, str]) -> Tuple[str | None, List[Tuple[str, int]]]:
+    return headers.get(TRACE_HEADER), decode_stages(headers.get(STAGES_HEADER))
+
+
+class TraceExporter(object):
+    """
+    Exports the traces completed by the gateway from a background thread,
+    so that handlers never wait for it. Traces are written as JSON lines to
+    a local file, or posted in batches to a collector when the target is an
+    HTTP URL. Without target, traces are only logged. When the exporter
+    falls behind, new traces are dropped.
+
+    Every trace holds its stages with their time, as nanoseconds since the
+    epoch, and the milliseconds elapsed between consecutive stages. Stages
+    are recorded by different hosts, hence their clocks should be in sync.
+
+    :param target: file path or collector URL, `SIF_TRACE_EXPORT` by default
+    :param max_pending: maximum number of traces waiting to be exported
+    :param batch: maximum number of traces exported at once
+    """
+
+    def __init__(self, target: str | None = None, max_pending: int = 10000, batch: int = 100):
+        super(TraceExporter, self).__init__()
+        self.target = target if target is not None else os.environ.get("SIF_TRACE_EXPORT")
+        self.batch = batch
+        self.dropped = 0
+        self.pending: queue.Queue = queue.Queue(max_pending)
+        self.http = None
+        if self.target and self.target.startswith(("http://", "https://")):
+            self.http = urllib3.PoolManager()
+        if self.target:
+            Thread(target=self._run, daemon=True).start()
+
+    @staticmethod
+    def record(trace_id: str, stages: List[Tuple[str, int]], **attrs: Any) -> Dict[str, Any]:
+        return {
+            "trace_id": trace_id,
+            **attrs,
+            "stages": [{"stage": stage, "ts": ts} for stage, ts in stages],
+            "durations_ms": {f"{prev[0]}->{cur[0]}": (cur[1] - prev[1]) / 1e6
+                             for prev, cur in zip(stages, stages[1:])},
+            "total_ms": (stages[-1][1] - stages[0][1]) / 1e6 if stages else 0.0,
+        }
+
+    def export(self, trace_id: str, stages: List[Tuple[str, int]], **attrs: Any):
+        record = TraceExporter.record(trace_id, stages, **attrs)
+        if not self.target:
+            logger.debug(f"trace {trace_id}: {record['durations_ms']}")
+            return
+        try:
+            self.pending.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            records = [self.pending.get(True)]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.http is not None:
+                    self.http.request("POST", self.target, json=records,
+                                      timeout=urllib3.Timeout(total=5))
+                else:
+                    with open(self.target, "a") as out:
+                        out.writelines(json.dumps(record) + "\n" for record in records)
+            except Exception as err:
+                logger.error(f"Failure exporting {len(records)} traces: {err}")
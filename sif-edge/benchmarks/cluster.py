@@ -0,0 +1,237 @@
+"""
+Runs a cluster of sif-edge replicas as local processes and checks that
+every function is placed on exactly one replica and invoked once per
+complete join, whichever replica receives the events, while a replica
+leaves and joins the cluster again. Reports the time the cluster takes to
+rebalance, as JSON.
+
+Half of the functions join two topics. Events are sent to random replicas,
+every round sending each topic once, so each function is expected to be
+invoked once per round.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.cluster --replicas 3 --functions 30
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import subprocess
+
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.hit(self.path.rsplit("/", 1)[-1])
+
+    def log_message(self, *args):
+        pass
+
+
+class StubReceiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super(StubReceiver, self).__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = Lock()
+        self.hits = {}
+
+    def hit(self, name: str):
+        with self.lock:
+            self.hits[name] = self.hits.get(name, 0) + 1
+
+    def reset(self) -> dict:
+        with self.lock:
+            hits, self.hits = self.hits, {}
+        return hits
+
+    def count(self) -> int:
+        with self.lock:
+            return sum(self.hits.values())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Replica(object):
+    def __init__(self, port: int, peers: list, data: str, heartbeat: float):
+        super(Replica, self).__init__()
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = dict(os.environ, SCH_DATA_PATH=data, SIF_CLUSTER_SELF=self.url,
+                        SIF_CLUSTER_PEERS=",".join(peers),
+                        SIF_CLUSTER_HEARTBEAT_S=str(heartbeat), SIF_CLUSTER_FAILURES="2")
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning"],
+            env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            self.proc.wait()
+            self.proc = None
+
+
+def health(http: urllib3.PoolManager, replica: Replica) -> dict | None:
+    try:
+        res = http.request("GET", f"{replica.url}/api/cluster/health",
+                           timeout=1.0, retries=False)
+        return res.json() if res.status == 200 else None
+    except Exception:
+        return None
+
+
+def wait_until(check, timeout: float) -> float | None:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if check():
+            return time.perf_counter() - start
+        time.sleep(0.05)
+    return None
+
+
+def converged(http: urllib3.PoolManager, live: list, names: list) -> bool:
+    """
+    Every live replica sees the others, and every function lives on exactly
+    one of them
+    """
+    urls = sorted(replica.url for replica in live)
+    placed = []
+    for replica in live:
+        state = health(http, replica)
+        if state is None or state["members"] != urls:
+            return False
+        placed.extend(state["functions"])
+    return sorted(placed) == sorted(names)
+
+
+def send_rounds(http: urllib3.PoolManager, live: list, topics: int, rounds: int):
+    for seq in range(rounds):
+        for topic in range(topics):
+            replica = random.choice(live)
+            http.request("POST", f"{replica.url}/api/event",
+                         json={"name": f"ClusterEvent{topic}", "data": {"seq": seq}})
+
+
+def phase(http: urllib3.PoolManager, receiver: StubReceiver, live: list, names: list,
+          topics: int, rounds: int, timeout: float) -> dict:
+    receiver.reset()
+    start = time.perf_counter()
+    send_rounds(http, live, topics, rounds)
+    expected = len(names) * rounds
+    wait_until(lambda: receiver.count() >= expected, timeout)
+    elapsed = time.perf_counter() - start
+    # Late duplicates show up after the expected count is reached
+    time.sleep(0.5)
+    hits = receiver.reset()
+    return {
+        "replicas": len(live),
+        "events": topics * rounds,
+        "invocations_expected": expected,
+        "invocations_received": sum(hits.values()),
+        "functions_missed": sorted(name for name in names if hits.get(name, 0) < rounds),
+        "functions_duplicated": sorted(name for name in names if hits.get(name, 0) > rounds),
+        "elapsed_s": elapsed,
+    }
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--replicas", type=int, default=3, help="number of replicas")
+    parser.add_argument("--functions", type=int, default=30, help="number of functions")
+    parser.add_argument("--topics", type=int, default=10, help="number of topics")
+    parser.add_argument("--rounds", type=int, default=20, help="events sent per topic and phase")
+    parser.add_argument("--heartbeat", type=float, default=0.2,
+                        help="seconds between two probes of the replicas")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for every step")
+    parser.add_argument("--output", default="-",
+                        help="file receiving the JSON results, standard output by default")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    http = urllib3.PoolManager(maxsize=args.replicas)
+
+    receiver = StubReceiver()
+    Thread(target=receiver.serve_forever, daemon=True).start()
+
+    ports = [free_port() for _ in range(args.replicas)]
+    peers = [f"http://127.0.0.1:{port}" for port in ports]
+    base = tempfile.mkdtemp()
+    replicas = [Replica(port, peers, os.path.join(base, str(idx)), args.heartbeat)
+                for idx, port in enumerate(ports)]
+    for idx, replica in enumerate(replicas):
+        os.makedirs(os.path.join(base, str(idx)))
+        replica.start()
+
+    report = {"benchmark": "cluster", "config": {
+        key: value for key, value in vars(args).items() if key != "output"}, "phases": {}}
+    try:
+        if wait_until(lambda: all(health(http, replica) for replica in replicas),
+                      args.timeout) is None:
+            raise RuntimeError("replicas did not start in time")
+
+        names = []
+        for idx in range(args.functions):
+            subs = [f"ClusterEvent{idx % args.topics}"]
+            if idx % 2:
+                subs.append(f"ClusterEvent{(idx + 1) % args.topics}")
+            name = f"cluster-{idx}"
+            names.append(name)
+            http.request("POST", f"{random.choice(replicas).url}/api/function", json={
+                "name": name, "subs": subs, "method": "POST",
+                "url": f"127.0.0.1:{receiver.server_port}/api/{name}"})
+
+        live = list(replicas)
+        report["phases"]["startup_convergence_s"] = wait_until(
+            lambda: converged(http, live, names), args.timeout)
+        report["phases"]["all"] = phase(http, receiver, live, names, args.topics,
+                                        args.rounds, args.timeout)
+
+        leaving = live.pop()
+        leaving.stop()
+        report["phases"]["leave_rebalance_s"] = wait_until(
+            lambda: converged(http, live, names), args.timeout)
+        report["phases"]["after_leave"] = phase(http, receiver, live, names, args.topics,
+                                                args.rounds, args.timeout)
+
+        leaving.start()
+        live.append(leaving)
+        report["phases"]["join_rebalance_s"] = wait_until(
+            lambda: converged(http, live, names), args.timeout)
+        report["phases"]["after_join"] = phase(http, receiver, live, names, args.topics,
+                                               args.rounds, args.timeout)
+    finally:
+        for replica in replicas:
+            replica.stop()
+        receiver.shutdown()
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
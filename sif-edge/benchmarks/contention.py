@@ -0,0 +1,125 @@
+"""
+Measures the latency of routing an event into an invocation while other
+threads register and delete functions, or poll the status as a dashboard
+would, next to the latency without them.
+
+The latency of an event runs from its creation to the invocation reaching
+the dispatcher queue. Events are sent at a fixed rate to functions joining
+a single topic among `--functions` registered ones, so every event yields
+one invocation.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.contention --functions 10000
+"""
+import sys
+import time
+import queue
+import argparse
+import tempfile
+import statistics
+
+from threading import Thread, Event
+from typing import List
+
+import common
+from scheduler import Scheduler
+
+
+class LatencyQueue(queue.Queue):
+    """
+    Dispatcher queue recording the latency of every invocation
+    """
+
+    def __init__(self):
+        super(LatencyQueue, self).__init__()
+        self.latencies: List[float] = []
+
+    def put(self, inv, block=True, timeout=None):
+        now = time.monotonic_ns()
+        for evt in (inv.events or {}).values():
+            self.latencies.append((now - evt.monotonic_ns) / 1e6)
+
+
+def churn(sch: Scheduler, stop: Event, rate: float, fns: int):
+    """
+    Replaces and deletes functions subscribed to topics shared with the
+    registered ones, at `rate` changes per second
+    """
+    seq = 0
+    while not stop.is_set():
+        name = f"churn-{seq // 2 % 100}"
+        if seq % 2:
+            sch.delete_fn(name)
+        else:
+            sch.register_fn(common.Function(name, [f"topic-{seq % fns}", "never"],
+                                            "localhost:8000/api/bench", mock=True))
+        seq += 1
+        time.sleep(1 / rate)
+
+
+def poll(sch: Scheduler, stop: Event, rate: float):
+    while not stop.is_set():
+        sch.status_view.current()
+        sch.status_sch()
+        time.sleep(1 / rate)
+
+
+def run(args: argparse.Namespace, churn_rate: float, poll_rate: float) -> dict:
+    dispatcher = LatencyQueue()
+    with tempfile.TemporaryDirectory() as base_path:
+        sch = Scheduler(dispatcher=dispatcher, base_path=base_path)
+        sch.register_fns([common.Function(f"fn-{idx}", [f"topic-{idx}"],
+                                          "localhost:8000/api/bench", mock=True)
+                          for idx in range(args.functions)])
+        sch.wait_loop()
+        stop = Event()
+        threads = []
+        if churn_rate:
+            threads.append(Thread(target=churn, args=(sch, stop, churn_rate, args.functions)))
+        if poll_rate:
+            threads.append(Thread(target=poll, args=(sch, stop, poll_rate)))
+        for thr in threads:
+            thr.start()
+
+        evt_loop = sch.return_event_loop()
+        for idx in range(args.events):
+            evt_loop.put(common.Event(f"topic-{idx % args.functions}"))
+            time.sleep(1 / args.rate)
+        while len(dispatcher.latencies) < args.events and evt_loop.qsize():
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+        stop.set()
+        for thr in threads:
+            thr.join()
+        sch.close()
+
+    latencies = sorted(dispatcher.latencies)
+    return {
+        "events": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "max_ms": latencies[-1],
+    }
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--functions", type=int, default=10_000, help="number of registered functions")
+    parser.add_argument("--events", type=int, default=5_000, help="events sent per scenario")
+    parser.add_argument("--rate", type=float, default=2_000, help="events sent per second")
+    parser.add_argument("--churn", type=float, default=500,
+                        help="registrations and deletions per second")
+    parser.add_argument("--poll", type=float, default=100, help="status reads per second")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    for name, churn_rate, poll_rate in (("idle", 0, 0), ("churn", args.churn, 0),
+                                        ("polling", 0, args.poll),
+                                        ("churn+polling", args.churn, args.poll)):
+        res = run(args, churn_rate, poll_rate)
+        print(f"{name:>14}: p50 {res['p50_ms']:.3f} ms, p99 {res['p99_ms']:.3f} ms, "
+              f"max {res['max_ms']:.3f} ms over {res['events']} events")
@@ -0,0 +1,88 @@
+"""
+Measures the dispatcher throughput against local stub servers answering
+after a fixed latency, for an increasing number of dispatcher workers.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.dispatch
+"""
+import time
+
+from threading import Thread, Lock, Event
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import common
+from dispatcher import Dispatcher
+
+HOSTS = 4
+LATENCY = 0.02
+INVOCATIONS = 800
+WORKERS = [1, 4, 16, 64]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.hit()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super(StubServer, self).__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = Lock()
+        self.hits = 0
+        self.target = 0
+        self.done = Event()
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+            if self.hits >= self.target:
+                self.done.set()
+
+
+def run(servers, workers: int) -> float:
+    dispatcher = Dispatcher(workers=workers, per_host=workers)
+    dispatcher.wait_loop()
+    per_server = INVOCATIONS // len(servers)
+    for srv in servers:
+        srv.hits, srv.target = 0, per_server
+        srv.done.clear()
+
+    start = time.perf_counter()
+    for idx in range(INVOCATIONS):
+        srv = servers[idx % len(servers)]
+        url = f"127.0.0.1:{srv.server_port}/api/bench"
+        dispatcher.event_loop.put(common.Invocation(
+            url, "POST", False, json={"bench": {"data": idx}}))
+    for srv in servers:
+        srv.done.wait()
+    elapsed = time.perf_counter() - start
+
+    for _ in range(workers):
+        dispatcher.event_loop.put(None)
+    return INVOCATIONS / elapsed
+
+
+if __name__ == "__main__":
+    servers = [StubServer() for _ in range(HOSTS)]
+    for srv in servers:
+        Thread(target=srv.serve_forever, daemon=True).start()
+
+    print(f"{HOSTS} hosts, {LATENCY * 1000:.0f} ms latency per request")
+    for workers in WORKERS:
+        print(f"{workers:>4} workers: {run(servers, workers):>10,.0f} invocations/s")
+
+    for srv in servers:
+        srv.shutdown()
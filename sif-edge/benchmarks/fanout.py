@@ -0,0 +1,63 @@
+"""
+Measures the CPU time spent per event, from routing it to building the
+request bodies of its invocations, when one event feeds 1, 10 or 100
+functions.
+
+Bodies are either spliced from the encoding of every event, as sent by the
+dispatcher, or encoded anew for every invocation from its payload, as
+sending with ``json=`` did. Sending the requests themselves is left out, so
+that the difference is not hidden behind the network.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.fanout --fields 50
+"""
+import sys
+import time
+import argparse
+import tempfile
+
+from queue import Queue
+
+import common
+from common.base import encode_json
+from scheduler import Scheduler
+
+FAN_OUTS = [1, 10, 100]
+
+
+def run(fan_out: int, args: argparse.Namespace, splice: bool) -> float:
+    dispatcher = Queue()
+    with tempfile.TemporaryDirectory() as base_path:
+        sch = Scheduler(dispatcher=dispatcher, base_path=base_path)
+        sch.register_fns([common.Function(f"fn-{idx}", ["readings"], "localhost:8000/api/bench",
+                                           method="POST") for idx in range(fan_out)])
+        data = {f"sensor-{idx}": {"value": idx * 0.5, "unit": "celsius", "ok": True}
+                for idx in range(args.fields)}
+        events = [common.Event("readings", dict(data, seq=idx)) for idx in range(args.events)]
+
+        start = time.process_time()
+        for evt in events:
+            sch.route_event(evt)
+            while not dispatcher.empty():
+                inv = dispatcher.get()
+                inv.body() if splice else encode_json(inv.payload())
+        elapsed = time.process_time() - start
+        sch.close()
+    return elapsed / args.events * 1e6
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=2_000, help="events sent per fan-out")
+    parser.add_argument("--fields", type=int, default=50, help="readings in the data of every event")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    for fan_out in FAN_OUTS:
+        encoded = run(fan_out, args, splice=False)
+        spliced = run(fan_out, args, splice=True)
+        print(f"fan-out {fan_out:>3}: encoded per invocation {encoded:.1f} us, "
+              f"spliced {spliced:.1f} us of CPU per event")
@@ -0,0 +1,55 @@
+"""
+Compares the ingestion rate of the single event endpoint against the bulk
+endpoint, both as a JSON array and as a NDJSON stream.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.ingest
+"""
+import os
+import json
+import time
+import tempfile
+
+EVENTS = 5_000
+BATCH = 500
+
+os.environ.setdefault("SCH_DATA_PATH", tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+
+def events(count: int):
+    return [{"name": "BenchEvent", "data": {"seq": idx, "value": idx * 0.5}}
+            for idx in range(count)]
+
+
+def single(client: TestClient) -> float:
+    start = time.perf_counter()
+    for evt in events(EVENTS):
+        client.post("/api/event", json=evt)
+    return EVENTS / (time.perf_counter() - start)
+
+
+def array(client: TestClient) -> float:
+    start = time.perf_counter()
+    for _ in range(EVENTS // BATCH):
+        client.post("/api/events", json=events(BATCH))
+    return EVENTS / (time.perf_counter() - start)
+
+
+def ndjson(client: TestClient) -> float:
+    start = time.perf_counter()
+    for _ in range(EVENTS // BATCH):
+        body = "\n".join(json.dumps(evt) for evt in events(BATCH))
+        client.post("/api/events", content=body,
+                    headers={"Content-Type": "application/x-ndjson"})
+    return EVENTS / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    client = TestClient(main.app)
+    for name, bench in [("single", single), ("array", array), ("ndjson", ndjson)]:
+        print(f"{name:>7}: {bench(client):>10,.0f} events/s")
@@ -0,0 +1,257 @@
+"""
+Drives sif-edge at configurable event rates and reports the throughput and
+the event to handler latency of the whole ``/api/event`` -> scheduler ->
+dispatcher pipeline.
+
+sif-edge is started in-process behind uvicorn, with `functions` functions
+spread over `topics` topics, each one pointing at one of the local stub
+receivers. Every event carries the time it was sent, which the receivers
+subtract from the time the invocation arrives. The results are written as
+JSON, to compare them between releases.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.load --functions 100 --topics 10 --rates 100 500 1000
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+os.environ.setdefault("SCH_DATA_PATH", tempfile.mkdtemp())
+
+import uvicorn  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        received = time.time_ns()
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        sent = [vals["data"]["sent_ns"] for vals in json.loads(body).values()]
+        self.server.record(received - max(sent))
+
+    def log_message(self, *args):
+        pass
+
+
+class StubReceiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super(StubReceiver, self).__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = Lock()
+        self.latencies = []
+
+    def record(self, latency: int):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def drain(self) -> list:
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server() -> tuple:
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        main.app, host="127.0.0.1", port=port, log_level="warning"))
+    Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def register(http: urllib3.PoolManager, base: str, receivers: list,
+             functions: int, topics: int):
+    for idx in range(functions):
+        rcv = receivers[idx % len(receivers)]
+        res = http.request("POST", f"{base}/api/function", json={
+            "name": f"bench-{idx}",
+            "subs": [f"BenchEvent{idx % topics}"],
+            "url": f"127.0.0.1:{rcv.server_port}/api/bench",
+            "method": "POST",
+        })
+        if res.status != 200:
+            raise RuntimeError(f"failure to register bench-{idx}: {res.status}")
+
+
+def percentile(values: list, pct: float) -> float | None:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct))] / 1e6
+
+
+def generate(http: urllib3.PoolManager, base: str, fanout: list, rate: float,
+             duration: float, offset: int, stride: int, counters: dict, lock: Lock):
+    # Open loop: the events are sent on schedule, whatever the answers take,
+    # and a generator running late catches up without waiting
+    interval = stride / rate
+    start = time.perf_counter()
+    topics = len(fanout)
+    sent = accepted = rejected = expected = 0
+    seq = offset
+    while True:
+        due = start + (seq - offset) / stride * interval
+        if due - start >= duration:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        res = http.request("POST", f"{base}/api/event", json={
+            "name": f"BenchEvent{seq % topics}",
+            "data": {"seq": seq, "sent_ns": time.time_ns()},
+        })
+        sent += 1
+        if res.status == 200:
+            accepted += 1
+            expected += fanout[seq % topics]
+        else:
+            rejected += 1
+        seq += stride
+    with lock:
+        counters["sent"] += sent
+        counters["accepted"] += accepted
+        counters["rejected"] += rejected
+        counters["expected"] += expected
+
+
+def run(base: str, receivers: list, functions: int, topics: int, rate: float,
+        duration: float, generators: int, drain: float) -> dict:
+    for rcv in receivers:
+        rcv.drain()
+    # Functions subscribe to one topic each, hence every accepted event is
+    # expected to reach the functions of its topic
+    fanout = [len(range(topic, functions, topics)) for topic in range(topics)]
+    counters = {"sent": 0, "accepted": 0, "rejected": 0, "expected": 0}
+    lock = Lock()
+    threads = []
+    start = time.perf_counter()
+    for idx in range(generators):
+        http = urllib3.PoolManager(maxsize=1)
+        thr = Thread(target=generate, args=(http, base, fanout, rate, duration,
+                                            idx, generators, counters, lock))
+        thr.start()
+        threads.append(thr)
+    for thr in threads:
+        thr.join()
+    send_time = time.perf_counter() - start
+
+    expected = counters["expected"]
+    latencies = []
+    deadline = time.perf_counter() + drain
+    while time.perf_counter() < deadline:
+        for rcv in receivers:
+            latencies.extend(rcv.drain())
+        if len(latencies) >= expected:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rate": rate,
+        "duration_s": duration,
+        "events_sent": counters["sent"],
+        "events_accepted": counters["accepted"],
+        "events_rejected": counters["rejected"],
+        "send_rate": counters["sent"] / send_time,
+        "invocations_expected": expected,
+        "invocations_received": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": percentile(latencies, 1.0),
+        },
+    }
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--functions", type=int, default=100,
+                        help="number of registered functions")
+    parser.add_argument("--topics", type=int, default=10,
+                        help="number of topics the functions are spread over")
+    parser.add_argument("--receivers", type=int, default=4,
+                        help="number of stub receivers the functions point at")
+    parser.add_argument("--rates", type=float, nargs="+", default=[100, 500, 1000],
+                        help="event rates to drive, in events per second")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds each rate is driven for")
+    parser.add_argument("--generators", type=int, default=8,
+                        help="number of concurrent event senders")
+    parser.add_argument("--drain", type=float, default=30,
+                        help="seconds to wait for outstanding invocations")
+    parser.add_argument("--output", default="-",
+                        help="file receiving the JSON results, standard output by default")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # Imported here, as shard processes of the scheduler, see
+    # SIF_SCHEDULER_SHARDS, import the main module again
+    import main
+
+    args = parse_args(sys.argv[1:])
+
+    receivers = [StubReceiver() for _ in range(args.receivers)]
+    for rcv in receivers:
+        Thread(target=rcv.serve_forever, daemon=True).start()
+    server, base = start_server()
+    register(urllib3.PoolManager(), base, receivers, args.functions, args.topics)
+
+    results = []
+    for rate in args.rates:
+        results.append(run(base, receivers, args.functions, args.topics, rate,
+                           args.duration, args.generators, args.drain))
+        print(f"{rate:>8,.0f} events/s: {results[-1]['throughput']:>10,.0f} invocations/s"
+              f"  p50 {results[-1]['latency_ms']['p50']} ms"
+              f"  p99 {results[-1]['latency_ms']['p99']} ms", file=sys.stderr)
+
+    report = {
+        "benchmark": "load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "dispatcher_workers": main.dispatcher.workers,
+            "queue_kind": os.environ.get("SIF_QUEUE_KIND", "local"),
+            "scheduler_shards": int(os.environ.get("SIF_SCHEDULER_SHARDS", 1)),
+        },
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+
+    server.should_exit = True
+    for rcv in receivers:
+        rcv.shutdown()
+    main.sch.close()
@@ -0,0 +1,64 @@
+"""
+Measures the memory held per buffered event and the memory allocated while
+routing one event to a function, including the invocation it generates.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.memory
+"""
+import gc
+import sys
+import tracemalloc
+
+import common
+
+EVENTS = 50_000
+
+
+def buffered() -> tuple:
+    """
+    Bytes and blocks retained per event waiting in a join buffer
+    """
+    fn = common.Function("bench", ["BenchEvent", "never"], "localhost:8000/api/bench", mock=True)
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    before, _ = tracemalloc.get_traced_memory()
+    for idx in range(EVENTS):
+        fn.update_event(common.Event("BenchEvent", data={"seq": idx}))
+    after, _ = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    return (after - before) / EVENTS, blocks / EVENTS
+
+
+def routed() -> float:
+    """
+    Peak bytes allocated to route one event into an invocation
+    """
+    fn = common.Function("bench", ["BenchEvent"], "localhost:8000/api/bench", mock=True)
+    for idx in range(100):
+        fn.update_event(common.Event("BenchEvent", data={"seq": idx}))
+        fn.generate_invocation()
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    peak = 0
+    for idx in range(1000):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        evt = common.Event("BenchEvent", data={"seq": idx})
+        if fn.update_event(evt):
+            inv = fn.generate_invocation()
+        _, top = tracemalloc.get_traced_memory()
+        peak += top - start
+        del evt, inv
+    tracemalloc.stop()
+    gc.enable()
+    return peak / 1000
+
+
+if __name__ == "__main__":
+    size, blocks = buffered()
+    print(f"buffered event: {size:>8.1f} bytes  {blocks:>6.1f} blocks")
+    print(f"routed event:   {routed():>8.1f} bytes at peak")
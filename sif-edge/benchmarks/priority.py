@@ -0,0 +1,158 @@
+"""
+Measures the latency of emergency notifications while bulk invocations,
+such as model training calls, saturate the dispatcher, with FIFO queues
+against priority lanes and a reserved dispatcher worker.
+
+Bulk events are sent faster than the dispatcher workers can answer them,
+so invocations pile up. Critical emergency events are sent at a low rate
+in between. In the saturated scenarios every bulk event is also buffered
+by many functions waiting for a topic that never comes, so that routing
+falls behind and events pile up in the scheduler queue as well. The latency of an emergency runs from the creation of its event
+to the notification reaching the stub server of the function. Every
+scenario runs in its own process, so the backlog left by one does not slow
+down the next.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.priority --seconds 5
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+from threading import Thread, Lock
+from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import common
+from common import Priority
+from dispatcher import Dispatcher
+from scheduler import Scheduler
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        (evt,) = body.values()
+        self.server.hit(evt["data"]["sent"])
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        super(StubServer, self).__init__(("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.lock = Lock()
+        self.latencies: List[float] = []
+
+    def hit(self, sent: float):
+        with self.lock:
+            self.latencies.append((time.perf_counter() - sent) * 1000)
+
+
+def emit(evt_loop, name: str, priority: Priority, rate: float, seconds: float, sent: List[int]):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        evt_loop.put(common.Event(name, {"sent": time.perf_counter()}, priority=priority))
+        sent[0] += 1
+        time.sleep(1 / rate)
+
+
+def run(args: argparse.Namespace, kind: str, reserved: int, fanout: int) -> dict:
+    bulk, emergency = StubServer(args.bulk_latency), StubServer(args.emergency_latency)
+    for srv in (bulk, emergency):
+        Thread(target=srv.serve_forever, daemon=True).start()
+
+    dispatcher = Dispatcher(workers=args.workers, per_host=args.workers, queue_kind=kind,
+                            queue_max_wait=args.max_wait, reserved=reserved)
+    dispatcher.wait_loop()
+    with tempfile.TemporaryDirectory() as base_path:
+        sch = Scheduler(dispatcher=dispatcher.return_event_loop(), base_path=base_path,
+                        queue_kind=kind, queue_max_wait=args.max_wait)
+        sch.register_fns([
+            common.Function("create_model_from_influx", ["TrainOccupancyModelEvent"],
+                            f"127.0.0.1:{bulk.server_port}/api/train", method="POST",
+                            priority=Priority.LOW),
+            common.Function("emergency_notification_function", ["EmergencyEvent"],
+                            f"127.0.0.1:{emergency.server_port}/api/notify", method="POST",
+                            priority=Priority.CRITICAL)])
+        sch.register_fns([
+            common.Function(f"join_training_{idx}", ["TrainOccupancyModelEvent", "TrainingDatasetEvent"],
+                            "127.0.0.1/api/train", mock=True, priority=Priority.LOW,
+                            window=common.Window(policy="keep-latest"))
+            for idx in range(fanout)])
+        sch.wait_loop()
+        evt_loop = sch.return_event_loop()
+
+        sent = [0]
+        threads = [Thread(target=emit, args=(evt_loop, "TrainOccupancyModelEvent", Priority.LOW,
+                                             args.bulk_rate, args.seconds, [0])),
+                   Thread(target=emit, args=(evt_loop, "EmergencyEvent", Priority.CRITICAL,
+                                             args.emergency_rate, args.seconds, sent))]
+        for thr in threads:
+            thr.start()
+        for thr in threads:
+            thr.join()
+        backlog = evt_loop.qsize()
+        # Emergencies still queued behind the backlog are waited for
+        time.sleep(args.drain)
+        sch.close()
+
+    latencies = sorted(emergency.latencies)
+    return {
+        "delivered": len(latencies), "sent": sent[0],
+        "p50_ms": statistics.median(latencies) if latencies else float("nan"),
+        "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else float("nan"),
+        "max_ms": latencies[-1] if latencies else float("nan"),
+        "bulk": len(bulk.latencies), "backlog": backlog,
+    }
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seconds", type=float, default=5, help="duration of the load")
+    parser.add_argument("--workers", type=int, default=8, help="dispatcher workers")
+    parser.add_argument("--bulk-rate", type=float, default=400, help="bulk events per second")
+    parser.add_argument("--bulk-latency", type=float, default=0.05, help="seconds to answer a bulk invocation")
+    parser.add_argument("--emergency-rate", type=float, default=10, help="emergency events per second")
+    parser.add_argument("--emergency-latency", type=float, default=0.001,
+                        help="seconds to answer an emergency notification")
+    parser.add_argument("--max-wait", type=float, default=1.0,
+                        help="seconds after which a bulk invocation is served regardless of its priority")
+    parser.add_argument("--fanout", type=int, default=4000,
+                        help="functions buffering every bulk event in the saturated scenarios")
+    parser.add_argument("--drain", type=float, default=2.0,
+                        help="seconds to wait for late emergencies once the load stops")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    print(f"{args.workers} workers answering bulk invocations in {args.bulk_latency * 1000:.0f} ms, "
+          f"{args.bulk_rate:.0f} bulk and {args.emergency_rate:.0f} emergency events per second")
+    ctx = multiprocessing.get_context("spawn")
+    for name, kind, reserved, fanout in (
+            ("fifo", "local", 0, 0),
+            ("priority lanes", "priority", 0, 0),
+            ("+ reserved", "priority", 1, 0),
+            ("saturated fifo", "local", 0, args.fanout),
+            ("saturated lanes", "priority", 1, args.fanout)):
+        with ctx.Pool(1) as pool:
+            res = pool.apply(run, (args, kind, reserved, fanout))
+        print(f"{name:>15}: emergency p50 {res['p50_ms']:.1f} ms, p99 {res['p99_ms']:.1f} ms, "
+              f"max {res['max_ms']:.1f} ms, {res['delivered']}/{res['sent']} delivered, "
+              f"{res['bulk']} bulk invocations served, {res['backlog']} events left in the scheduler queue")
@@ -0,0 +1,50 @@
+"""
+Measures the enqueue to dequeue latency of one event between two threads
+for every queue kind. The producer waits for every event to be consumed
+before sending the next one, so the figures exclude queueing delay.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.queues
+"""
+import time
+import statistics
+
+from threading import Thread, Event
+
+import common
+from common.queues import QUEUES, create_queue
+
+EVENTS = 5_000
+
+
+def run(kind: str):
+    q = create_queue(kind, 1024)
+    latencies = []
+    consumed = Event()
+
+    def consume():
+        for _ in range(EVENTS):
+            sent, _ = q.get(True)
+            latencies.append(time.perf_counter_ns() - sent)
+            consumed.set()
+
+    consumer = Thread(target=consume)
+    consumer.start()
+    for idx in range(EVENTS):
+        evt = common.Event("BenchEvent", data={"seq": idx})
+        consumed.clear()
+        q.put((time.perf_counter_ns(), evt), True)
+        consumed.wait()
+    consumer.join()
+
+    latencies.sort()
+    return (statistics.mean(latencies) / 1000,
+            latencies[len(latencies) // 2] / 1000,
+            latencies[int(len(latencies) * 0.99)] / 1000)
+
+
+if __name__ == "__main__":
+    for kind in QUEUES:
+        mean, p50, p99 = run(kind)
+        print(f"{kind:>8}: mean {mean:>8.1f} us  p50 {p50:>8.1f} us  p99 {p99:>8.1f} us")
@@ -0,0 +1,52 @@
+"""
+Measures how many events per second the scheduler routes depending on the
+number of registered functions.
+
+Every function subscribes to its own topic plus a topic that never fires, so
+events are buffered but no invocation (and therefore no checkpoint write) is
+generated. This isolates the cost of finding the subscribers of an event.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.routing
+"""
+import os
+import tempfile
+import time
+
+from queue import Queue
+
+import common
+from scheduler import Scheduler, checkpoint
+
+SIZES = [10, 1_000, 10_000]
+EVENTS = 20_000
+
+
+def build_scheduler(base_path: str, n_fns: int) -> Scheduler:
+    fns = [common.Function(f"fn-{idx}", [f"topic-{idx}", "never"],
+                           "localhost:8000/api/bench", mock=True)
+           for idx in range(n_fns)]
+    # Registering through the checkpoint keeps setup linear for large sizes
+    with open(os.path.join(base_path, "scheduler.chk"), "wb") as chk:
+        chk.write(checkpoint.dumps(fns))
+    return Scheduler(dispatcher=Queue(), base_path=base_path)
+
+
+def run(n_fns: int) -> float:
+    with tempfile.TemporaryDirectory() as base_path:
+        sch = build_scheduler(base_path, n_fns)
+        events = [common.Event(f"topic-{idx % n_fns}")
+                  for idx in range(EVENTS)]
+
+        start = time.perf_counter()
+        for evt in events:
+            sch.route_event(evt)
+        elapsed = time.perf_counter() - start
+        sch.close()
+    return EVENTS / elapsed
+
+
+if __name__ == "__main__":
+    for size in SIZES:
+        print(f"{size:>6} functions: {run(size):>12,.0f} events/s")
@@ -0,0 +1,82 @@
+"""
+Measures how long the scheduler takes to restore its functions on start,
+from the binary checkpoint and from a checkpoint pickled by earlier
+releases, which is migrated on the way.
+
+Half of the functions join two topics and hold a buffered event, a third of
+them have a bounded window and some are rate limited, so that the
+checkpoint covers every field of a function.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.startup --functions 100000
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+
+from queue import Queue
+from typing import List
+
+import common
+from scheduler import Scheduler, checkpoint
+
+
+def build_functions(n_fns: int) -> List[common.Function]:
+    fns = []
+    for idx in range(n_fns):
+        subs = [f"topic-{idx}"] + (["shared"] if idx % 2 else [])
+        fn = common.Function(
+            f"fn-{idx}", subs, "localhost:8000/api/bench", mock=True,
+            window=common.Window(max_events=10) if idx % 3 == 0 else None,
+            rate_limit=common.RateLimit(rate=5, burst=10) if idx % 7 == 0 else None)
+        if idx % 2:
+            fn.update_event(common.Event(f"topic-{idx}", data={"seq": idx, "value": idx / 10}))
+        fns.append(fn)
+    return fns
+
+
+def restore(base_path: str) -> float:
+    start = time.perf_counter()
+    sch = Scheduler(dispatcher=Queue(), base_path=base_path)
+    elapsed = time.perf_counter() - start
+    sch.close()
+    return elapsed
+
+
+def run(fns: List[common.Function], legacy: bool) -> dict:
+    with tempfile.TemporaryDirectory() as base_path:
+        if legacy:
+            data = pickle.dumps(fns)
+            path = os.path.join(base_path, "scheduler.pkl")
+        else:
+            data = checkpoint.dumps(fns)
+            path = os.path.join(base_path, "scheduler.chk")
+        with open(path, "wb") as chk:
+            chk.write(data)
+        start = time.perf_counter()
+        loaded = pickle.loads(data) if legacy else checkpoint.loads(data)
+        decode = time.perf_counter() - start
+        del loaded
+        startup = restore(base_path)
+        # A migrated checkpoint starts as fast as a binary one from then on
+        restart = restore(base_path)
+    return {"bytes": len(data), "decode_s": decode, "startup_s": startup, "restart_s": restart}
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--functions", type=int, default=100_000, help="number of functions")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    fns = build_functions(args.functions)
+    for name, legacy in (("binary", False), ("pickle", True)):
+        res = run(fns, legacy)
+        print(f"{name:>6}: {res['bytes'] / 1e6:>7.1f} MB, decode {res['decode_s']:.3f}s, "
+              f"startup {res['startup_s']:.3f}s, restart {res['restart_s']:.3f}s")
@@ -0,0 +1,59 @@
+"""
+Measures the cost of finding the patterns matching the topic of an event,
+with a trie against matching every pattern in turn, depending on the number
+of patterns.
+
+Patterns look like `site-N.*.motion` or `site-N.room-M.#`, so that every
+topic matches a couple of them while sharing its first level with none of
+the others, as in a deployment spanning many sites.
+
+Run from the ``sif-edge`` directory::
+
+    python -m benchmarks.topics
+"""
+import sys
+import time
+import argparse
+
+from typing import List
+
+from common.topics import TopicTrie, matches
+
+SIZES = [10, 1_000, 10_000]
+
+
+def build_patterns(n_patterns: int) -> List[str]:
+    return [f"site-{idx // 2}.*.motion" if idx % 2 else f"site-{idx // 2}.room-{idx % 7}.#"
+            for idx in range(n_patterns)]
+
+
+def run(n_patterns: int, n_lookups: int) -> dict:
+    patterns = build_patterns(n_patterns)
+    trie = TopicTrie().update({pattern: [pattern] for pattern in patterns})
+    topics = [f"site-{idx % max(n_patterns // 2, 1)}.room-{idx % 7}.motion" for idx in range(n_lookups)]
+
+    start = time.perf_counter()
+    trie_matched = sum(len(trie.match(topic)) for topic in topics)
+    trie_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scan_matched = sum(sum(1 for pattern in patterns if matches(pattern, topic)) for topic in topics)
+    scan_s = time.perf_counter() - start
+
+    assert trie_matched == scan_matched
+    return {"trie_us": trie_s / n_lookups * 1e6, "scan_us": scan_s / n_lookups * 1e6,
+            "matched": trie_matched / n_lookups}
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lookups", type=int, default=2_000, help="topics looked up per size")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    for size in SIZES:
+        res = run(size, args.lookups)
+        print(f"{size:>6} patterns: trie {res['trie_us']:.2f} us, linear scan {res['scan_us']:.2f} us "
+              f"per lookup, {res['matched']:.1f} matches")
@@ -0,0 +1,4 @@
+from .ring import HashRing
+from .node import ClusterNode
+
+__all__ = ["HashRing", "ClusterNode"]
@@ -0,0 +1,408 @@
+import os
+import json
+import time
+import urllib3
+import logging
+
+from queue import Full
+from threading import Thread, Lock, Condition
+from typing import Any, Callable, Dict, List, Set
+
+import common
+
+from common import BaseFunction, ClusterEvent, FunctionEntry, Handoff
+from common.queues import LocalQueue
+from common.topics import TopicTrie, is_pattern
+from common.trace import Trace
+
+from .ring import HashRing
+
+logger = logging.getLogger("uvicorn.error")
+
+# Forwarded events are forwarded again at most once, in case the replicas
+# disagree on the members of the cluster
+MAX_HOPS = 2
+
+
+def anchor(subs: List[str]) -> str:
+    """
+    Topic deciding where a function lives, so that every replica agrees on
+    it regardless of the order of the subscriptions
+    """
+    return min(subs)
+
+
+def build_fn(spec: BaseFunction) -> common.Function:
+    return common.Function(spec.name, spec.subs, spec.url, spec.mock, spec.method,
+                           spec.window, spec.coalesce, spec.rate_limit, spec.filters, spec.priority)
+
+
+class ClusterNode(object):
+    """
+    Member of a cluster of sif-edge replicas sharing the functions.
+
+    Topics are partitioned over the live replicas by a :class:`HashRing <ring.HashRing>`
+    and every function lives on the owner of its anchor topic, the smallest
+    of its subscriptions, so that the whole join of a function happens on one
+    replica. An event received by any replica is handed to the local
+    scheduler if it hosts subscribers of the topic, and forwarded to the
+    other replicas hosting subscribers.
+
+    Every replica keeps the directory of all functions, replicated by
+    broadcasting registrations and deletions, last writer wins, and by
+    pulling the directory of every replica joining the cluster. The
+    directory is persisted under `base_path`.
+
+    Replicas probe each other every `heartbeat` seconds and a peer missing
+    `failures` probes in a row leaves the cluster. Upon any change, the
+    functions are rebalanced: a replica hands the functions it no longer
+    owns, with their buffered events, over to their new owner, and creates
+    the functions it now owns whose owner left, without their events.
+    During a rebalancing, events may be delivered twice.
+
+    :param url: URL the peers reach this replica at
+    :param peers: URLs of the other replicas
+    :param scheduler: local scheduler, hosting the functions owned by this replica
+    :param submit: hands an event to the local scheduler
+    :param base_path: directory holding the function directory
+    :param heartbeat: seconds between two probes of the peers
+    :param failures: number of missed probes before a peer is deemed gone
+    :param vnodes: number of points of every replica on the ring
+    :param forwarders: number of threads forwarding events and updates
+    :param forward_queue: maximum number of messages waiting to be forwarded
+    """
+
+    def __init__(self, url: str, peers: List[str], scheduler: Any,
+                 submit: Callable[..., None], base_path: str = "/data",
+                 heartbeat: float = 1.0, failures: int = 3, vnodes: int = 64,
+                 forwarders: int = 4, forward_queue: int = 10000):
+        super(ClusterNode, self).__init__()
+        self.url = url.rstrip("/")
+        self.peers = [peer.rstrip("/") for peer in peers if peer.rstrip("/") != self.url]
+        self.sch = scheduler
+        self.submit = submit
+        self.path = os.path.join(base_path, "cluster.json")
+        self.heartbeat = heartbeat
+        self.failures = failures
+        self.vnodes = vnodes
+
+        self.lock = Lock()
+        # Guards the local functions, never held while waiting for a peer
+        self.local_lock = Lock()
+        self.misses: Dict[str, int] = {peer: failures for peer in self.peers}
+        self.alive: Set[str] = {self.url}
+        self.ring = HashRing(self.alive, vnodes)
+        self.directory: Dict[str, FunctionEntry] = self.__load()
+        self.routes: Dict[str, Set[str]] = {}
+        self.patterns = TopicTrie()
+        # Functions hosted by the local scheduler, with the version of their entry
+        self.local: Dict[str, int] = {
+            name: self.directory[name].version if name in self.directory else 0
+            for name in scheduler.function_names()}
+        self.__reroute()
+
+        self.http = urllib3.PoolManager(maxsize=forwarders)
+        self.timeout = urllib3.Timeout(total=max(heartbeat, 1.0))
+        self.outbox = LocalQueue(forward_queue)
+        self.dirty = Condition()
+        self.pending = False
+        for _ in range(forwarders):
+            Thread(target=self._forward_loop, daemon=True).start()
+        Thread(target=self._heartbeat_loop, daemon=True).start()
+        Thread(target=self._reconcile_loop, daemon=True).start()
+
+    def __load(self) -> Dict[str, FunctionEntry]:
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path) as chk:
+            return {entry["name"]: FunctionEntry.model_validate(entry) for entry in json.load(chk)}
+
+    def __persist(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as chk:
+            json.dump([entry.model_dump(mode="json") for entry in self.directory.values()], chk)
+            chk.flush()
+            os.fsync(chk.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __reroute(self):
+        routes: Dict[str, Set[str]] = {}
+        patterns: Dict[str, Set[str]] = {}
+        for entry in self.directory.values():
+            if entry.function is None:
+                continue
+            home = self.ring.owner(anchor(entry.function.subs))
+            for topic in entry.function.subs:
+                (patterns if is_pattern(topic) else routes).setdefault(topic, set()).add(home)
+        self.patterns = TopicTrie().update(patterns)
+        self.routes = routes
+
+    def __schedule(self):
+        with self.dirty:
+            self.pending = True
+            self.dirty.notify()
+
+    def status(self) -> Dict[str, Any]:
+        return {"url": self.url, "members": sorted(self.alive),
+                "functions": sorted(self.local),
+                "directory": sum(1 for entry in self.directory.values() if entry.function)}
+
+    def list_directory(self) -> List[Dict[str, Any]]:
+        return [entry.model_dump(mode="json") for entry in self.directory.values()]
+
+    # Events
+
+    def route(self, topic: str) -> Set[str]:
+        """
+        Replicas hosting functions subscribed to the topic, or to a pattern
+        matching it
+        """
+        homes = self.routes.get(topic, set())
+        if self.patterns:
+            homes = homes.union(self.patterns.match(topic))
+        return homes
+
+    def handle_event(self, evt: common.Event, hops: int = 0, block: bool = True):
+        """
+        Hands the event to the local scheduler and forwards it to the other
+        replicas hosting subscribers of its topic
+
+        :raises Full: the local scheduler is full and `block` is false
+        """
+        targets = self.route(evt.name)
+        if self.url in targets:
+            self.submit(evt, block)
+            if hops:
+                # The sender forwarded it to the other replicas as well
+                return
+        if hops >= MAX_HOPS:
+            logger.warning(f"Dropping event {evt.name} forwarded {hops} times")
+            return
+        body = ClusterEvent(name=evt.name, data=evt.data, created_ns=evt.created_ns,
+                            hops=hops + 1, priority=evt.priority).model_dump(mode="json")
+        headers = evt.trace.headers() if evt.trace is not None else None
+        for target in targets:
+            if target != self.url:
+                self.__send("POST", f"{target}/api/cluster/event", body, headers)
+
+    def receive_event(self, msg: ClusterEvent, trace: Trace | None = None):
+        evt = common.Event(msg.name, data=msg.data, trace=trace, priority=msg.priority)
+        if msg.created_ns is not None:
+            evt.created_ns = msg.created_ns
+        self.handle_event(evt, msg.hops)
+
+    # Directory
+
+    def register(self, spec: BaseFunction):
+        self.__publish(FunctionEntry(name=spec.name, version=time.time_ns(), function=spec))
+
+    def register_many(self, specs: List[BaseFunction]):
+        """
+        Registers the functions with a single change of the directory and a
+        single message to every peer
+        """
+        version = time.time_ns()
+        entries = [FunctionEntry(name=spec.name, version=version, function=spec) for spec in specs]
+        self.merge(entries)
+        body = [entry.model_dump(mode="json") for entry in entries]
+        for peer in sorted(self.alive):
+            if peer != self.url:
+                self.__send("POST", f"{peer}/api/cluster/functions", body)
+
+    def delete(self, name: str):
+        self.__publish(FunctionEntry(name=name, version=time.time_ns()))
+
+    def __publish(self, entry: FunctionEntry):
+        self.apply(entry)
+        body = entry.model_dump(mode="json")
+        for peer in sorted(self.alive):
+            if peer != self.url:
+                self.__send("POST", f"{peer}/api/cluster/function", body)
+
+    def apply(self, entry: FunctionEntry) -> bool:
+        """
+        Applies a change of the directory, unless a newer one is known
+
+        :returns: whether the directory changed
+        """
+        return self.merge([entry])
+
+    def merge(self, entries: List[FunctionEntry]) -> bool:
+        changed = False
+        with self.lock:
+            for entry in entries:
+                current = self.directory.get(entry.name)
+                if current is None or current.version < entry.version:
+                    self.directory[entry.name] = entry
+                    changed = True
+            if changed:
+                self.__persist()
+                self.__reroute()
+        if changed:
+            self.__schedule()
+        return changed
+
+    # Rebalancing
+
+    def receive_handoff(self, handoff: Handoff):
+        """
+        Takes over a function from another replica, merging its buffered
+        events with those of the local copy, if any
+        """
+        entry = handoff.entry
+        self.apply(entry)
+        with self.lock:
+            current = self.directory[entry.name]
+        if current.version != entry.version or current.function is None:
+            return
+
+        fn = build_fn(current.function)
+        evts = []
+        for msg in handoff.events:
+            evt = common.Event(msg.name, data=msg.data, priority=msg.priority)
+            evt.created_ns = msg.created_ns or evt.created_ns
+            evts.append(evt)
+        with self.local_lock:
+            if entry.name in self.local:
+                existing = self.sch.take_fn(entry.name)
+                if existing is not None:
+                    evts.extend(evt for buf in existing.join.buffers.values() for evt in buf)
+            for evt in sorted(evts, key=lambda evt: evt.created_ns):
+                fn.update_event(evt)
+            self.sch.register_fn(fn)
+            self.local[entry.name] = entry.version
+        logger.info(f"Took over function {entry.name} with {len(evts)} buffered events")
+
+    def __handoff(self, entry: FunctionEntry, home: str) -> bool:
+        with self.local_lock:
+            if entry.name not in self.local:
+                return True
+            fn = self.sch.take_fn(entry.name)
+            self.local.pop(entry.name, None)
+        if fn is None:
+            return True
+        events = [ClusterEvent(name=evt.name, data=evt.data, created_ns=evt.created_ns,
+                               priority=evt.priority)
+                  for buf in fn.join.buffers.values() for evt in buf]
+        body = Handoff(entry=entry, events=events).model_dump(mode="json")
+        try:
+            res = self.http.request("POST", f"{home}/api/cluster/handoff", json=body,
+                                    timeout=self.timeout, retries=urllib3.Retry(2))
+            if res.status < 300:
+                logger.info(f"Handed function {entry.name} over to {home}")
+                return True
+            err = f"{res.status} {res.reason}"
+        except Exception as exc:
+            err = str(exc)
+        logger.error(f"Failure handing function {entry.name} over to {home}: {err}")
+        with self.local_lock:
+            if entry.name not in self.local:
+                self.sch.register_fn(fn)
+                self.local[entry.name] = entry.version
+        return False
+
+    def reconcile(self) -> bool:
+        """
+        Creates, replaces, deletes or hands over the local functions until
+        they match the directory
+
+        :returns: whether every function is where it belongs
+        """
+        with self.lock:
+            entries = list(self.directory.values())
+            ring = self.ring
+        done = True
+        handoffs = []
+        created = []
+        with self.local_lock:
+            for entry in entries:
+                local = self.local.get(entry.name)
+                if entry.function is None:
+                    if local is not None:
+                        self.sch.delete_fn(entry.name)
+                        self.local.pop(entry.name, None)
+                    continue
+                home = ring.owner(anchor(entry.function.subs))
+                if home != self.url:
+                    if local is not None:
+                        handoffs.append((entry, home))
+                elif local != entry.version:
+                    created.append(build_fn(entry.function))
+                    self.local[entry.name] = entry.version
+            if created:
+                self.sch.register_fns(created)
+        for entry, home in handoffs:
+            done = self.__handoff(entry, home) and done
+        return done
+
+    # Background threads
+
+    def __send(self, method: str, url: str, body: Any, headers: Dict[str, str] | None = None):
+        try:
+            self.outbox.put_nowait((method, url, body, headers))
+        except Full:
+            logger.error(f"Dropping message to {url}, the forwarding queue is full")
+
+    def _forward_loop(self):
+        while True:
+            method, url, body, headers = self.outbox.get(True)
+            try:
+                res = self.http.request(method, url, json=body, headers=headers,
+                                        timeout=self.timeout, retries=urllib3.Retry(3, backoff_factor=0.1))
+                if res.status >= 300:
+                    logger.warning(f"Failure forwarding to {url}: {res.status} {res.reason}")
+            except Exception as err:
+                logger.warning(f"Failure forwarding to {url}: {err}")
+
+    def __probe(self, peer: str) -> bool:
+        try:
+            res = self.http.request("GET", f"{peer}/api/cluster/health",
+                                    timeout=self.timeout, retries=False)
+            return res.status == 200
+        except Exception:
+            return False
+
+    def __pull(self, peer: str):
+        try:
+            res = self.http.request("GET", f"{peer}/api/cluster/directory",
+                                    timeout=self.timeout, retries=urllib3.Retry(2))
+            if res.status == 200:
+                self.merge([FunctionEntry.model_validate(entry) for entry in res.json()])
+        except Exception as err:
+            logger.warning(f"Failure pulling the directory of {peer}: {err}")
+
+    def _heartbeat_loop(self):
+        # Functions are only placed once the peers answered the first probes
+        first = True
+        while True:
+            for peer in self.peers:
+                self.misses[peer] = 0 if self.__probe(peer) else self.misses[peer] + 1
+            alive = {self.url} | {peer for peer in self.peers if self.misses[peer] < self.failures}
+            if first:
+                first = False
+                self.__schedule()
+            if alive != self.alive:
+                joined = alive - self.alive
+                logger.info(f"Cluster members changed to {sorted(alive)}")
+                with self.lock:
+                    self.alive = alive
+                    self.ring = HashRing(alive, self.vnodes)
+                    self.__reroute()
+                for peer in joined:
+                    self.__pull(peer)
+                self.__schedule()
+            time.sleep(self.heartbeat)
+
+    def _reconcile_loop(self):
+        while True:
+            with self.dirty:
+                while not self.pending:
+                    self.dirty.wait()
+                self.pending = False
+            try:
+                if not self.reconcile():
+                    # Functions that could not be handed over are tried again
+                    time.sleep(self.heartbeat)
+                    self.__schedule()
+            except Exception as err:
+                logger.error(f"Failure while rebalancing the functions: {err}")
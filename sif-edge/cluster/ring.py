@@ -0,0 +1,36 @@
+import bisect
+import hashlib
+
+from typing import Dict, Iterable, List
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys, i.e., topics, over the replicas of the
+    cluster. Every replica is placed `vnodes` times on the ring, so that
+    a replica joining or leaving only moves about 1/N of the keys.
+
+    :param nodes: replicas of the cluster
+    :param vnodes: number of points of every replica on the ring
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 64):
+        super(HashRing, self).__init__()
+        self.nodes: List[str] = sorted(set(nodes))
+        self.vnodes = vnodes
+        points: Dict[int, str] = {}
+        for node in self.nodes:
+            for idx in range(vnodes):
+                points[HashRing.hash(f"{node}#{idx}")] = node
+        self.points = sorted(points)
+        self.owners = [points[point] for point in self.points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def owner(self, key: str) -> str | None:
+        if not self.points:
+            return None
+        idx = bisect.bisect(self.points, HashRing.hash(key)) % len(self.points)
+        return self.owners[idx]
@@ -1,4 +1,7 @@
-from .base import Invocation, Function, Event, EventRequest, BaseFunction, DeleteFunction
+from .base import Invocation, Function, Event, EventRequest, BaseFunction, DeleteFunction, ReplayRequest, Window, RateLimit, \
+    Condition, ClusterEvent, FunctionEntry, Handoff
+from .priority import Priority
 
 __all__ = ["Invocation", "Function", "Event",
-           "EventRequest", "BaseFunction", "DeleteFunction"]
+           "EventRequest", "BaseFunction", "DeleteFunction", "ReplayRequest", "Window", "RateLimit", "Condition",
+           "ClusterEvent", "FunctionEntry", "Handoff", "Priority"]
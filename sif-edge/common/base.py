@@ -1,71 +1,339 @@
-import pytz
+import json
+import time
 import urllib3
 import logging
 
+from pprint import pformat
+from functools import lru_cache
+
 from abc import ABC
-from typing import Dict, Optional, Any, List
+from typing import Annotated, Dict, Optional, Any, List, Literal
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, BeforeValidator, Field, PositiveInt, field_validator, model_validator
 
+from . import topics
+from .filters import EventFilter, Operator
+from .priority import Priority
+from .join import JoinBuffer, EvictionPolicy
 from .status import EventStatus
+from .trace import Trace
 
 logger = logging.getLogger("uvicorn.error")
 
+# Priority given by name, e.g., `critical`, or by value
+PriorityField = Annotated[Priority, BeforeValidator(Priority.parse)]
+
 class EventRequest(BaseModel):
     name: str
     data: Optional[Dict[Any, Any]] | Optional[Any] = None
+    priority: PriorityField = Priority.NORMAL
 
 
 class DeleteFunction(BaseModel):
     name: str
 
 
+class ReplayRequest(BaseModel):
+    ids: Optional[List[int]] = None
+
+
+class Window(BaseModel):
+    max_events: Optional[int] = Field(None, ge=1)
+    max_age_ms: Optional[int] = Field(None, ge=0)
+    policy: EvictionPolicy = EvictionPolicy.DROP_OLDEST
+
+
+class RateLimit(BaseModel):
+    rate: float = Field(gt=0)
+    burst: int = Field(1, ge=1)
+
+
+class Condition(BaseModel):
+    field: str = ""
+    op: Operator = Operator.EQ
+    value: Any = None
+    topic: Optional[str] = None
+
+    @model_validator(mode="after")
+    def validate_value(self) -> "Condition":
+        if self.op == Operator.IN and not isinstance(self.value, list):
+            raise ValueError("The value of an 'in' condition must be a list")
+        return self
+
+
 class BaseFunction(BaseModel):
     name: str
     subs: List[str]
     url: str
     method: Optional[str] = "GET"
     mock: Optional[bool] = False
+    window: Optional[Window] = None
+    coalesce: Optional[Literal["latest"] | PositiveInt] = None
+    rate_limit: Optional[RateLimit] = None
+    filters: Optional[List[Condition]] = None
+    priority: PriorityField = Priority.NORMAL
+
+    @field_validator("subs")
+    @classmethod
+    def validate_subs(cls, subs: List[str]) -> List[str]:
+        return [topics.validate(topic) for topic in subs]
+
+    @model_validator(mode="after")
+    def validate_filters(self) -> "BaseFunction":
+        for cond in self.filters or []:
+            if cond.topic is not None and cond.topic not in self.subs:
+                raise ValueError(f"Filter topic {cond.topic} is not a subscription of {self.name}")
+        return self
+
+
+class ClusterEvent(BaseModel):
+    name: str
+    data: Optional[Dict[Any, Any]] | Optional[Any] = None
+    created_ns: Optional[int] = None
+    hops: int = 0
+    priority: PriorityField = Priority.NORMAL
+
+
+class FunctionEntry(BaseModel):
+    name: str
+    version: int
+    function: Optional[BaseFunction] = None
+
+
+class Handoff(BaseModel):
+    entry: FunctionEntry
+    events: List[ClusterEvent] = []
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 
-class Event(ABC):
-    def __init__(self, name: str, data: List[Dict[Any, Any]] | Dict[Any, Any] | Any = None):
-        super(Event, self).__init__()
+def encode_json(value: Any) -> bytes:
+    """
+    Encodes a value as compact UTF-8 JSON, as urllib3 does for `json=`
+    """
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+@lru_cache(maxsize=4096)
+def _encode_topic(topic: str) -> bytes:
+    return encode_json(topic)
+
+
+class Event(object):
+    """
+    Event submitted to the scheduler.
+
+    Events are buffered by the thousands, hence they are slotted and only
+    keep the creation time as nanoseconds, both from the wall clock and the
+    monotonic clock. The formatted timestamp is built when needed.
+
+    Events emitted with a trace keep it, see :class:`Trace <trace.Trace>`,
+    so the stages they go through reach the function handling them.
+
+    An event feeding many functions is encoded once, see `encode`, and its
+    encoding is spliced into the body of every invocation.
+
+    The priority of an event decides its place in the scheduler queue and,
+    along with the priority of the function, the place of its invocations in
+    the dispatcher queue.
+    """
+
+    __slots__ = ("name", "data", "status", "created_ns", "monotonic_ns", "trace", "fragment",
+                 "priority")
+
+    def __init__(self, name: str, data: List[Dict[Any, Any]] | Dict[Any, Any] | Any = None,
+                 trace: Trace | None = None, priority: Priority = Priority.NORMAL):
         self.name: str = name
         self.data: List[Dict[Any, Any]] | Dict[Any, Any] = data
         self.status: EventStatus = EventStatus.CREATED
-        self.timestamp: str = datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z")
-
-
-class Invocation(ABC):
+        self.created_ns: int = time.time_ns()
+        self.monotonic_ns: int = time.monotonic_ns()
+        self.trace: Trace | None = trace
+        self.fragment: bytes | None = None
+        self.priority: Priority = priority
+
+    @property
+    def created(self) -> float:
+        """
+        Creation time as seconds since the epoch
+        """
+        return self.created_ns / 1e9
+
+    @property
+    def timestamp(self) -> str:
+        return datetime.fromtimestamp(self.created_ns / 1e9).strftime(TIMESTAMP_FORMAT)
+
+    def encode(self) -> bytes:
+        """
+        Members of the JSON object describing the event in the body of an
+        invocation, i.e., its data and timestamp, encoded on first use
+        """
+        fragment = self.fragment
+        if fragment is None:
+            fragment = b'"timestamp":' + encode_json(self.timestamp)
+            if self.data:
+                fragment = b'"data":' + encode_json(self.data) + b"," + fragment
+            self.fragment = fragment
+        return fragment
+
+    def __setstate__(self, state: Any):
+        if isinstance(state, tuple):
+            _, state = state
+        else:
+            # Checkpoints written before events were slotted pickled their
+            # __dict__, with the creation time formatted as timestamp
+            state = dict(state)
+            created = state.pop("created", None)
+            timestamp = state.pop("timestamp", None)
+            if created is None and timestamp is not None:
+                created = datetime.fromisoformat(timestamp).timestamp()
+            state["created_ns"] = int((created or 0) * 1e9)
+            state["monotonic_ns"] = 0
+        self.trace = None
+        self.fragment = None
+        self.priority = Priority.NORMAL
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class Invocation(object):
     """
-    Abstract class emerging from a function upon fulfilling all event(s)
+    Class emerging from a function upon fulfilling all event(s)
     requirements.
+
+    The invocation keeps the events it was generated from and only turns
+    them into the request body, see `body`, when it is sent. The body is
+    spliced from the encoding of every event, shared by all the invocations
+    an event feeds, rather than encoded anew.
     """
 
-    def __init__(self, url: str, method: str, mock: bool, ** kwargs):
-        super(Invocation, self).__init__()
+    __slots__ = ("kwargs", "events", "trace", "url", "method", "mock", "name", "coalesce",
+                 "rate_limit", "rate_reserved", "attempts", "status", "error", "retryable",
+                 "retry_after", "priority", "created_ns")
+
+    def __init__(self, url: str, method: str, mock: bool, name: str | None = None,
+                 coalesce: str | int | None = None, rate_limit: RateLimit | None = None,
+                 events: Dict[str, Event] | None = None, trace: Trace | None = None,
+                 priority: Priority = Priority.NORMAL, ** kwargs):
         self.kwargs = kwargs
+        self.events = events
+        self.trace = trace
         self.url = url
         self.method = method
         self.mock = mock
-
-    def invoke(self):
+        self.name = name
+        self.coalesce = coalesce
+        self.rate_limit = rate_limit
+        self.rate_reserved: bool = False
+        self.attempts: int = 0
+        self.status: int | None = None
+        self.error: str | None = None
+        self.retryable: bool = False
+        self.retry_after: float | None = None
+        self.priority: Priority = priority
+        self.created_ns: int = time.time_ns()
+
+    def payload(self) -> Dict[str, Any] | None:
+        """
+        Body of the request, with the data and timestamp of every event
+        indexed by topic. Events received through a pattern also carry the
+        topic they were published on
+        """
+        if self.events is None:
+            return self.kwargs.get("json")
+        body = dict()
+        for topic, evt in self.events.items():
+            vals = dict()
+            if evt.data:
+                vals["data"] = evt.data
+            vals["timestamp"] = evt.timestamp
+            if evt.name != topic:
+                vals["topic"] = evt.name
+            body[topic] = vals
+        return body
+
+    def body(self) -> bytes:
+        """
+        Encoded `payload`
+        """
+        if self.events is None:
+            return encode_json(self.kwargs.get("json"))
+        parts = []
+        for topic, evt in self.events.items():
+            if evt.name != topic:
+                parts.append(b"%s:{%s,\"topic\":%s}" % (
+                    _encode_topic(topic), evt.encode(), _encode_topic(evt.name)))
+            else:
+                parts.append(b"%s:{%s}" % (_encode_topic(topic), evt.encode()))
+        return b"{" + b",".join(parts) + b"}"
+
+    @property
+    def host(self) -> str:
+        """
+        Target host and port of the invocation, used to bound the number
+        of concurrent requests per host
+        """
         try:
-            if not self.mock:
-                # TODO: Add retries method and provide feedback with function name
-                if self.method == "GET":
-                    self.kwargs = {}
-
-                res = urllib3.request(self.method, self.url, **self.kwargs)
-                if res.status >= 300:
-                    logger.warn(
-                        f"failure to invoke remote resource because: [{res.reason}]")
-                logger.info("invocation has been dispatched")
+            url = urllib3.util.parse_url(self.url)
+        except urllib3.exceptions.LocationParseError:
+            return self.url
+        return f"{url.host}:{url.port or 80}"
+
+    def invoke(self, http: urllib3.PoolManager | None = None,
+               timeout: urllib3.Timeout | float | None = None) -> bool:
+        """
+        Sends the request to the target, whose answer ends in `status`. Upon
+        failure, `error` describes it and `retryable` indicates if sending it
+        again may succeed, i.e., the target was unreachable, timed out, or
+        answered 429 or 5xx.
+
+        :param http: pool whose connections are reused, module-level pool by default
+        :param timeout: time limit of the request
+        :returns: whether the target accepted the invocation
+        """
+        if self.mock:
+            return True
+
+        self.attempts += 1
+        self.status = None
+        self.retry_after = None
+        try:
+            kwargs = self.kwargs
+            if self.method == "GET":
+                kwargs = {}
+            elif self.events is not None:
+                kwargs = dict(kwargs, body=self.body(),
+                              headers=dict(kwargs.get("headers") or {}, **JSON_HEADERS))
+            if self.trace is not None:
+                kwargs = dict(kwargs, headers=dict(kwargs.get("headers") or {}, **self.trace.headers()))
+
+            url = self.url if "://" in self.url else f"http://{self.url}"
+            res = (http or urllib3).request(
+                self.method, url, timeout=timeout, **kwargs)
+            self.status = res.status
         except Exception as err:
-            logger.error("Failure during invocation...")
+            logger.error(f"Failure during invocation of {self.name}...")
             logger.error(err)
-        return
+            self.error = str(err)
+            self.retryable = True
+            return False
+
+        if res.status >= 300:
+            logger.warning(
+                f"failure to invoke {self.name} remote resource because: [{res.reason}]")
+            self.error = f"{res.status} {res.reason}"
+            self.retryable = res.status == 429 or res.status >= 500
+            retry_after = res.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                self.retry_after = float(retry_after)
+            return False
+
+        logger.info(f"invocation of {self.name} has been dispatched")
+        self.error = None
+        return True
 
 
 class RemoteInvocation(Invocation):
@@ -82,21 +350,62 @@ class Function(ABC):
     arrived, the scheduler will generate an invocation from
     the function data, which includes the target's URL and
     correspondg event(s) data.
+
+    The optional window bounds how many events, and for how long, are
+    buffered per topic while waiting for the other topics. With `coalesce`,
+    invocations still waiting in the dispatcher are merged with newer ones,
+    either as long as they wait (`latest`) or during a window given in
+    milliseconds. The rate limit bounds how often the dispatcher sends the
+    invocations of the function. The filters are conditions on the event
+    data, checked before an event enters the join buffers, so that events
+    the function does not care about never cause an invocation. Invocations
+    are dispatched with the priority of the function or, if more urgent, of
+    the most urgent of their events.
     """
 
-    def __init__(self, name: str, subs: List[str], ref: str, mock: bool = False, method: str = "GET"):
+    # Defaults of functions checkpointed before these options existed
+    coalesce: str | int | None = None
+    rate_limit: RateLimit | None = None
+    filter: EventFilter | None = None
+    priority: Priority = Priority.NORMAL
+
+    def __init__(self, name: str, subs: List[str], ref: str, mock: bool = False, method: str = "GET",
+                 window: Window | None = None, coalesce: str | int | None = None,
+                 rate_limit: RateLimit | None = None, filters: List[Condition] | None = None,
+                 priority: Priority = Priority.NORMAL):
         super(Function, self).__init__()
 
         self.name: str = name
         self.ref: str = ref
         self.method: str = method
-        self.events: Dict[str, List[Event]] = {}
         self.subs: List[str] = subs
-        self.ready: List[List[str]] = []
-        self.last_pos = None
+        if window is None:
+            self.join: JoinBuffer = JoinBuffer(subs)
+        else:
+            max_age = window.max_age_ms / 1000 if window.max_age_ms is not None else None
+            self.join: JoinBuffer = JoinBuffer(
+                subs, window.max_events, max_age, window.policy)
         self.mock = mock
+        self.coalesce = coalesce
+        self.rate_limit = rate_limit
+        self.filter = EventFilter((cond.field, cond.op, cond.value, cond.topic)
+                                  for cond in filters) if filters else None
+        self.priority = Priority(priority)
         self.last_invoke = None
-        self.reset_fn()
+
+    def __setstate__(self, state: Dict[str, Any]):
+        # Checkpoints written before the join buffers kept the partial matches
+        # as parallel per-topic lists, which are replayed in arrival order
+        if "join" not in state:
+            events = state.pop("events", None) or {}
+            state.pop("ready", None)
+            state.pop("last_pos", None)
+            state["join"] = JoinBuffer(state["subs"])
+            for topic in state["join"].topics:
+                for evt in events.get(topic) or []:
+                    if evt is not None:
+                        state["join"].push(evt)
+        self.__dict__.update(state)
 
     def __repr__(self):
         return pformat(vars(self), indent=4)
@@ -105,83 +414,25 @@ class Function(ABC):
         return f"[{self.name}] -> {self.ref} ? {','.join(self.subs)}"
 
     def update_event(self, evt: Event) -> bool:
-        if evt.name not in self.subs:
-            return False
-        if len(self.ready) == 0:
-            self.events[evt.name] = [evt]
-            idx = self.subs.index(evt.name)
-            vals = [None for _ in range(len(self.subs))]
-            vals[idx] = evt.name
-            self.ready.append(vals)
-            if None not in self.ready[-1]:
-                self.last_pos = 0
-                return True
-            return False
-
-        for idx, evt_tr in enumerate(self.ready):
-            if evt.name in evt_tr:
-                if None not in evt_tr:
-                    self.last_pos = idx
-                evts = [None for _ in range(len(self.subs))]
-                evts[self.subs.index(evt.name)] = evt.name
-                self.ready.insert(len(self.ready), evts)
-                if self.events[evt.name]:
-                    self.events[evt.name].insert(len(self.ready), evt)
-                else:
-                    self.events[evt.name] = [
-                        None for _ in range(len(self.ready)+1)]
-                    self.events[evt.name][len(self.ready)] = evt
-
-                if None not in self.ready[-1]:
-                    self.last_pos = len(self.ready) - 1
-                    return True
-                return (self.last_pos is not None) or False
-            else:
-                jdx = self.subs.index(evt.name)
-                if self.events[evt.name] is None:
-                    self.events[evt.name] = [
-                        None for _ in range(len(self.ready))]
-                if idx > (len(self.events[evt.name]) - 1):
-                    self.events[evt.name].insert(idx, evt)
-                else:
-                    self.events[evt.name][idx] = evt
-                evt_tr[jdx] = evt.name
-                if None not in evt_tr:
-                    self.last_pos = idx
-                    return True
-                return False
-        return False
-
-    def reset_fn(self):
-        if self.last_pos is None:
-            for topic in self.subs:
-                self.events[topic] = None
-            return
-
-        if len(self.ready) > self.last_pos:
-
-            lst = self.ready.pop(self.last_pos)
-
-            for topic in self.subs:
-                if len(self.events[topic]) > self.last_pos:
-                    self.events[topic].pop(self.last_pos)
-
-            logger.info(
-                f"removing {lst} from the ready queue for function {self.name}")
-            self.last_pos = None
+        return self.join.push(evt)
 
     def generate_invocation(self) -> Invocation:
-        kwargs = dict()
-        for k, v in self.events.items():
-            vals = dict()
-            if v[self.last_pos].data:
-                vals["data"] = v[self.last_pos].data
-            vals["timestamp"] = v[self.last_pos].timestamp
-            kwargs[k] = vals
-
-        inv = Invocation(self.ref, self.method, self.mock, json=kwargs)
-        self.reset_fn()
-        self.last_invoke = int(datetime.now(
-            pytz.timezone("Europe/Berlin")).timestamp()*1000)
+        evts = self.join.pop()
+        # The latest traced event is the one that completed the join, hence
+        # lies on the critical path of the invocation
+        trace = None
+        for evt in evts.values():
+            if evt.trace is not None and (trace is None or evt.created_ns > trace[0]):
+                trace = (evt.created_ns, evt.trace)
+        if trace is not None:
+            trace = trace[1].fork()
+            trace.mark("joined")
+        priority = min(self.priority, *(evt.priority for evt in evts.values()))
+        inv = Invocation(self.ref, self.method, self.mock,
+                         name=self.name, coalesce=self.coalesce,
+                         rate_limit=self.rate_limit, events=evts, trace=trace,
+                         priority=priority)
+        logger.info(f"removing {list(evts)} from the join buffers for function {self.name}")
+        self.last_invoke = time.time_ns() // 1_000_000
 
         return inv
@@ -0,0 +1,113 @@
+import operator
+
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from .topics import matches
+
+# Field, operator, value and topic, if the condition only applies to the
+# events of one subscription
+Spec = Tuple[str, str, Any, str | None]
+
+
+class Operator(str, Enum):
+    """
+    Comparison between a field of the event data and the value of a condition
+    """
+    EQ = "eq"
+    NE = "ne"
+    LT = "lt"
+    LE = "le"
+    GT = "gt"
+    GE = "ge"
+    IN = "in"
+    EXISTS = "exists"
+
+
+OPERATORS: Dict[Operator, Callable[[Any, Any], bool]] = {
+    Operator.EQ: operator.eq,
+    Operator.NE: operator.ne,
+    Operator.LT: operator.lt,
+    Operator.LE: operator.le,
+    Operator.GT: operator.gt,
+    Operator.GE: operator.ge,
+    Operator.IN: lambda field, value: field in value,
+    Operator.EXISTS: lambda field, value: True,
+}
+
+
+def compile_condition(field: str, op: Operator | str, value: Any) -> Callable[[Any], bool]:
+    """
+    Compiles a condition into a test of the event data. The field is a path
+    of keys separated by dots, or empty to compare the data as a whole. A
+    missing field, or a field that cannot be compared to the value, fails
+    the test.
+    """
+    path = tuple(field.split(".")) if field else ()
+    compare = OPERATORS[Operator(op)]
+
+    def test(data: Any) -> bool:
+        for key in path:
+            if not isinstance(data, dict) or key not in data:
+                return False
+            data = data[key]
+        try:
+            return bool(compare(data, value))
+        except TypeError:
+            return False
+
+    return test
+
+
+class EventFilter(object):
+    """
+    Conditions an event must all fulfill to be handed over to a function,
+    compiled once so that filtering an event only runs the tests of its topic.
+
+    Conditions scoped to a topic apply to the events of that subscription
+    only, those without a topic to every event. `dropped` counts the events
+    that failed the conditions since the function was registered or restored.
+
+    :param specs: field, operator, value and optional topic of every condition
+    """
+
+    def __init__(self, specs: Iterable[Spec]):
+        super(EventFilter, self).__init__()
+        self.specs: List[Spec] = [(field, Operator(op).value, value, topic)
+                                  for field, op, value, topic in specs]
+        self.dropped = 0
+        self.__compile()
+
+    def __compile(self):
+        self.tests: List[Callable[[Any], bool]] = []
+        self.scoped: List[Tuple[str, Callable[[Any], bool]]] = []
+        for field, op, value, topic in self.specs:
+            test = compile_condition(field, op, value)
+            if topic is None:
+                self.tests.append(test)
+            else:
+                self.scoped.append((topic, test))
+
+    def __getstate__(self):
+        # The compiled tests are closures, rebuilt when unpickled
+        return {"specs": self.specs, "dropped": self.dropped}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.specs = state["specs"]
+        self.dropped = state["dropped"]
+        self.__compile()
+
+    def accepts(self, evt: Any) -> bool:
+        """
+        Tests the event, counting it as dropped if it fails
+        """
+        data = evt.data
+        for test in self.tests:
+            if not test(data):
+                self.dropped += 1
+                return False
+        for topic, test in self.scoped:
+            if (topic == evt.name or matches(topic, evt.name)) and not test(data):
+                self.dropped += 1
+                return False
+        return True
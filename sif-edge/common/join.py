@@ -0,0 +1,169 @@
+import time
+
+from enum import Enum
+from collections import deque
+from typing import Any, Deque, Dict, FrozenSet, List, Tuple
+
+from .topics import is_pattern, matches
+
+
+class EvictionPolicy(str, Enum):
+    """
+    Event discarded once a topic buffer of a function is full
+    """
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+    KEEP_LATEST = "keep-latest"
+
+
+class JoinBuffer(object):
+    """
+    Joins the events of a function subscribed to one or more topics.
+
+    Each topic owns a FIFO buffer and the number of empty buffers is kept
+    up to date, so detecting a complete tuple is constant time regardless of
+    how many events are waiting. Once every topic holds an event, the oldest
+    event of each topic forms the tuple handed to the invocation, i.e., the
+    first complete tuple wins.
+
+    With one or two topics this hands over the same tuples, at the same
+    events, as the join `Function` ran before the buffers. With three topics
+    and more it differs: the former join lost track of events already
+    received once a tuple was removed while another one was still partial,
+    skipping them and waiting for later events, whereas the buffers always
+    complete a tuple as soon as its last topic arrives and never skip an
+    event. See ``tests/test_join.py``.
+
+    A topic may be a pattern with wildcards, see :mod:`topics <common.topics>`,
+    buffering every event whose topic it matches. An event matching several
+    topics of the function is buffered under each of them.
+
+    The buffers can be bounded, both in number of events per topic and in
+    age of the events. Once a buffer is full, the eviction policy decides
+    which event is dropped, while events older than `max_age` are dropped
+    whenever a new event arrives. `evicted` counts the dropped events.
+
+    :param topics: topics the function is subscribed to
+    :param max_events: maximum number of events buffered per topic
+    :param max_age: maximum number of seconds an event stays buffered
+    :param policy: event dropped once a buffer is full, `keep-latest` keeps a single event per topic
+    """
+
+    # Defaults of buffers checkpointed before they could be bounded
+    max_events: int | None = None
+    max_age: float | None = None
+    policy: EvictionPolicy = EvictionPolicy.DROP_OLDEST
+    evicted: int = 0
+    patterns: FrozenSet[str] = frozenset()
+
+    def __init__(self, topics: List[str], max_events: int | None = None,
+                 max_age: float | None = None,
+                 policy: EvictionPolicy | str = EvictionPolicy.DROP_OLDEST):
+        super(JoinBuffer, self).__init__()
+        self.topics: List[str] = list(dict.fromkeys(topics))
+        self.buffers: Dict[str, Deque[Any]] = {
+            topic: deque() for topic in self.topics}
+        self.missing: int = len(self.topics)
+        self.policy = EvictionPolicy(policy)
+        self.max_events = 1 if self.policy == EvictionPolicy.KEEP_LATEST else max_events
+        self.max_age = max_age
+        self.evicted = 0
+        self.patterns = frozenset(topic for topic in self.topics if is_pattern(topic))
+
+    def __len__(self) -> int:
+        return sum(len(buf) for buf in self.buffers.values())
+
+    def push(self, evt: Any) -> bool:
+        """
+        Buffers the event under its topic, and under every pattern matching
+        its topic
+
+        :returns: whether a complete tuple is available
+        """
+        if not self.patterns:
+            buf = self.buffers.get(evt.name)
+            if buf is None:
+                return False
+            if self.max_age is not None:
+                self.expire(time.time() - self.max_age)
+            self.__append(buf, evt)
+            return self.missing == 0
+
+        bufs = [buf for topic, buf in self.buffers.items()
+                if topic == evt.name or (topic in self.patterns and matches(topic, evt.name))]
+        if not bufs:
+            return False
+        if self.max_age is not None:
+            self.expire(time.time() - self.max_age)
+        for buf in bufs:
+            self.__append(buf, evt)
+        return self.missing == 0
+
+    def __append(self, buf: Deque[Any], evt: Any):
+        if self.max_events is not None and buf and len(buf) >= self.max_events:
+            self.evicted += 1
+            if self.policy != EvictionPolicy.DROP_NEWEST:
+                buf.popleft()
+                buf.append(evt)
+            return
+        if not buf:
+            self.missing -= 1
+        buf.append(evt)
+
+    def expire(self, deadline: float):
+        """
+        Drops the events created before the deadline, given as seconds
+        since the epoch
+        """
+        for buf in self.buffers.values():
+            if not buf or buf[0].created >= deadline:
+                continue
+            while buf and buf[0].created < deadline:
+                buf.popleft()
+                self.evicted += 1
+            if not buf:
+                self.missing += 1
+
+    def is_complete(self) -> bool:
+        return self.missing == 0
+
+    def pop(self) -> Dict[str, Any]:
+        """
+        Removes the oldest complete tuple from the buffers
+
+        :returns: the tuple of events indexed by topic
+        """
+        if self.missing:
+            raise LookupError("No complete tuple is available")
+        tup = {}
+        for topic, buf in self.buffers.items():
+            tup[topic] = buf.popleft()
+            if not buf:
+                self.missing += 1
+        return tup
+
+    def lengths(self) -> Tuple[int, ...]:
+        """
+        Number of events buffered per topic, in the order of `topics`
+        """
+        return tuple(len(buf) for buf in self.buffers.values())
+
+    def status(self) -> List[Dict[str, List[str]]]:
+        """
+        Describes the partial matches, one entry per buffered tuple, with the
+        topics that already arrived and the ones still being waited for
+        """
+        return JoinBuffer.describe(self.topics, self.lengths())
+
+    @staticmethod
+    def describe(topics: List[str], lengths: Tuple[int, ...]) -> List[Dict[str, List[str]]]:
+        status = []
+        for idx in range(max(lengths, default=0)):
+            evts = {"ready": [], "waiting": []}
+            for topic, length in zip(topics, lengths):
+                if length > idx:
+                    evts["ready"].append(topic)
+                else:
+                    evts["waiting"].append(topic)
+            status.append(evts)
+        return status
@@ -0,0 +1,174 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import math
+
+# Upper bounds, in seconds, of the histograms timing in-process work and
+# remote requests respectively
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+REQUEST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Metric exposed in the Prometheus text format, possibly split by labels.
+
+    Updates of a disabled registry are dropped before touching any state,
+    so the instrumentation of the hot paths costs a single check.
+
+    :param registry: registry exposing the metric
+    :param name: name of the metric
+    :param help: description of the metric
+    :param labels: names of the labels whose values identify a series
+    """
+
+    kind = "untyped"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Tuple[str, ...] = ()):
+        super(Metric, self).__init__()
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+
+    def _labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f"{name}=\"{_escape(str(value))}\"" for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        return iter(())
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Tuple[str, ...] = ()):
+        super(Counter, self).__init__(registry, name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{self._labels(labels)} {_format(value)}"
+
+
+class Gauge(Metric):
+    """
+    Gauge whose value is read from `fn` upon every scrape, so that e.g. the
+    depth of a queue costs nothing until it is asked for
+    """
+
+    kind = "gauge"
+
+    def __init__(self, registry: "Registry", name: str, help: str, fn: Callable[[], float]):
+        super(Gauge, self).__init__(registry, name, help)
+        self.fn = fn
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {_format(self.fn())}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = FAST_BUCKETS):
+        super(Histogram, self).__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per series, the count of every bucket followed by the sum
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        if not self.registry.enabled:
+            return
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 1)
+            series[idx] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = [(labels, list(series)) for labels, series in self.values.items()]
+        for labels, series in values:
+            count = 0
+            for bound, hits in zip(self.buckets, series):
+                count += hits
+                le = self._labels(labels, "le=\"" + _format(bound) + "\"")
+                yield f"{self.name}_bucket{le} {count}"
+            yield f"{self.name}_sum{self._labels(labels)} {_format(series[-1])}"
+            yield f"{self.name}_count{self._labels(labels)} {count}"
+
+
+class Registry(object):
+    """
+    Set of metrics rendered together by the `/metrics` endpoint.
+
+    :param enabled: whether the metrics are updated at all
+    """
+
+    def __init__(self, enabled: bool = True):
+        super(Registry, self).__init__()
+        self.enabled = enabled
+        self.lock = Lock()
+        self.metrics: Dict[str, Metric] = {}
+
+    def __register(self, metric: Metric) -> Metric:
+        with self.lock:
+            # Re-registering, e.g. a gauge bound to a new queue, replaces it
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.__register(Counter(self, name, help, labels))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        return self.__register(Gauge(self, name, help, fn))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = FAST_BUCKETS) -> Histogram:
+        return self.__register(Histogram(self, name, help, labels, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
@@ -0,0 +1,31 @@
+from enum import IntEnum
+from typing import Any
+
+
+class Priority(IntEnum):
+    """
+    Priority class of events, functions and invocations, the lower the value
+    the more urgent, so that priorities sort in the order they are served
+    """
+    CRITICAL = 0
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
+    @classmethod
+    def parse(cls, value: Any) -> "Priority":
+        """
+        Accepts a priority given by name, e.g., `critical`, or by value
+
+        :raises ValueError: the priority is unknown
+        """
+        if isinstance(value, str) and not value.isdigit():
+            try:
+                return cls[value.upper()]
+            except KeyError:
+                raise ValueError(f"Unknown priority {value}, expected one of "
+                                 f"{', '.join(p.name.lower() for p in cls)}")
+        try:
+            return cls(int(value))
+        except TypeError:
+            raise ValueError(f"Invalid priority {value!r}")
@@ -0,0 +1,245 @@
+import math
+import time
+import queue
+import multiprocessing
+import multiprocessing.queues
+
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Condition, Lock
+from typing import Any, Deque, List, Tuple
+
+from .priority import Priority
+
+
+class BaseQueue(ABC):
+    """
+    Interface of the queues connecting the API, the scheduler and the
+    dispatcher. It follows the signature of :class:`queue.Queue`.
+    """
+
+    @abstractmethod
+    def put(self, item: Any, block: bool = True, timeout: float | None = None):
+        raise NotImplementedError("Implement the 'put' method in your class")
+
+    @abstractmethod
+    def get(self, block: bool = True, timeout: float | None = None) -> Any:
+        raise NotImplementedError("Implement the 'get' method in your class")
+
+    @abstractmethod
+    def qsize(self) -> int:
+        raise NotImplementedError("Implement the 'qsize' method in your class")
+
+    def put_nowait(self, item: Any):
+        return self.put(item, False)
+
+    def get_nowait(self) -> Any:
+        return self.get(False)
+
+
+class LocalQueue(queue.Queue, BaseQueue):
+    """
+    Queue between threads of the same process. Items are handed over by
+    reference, without any serialization.
+
+    :param maxsize: maximum number of queued items, unbounded if 0
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super(LocalQueue, self).__init__(maxsize)
+
+
+class ProcessQueue(multiprocessing.queues.Queue, BaseQueue):
+    """
+    Queue between processes. Items are pickled and sent through a pipe by
+    a feeder thread, so it is only worth it when producer and consumer live
+    in different processes.
+
+    :param maxsize: maximum number of queued items, unbounded if 0
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super(ProcessQueue, self).__init__(
+            maxsize, ctx=multiprocessing.get_context())
+
+
+class PriorityQueue(BaseQueue):
+    """
+    Queue between threads of the same process with one FIFO lane per
+    :class:`Priority <common.priority.Priority>`, read from the most urgent
+    non-empty lane. Items carry their priority as a `priority` attribute,
+    items without one go to the `NORMAL` lane.
+
+    Against starvation, the head of a less urgent lane waiting longer than
+    `max_wait` seconds is served before the more urgent lanes, so bulk
+    traffic keeps moving under a steady flow of urgent items. Such
+    promotions are limited to one per `max_wait`, so that a backlog of
+    starving items does not turn the queue into a FIFO over all lanes.
+
+    Consumers may ask for the most urgent lane only, see `get`, which
+    lets some of them be reserved for it.
+
+    :param maxsize: maximum number of queued items over all lanes, unbounded if 0
+    :param max_wait: seconds after which a waiting item is served regardless of its priority
+    """
+
+    TOP = min(Priority)
+
+    def __init__(self, maxsize: int = 0, max_wait: float = 1.0):
+        super(PriorityQueue, self).__init__()
+        self.maxsize = maxsize
+        self.max_wait = max_wait
+        self.lanes: List[Deque[Tuple[float, Any]]] = [deque() for _ in Priority]
+        self.size = 0
+        self.promoted = 0
+        self.promoted_at = -math.inf
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_urgent_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+
+    def qsize(self) -> int:
+        return self.size
+
+    def lengths(self) -> List[int]:
+        """
+        Number of queued items per lane, most urgent first
+        """
+        with self.lock:
+            return [len(lane) for lane in self.lanes]
+
+    @staticmethod
+    def __wait(cond: Condition, ready, block: bool, timeout: float | None, error: type):
+        if ready():
+            return
+        if not block:
+            raise error
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not ready():
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                raise error
+            cond.wait(remaining)
+
+    def put(self, item: Any, block: bool = True, timeout: float | None = None):
+        with self.lock:
+            if self.maxsize > 0:
+                PriorityQueue.__wait(self.not_full, lambda: self.size < self.maxsize,
+                                     block, timeout, queue.Full)
+            self.__append(item)
+            self.size += 1
+            self.not_empty.notify()
+
+    def __append(self, item: Any):
+        """
+        Requires `lock`
+        """
+        priority = getattr(item, "priority", Priority.NORMAL)
+        self.lanes[priority].append((time.monotonic(), item))
+        if priority == PriorityQueue.TOP:
+            self.not_urgent_empty.notify()
+
+    def raise_priority(self, item: Any, priority: Priority) -> bool:
+        """
+        Sets the priority of an item, moving it to the lane of that priority,
+        behind the items waiting there, if it is queued and more urgent
+
+        :returns: whether the item has been moved
+        """
+        with self.lock:
+            current = getattr(item, "priority", Priority.NORMAL)
+            if priority >= current:
+                return False
+            item.priority = priority
+            lane = self.lanes[current]
+            for idx, (_, queued) in enumerate(lane):
+                if queued is item:
+                    del lane[idx]
+                    self.__append(item)
+                    return True
+            return False
+
+    def get(self, block: bool = True, timeout: float | None = None, urgent: bool = False) -> Any:
+        """
+        :param urgent: only take items of the most urgent lane
+        """
+        top = self.lanes[PriorityQueue.TOP]
+        with self.lock:
+            if urgent:
+                PriorityQueue.__wait(self.not_urgent_empty, lambda: top, block, timeout, queue.Empty)
+                _, item = top.popleft()
+            else:
+                PriorityQueue.__wait(self.not_empty, lambda: self.size, block, timeout, queue.Empty)
+                item = self.__pop()
+            self.size -= 1
+            self.not_full.notify()
+            return item
+
+    def __pop(self) -> Any:
+        """
+        Requires `lock` and a non-empty queue
+        """
+        lanes = iter(self.lanes)
+        for lane in lanes:
+            if lane:
+                break
+        # Oldest item of the less urgent lanes, served first once it starves
+        # unless another one was promoted within `max_wait`
+        now = time.monotonic()
+        deadline = now - self.max_wait
+        if self.promoted_at > deadline:
+            return lane.popleft()[1]
+        starving = None
+        for other in lanes:
+            if other and other[0][0] < deadline and (starving is None or other[0][0] < starving[0][0]):
+                starving = other
+        if starving is not None:
+            self.promoted += 1
+            self.promoted_at = now
+            lane = starving
+        return lane.popleft()[1]
+
+
+class Watermark(object):
+    """
+    Tells when a queue is overloaded, with hysteresis: the queue turns
+    overloaded once its depth reaches `high` and stays so until the depth
+    falls back to `low`.
+
+    :param queue: queue being watched
+    :param high: depth at which the queue turns overloaded
+    :param low: depth at which the queue stops being overloaded
+    """
+
+    def __init__(self, queue: BaseQueue, high: int, low: int):
+        super(Watermark, self).__init__()
+        self.queue = queue
+        self.high = high
+        self.low = min(low, high)
+        self.overloaded = False
+
+    def is_overloaded(self) -> bool:
+        depth = self.queue.qsize()
+        if depth >= self.high:
+            self.overloaded = True
+        elif depth <= self.low:
+            self.overloaded = False
+        return self.overloaded
+
+
+QUEUES = {"local": LocalQueue, "process": ProcessQueue, "priority": PriorityQueue}
+
+
+def create_queue(kind: str = "local", maxsize: int = 0, max_wait: float = 1.0) -> BaseQueue:
+    """
+    Instantiates a queue of the given kind, i.e., `local`, `process` or
+    `priority`
+
+    :param max_wait: starvation bound of the `priority` queues, see :class:`PriorityQueue`
+    """
+    if kind not in QUEUES:
+        raise ValueError(
+            f"Unknown queue kind {kind}, expected one of {', '.join(QUEUES)}")
+    if kind == "priority":
+        return PriorityQueue(maxsize, max_wait)
+    return QUEUES[kind](maxsize)
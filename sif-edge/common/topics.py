@@ -0,0 +1,154 @@
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+# Topics are hierarchical, their levels separated by dots, e.g.,
+# `sensor.bedroom.motion`. In a subscription, `*` matches exactly one level
+# and `#`, only allowed as the last level, matches zero or more levels.
+SEPARATOR = "."
+SINGLE = "*"
+MULTI = "#"
+
+
+def is_pattern(topic: str) -> bool:
+    return SINGLE in topic or MULTI in topic
+
+
+def validate(topic: str) -> str:
+    """
+    :raises ValueError: a wildcard is mixed with other characters within a
+        level, or `#` is not the last level
+    """
+    levels = topic.split(SEPARATOR)
+    for idx, level in enumerate(levels):
+        if level in (SINGLE, MULTI):
+            if level == MULTI and idx != len(levels) - 1:
+                raise ValueError(f"'{MULTI}' must be the last level of {topic}")
+        elif SINGLE in level or MULTI in level:
+            raise ValueError(f"Wildcards must span a whole level of {topic}")
+    return topic
+
+
+@lru_cache(maxsize=4096)
+def levels(topic: str) -> Tuple[str, ...]:
+    return tuple(topic.split(SEPARATOR))
+
+
+def matches(pattern: str, topic: str) -> bool:
+    pattern_levels, topic_levels = levels(pattern), levels(topic)
+    for idx, level in enumerate(pattern_levels):
+        if level == MULTI:
+            return True
+        if idx >= len(topic_levels) or (level != SINGLE and level != topic_levels[idx]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+class _Node(object):
+    __slots__ = ("children", "values")
+
+    def __init__(self, children: Dict[str, "_Node"], values: Tuple[Any, ...]):
+        self.children = children
+        self.values = values
+
+
+class TopicTrie(object):
+    """
+    Immutable trie of topic patterns, one level per node, holding values
+    for every pattern. Matching a topic walks the levels of the topic and
+    only branches on wildcards, so it costs about the depth of the topic
+    rather than the number of patterns.
+
+    Changing a pattern derives a new trie sharing every node but those on
+    the path of the pattern, hence a trie may be read without locking while
+    another is derived from it.
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self, root: _Node | None = None, size: int = 0):
+        super(TopicTrie, self).__init__()
+        self.root = root
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get(self, pattern: str) -> Tuple[Any, ...]:
+        node = self.root
+        for level in levels(pattern):
+            if node is None:
+                return ()
+            node = node.children.get(level)
+        return node.values if node is not None else ()
+
+    def set(self, pattern: str, values: Iterable[Any]) -> "TopicTrie":
+        """
+        Derives the trie where the pattern holds the values, or is removed
+        when there are none
+        """
+        return self.update({pattern: values})
+
+    def update(self, patterns: Mapping[str, Iterable[Any]]) -> "TopicTrie":
+        """
+        Derives the trie where every pattern holds its values, or is removed
+        when there are none. Nodes copied once are changed in place for the
+        following patterns, so changing many patterns at once copies every
+        node at most once.
+        """
+        fresh: Dict[int, _Node] = {}
+
+        def copy(node: _Node | None) -> _Node:
+            if node is not None and id(node) in fresh:
+                return node
+            new = _Node(dict(node.children), node.values) if node is not None else _Node({}, ())
+            fresh[id(new)] = new
+            return new
+
+        root = copy(self.root)
+        size = self.size
+        for pattern, values in patterns.items():
+            path = []
+            node = root
+            for level in levels(pattern):
+                child = copy(node.children.get(level))
+                node.children[level] = child
+                path.append((node, level))
+                node = child
+            values = tuple(values)
+            size += bool(values) - bool(node.values)
+            node.values = values
+            # Prunes the nodes left without patterns
+            for parent, level in reversed(path):
+                child = parent.children[level]
+                if child.children or child.values:
+                    break
+                del parent.children[level]
+        return TopicTrie(root if root.children or root.values else None, size)
+
+    def match(self, topic: str) -> List[Any]:
+        """
+        Values of every pattern matching the topic, a value appearing once
+        per matching pattern
+        """
+        if self.root is None:
+            return []
+        topic_levels = levels(topic)
+        matched = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            children = node.children
+            multi = children.get(MULTI)
+            if multi is not None:
+                matched.extend(multi.values)
+            if depth == len(topic_levels):
+                matched.extend(node.values)
+                continue
+            level = topic_levels[depth]
+            child = children.get(level) if level != SINGLE and level != MULTI else None
+            if child is not None:
+                stack.append((child, depth + 1))
+            child = children.get(SINGLE)
+            if child is not None:
+                stack.append((child, depth + 1))
+        return matched
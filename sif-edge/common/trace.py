@@ -0,0 +1,63 @@
+import time
+
+from typing import List, Mapping, Tuple
+
+# Headers carrying the trace of an event from its emission, through the
+# scheduler and dispatcher, to the function handling it
+TRACE_HEADER = "X-SIF-Trace-Id"
+STAGES_HEADER = "X-SIF-Trace-Stages"
+
+MAX_ID_LENGTH = 64
+MAX_STAGES = 32
+
+
+class Trace(object):
+    """
+    Trace of an event, identified by the id given upon its emission, with
+    the time, as nanoseconds since the epoch, at which it went through every
+    stage of the pipeline. The stages are encoded in the `STAGES_HEADER` as
+    comma-separated `stage=nanoseconds` pairs.
+
+    :param id: identifier shared by every stage of the trace
+    :param stages: stages passed so far, in order
+    """
+
+    __slots__ = ("id", "stages")
+
+    def __init__(self, id: str, stages: List[Tuple[str, int]] | None = None):
+        self.id = id
+        self.stages = stages if stages is not None else []
+
+    def mark(self, stage: str):
+        if len(self.stages) < MAX_STAGES:
+            self.stages.append((stage, time.time_ns()))
+
+    def fork(self) -> "Trace":
+        """
+        Copy of the trace, as the invocations of every function subscribed
+        to the event go through the remaining stages independently
+        """
+        return Trace(self.id, list(self.stages))
+
+    def headers(self) -> dict:
+        return {
+            TRACE_HEADER: self.id,
+            STAGES_HEADER: ",".join(f"{stage}={ts}" for stage, ts in self.stages),
+        }
+
+    @staticmethod
+    def from_headers(headers: Mapping[str, str]) -> "Trace | None":
+        """
+        Trace carried by the request headers, if any. Malformed stages are
+        skipped rather than failing the request.
+        """
+        trace_id = headers.get(TRACE_HEADER)
+        if not trace_id or len(trace_id) > MAX_ID_LENGTH:
+            return None
+
+        stages = []
+        for pair in (headers.get(STAGES_HEADER) or "").split(",")[:MAX_STAGES]:
+            stage, _, ts = pair.partition("=")
+            if stage and ts.isdigit():
+                stages.append((stage.strip(), int(ts)))
+        return Trace(trace_id, stages)
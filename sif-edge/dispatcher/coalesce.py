@@ -0,0 +1,82 @@
+from threading import Lock
+from typing import Any, Dict
+
+import common
+
+from common.queues import BaseQueue, PriorityQueue
+
+from .delay import DelayQueue
+
+
+class CoalescingQueue(BaseQueue):
+    """
+    Dispatcher queue merging the pending invocations of the same function.
+
+    Invocations of functions registered with `coalesce` are kept at most
+    once in the queue: while one is pending, newer ones only replace its
+    payload, while older ones re-entering the queue, e.g., retries, are
+    dropped. With `latest`, the pending invocation is queued right away and
+    carries the latest payload once a worker picks it up. With a number of
+    milliseconds, the first invocation is held back for that window and
+    every invocation arriving meanwhile is merged into it. Other invocations
+    go straight through. The pending invocation takes the most urgent
+    priority of those merged into it and, if already queued with priority
+    lanes, moves to the lane of that priority.
+
+    :param inner: queue holding the invocations
+    """
+
+    LATEST = "latest"
+
+    def __init__(self, inner: BaseQueue):
+        super(CoalescingQueue, self).__init__()
+        self.inner = inner
+        self.windows = DelayQueue(inner)
+        self.lock = Lock()
+        self.pending: Dict[str, common.Invocation] = {}
+        self.coalesced = 0
+
+    def put(self, item: Any, block: bool = True, timeout: float | None = None):
+        coalesce = getattr(item, "coalesce", None)
+        if coalesce is None:
+            return self.inner.put(item, block, timeout)
+
+        with self.lock:
+            pending = self.pending.get(item.name)
+            if pending is not None:
+                # Retries, rate-limited and replayed invocations re-enter the
+                # queue after newer ones, whose payload they must not replace
+                if item.created_ns >= pending.created_ns:
+                    pending.kwargs = item.kwargs
+                    pending.events = item.events
+                    pending.trace = item.trace
+                    pending.created_ns = item.created_ns
+                if item.priority < pending.priority:
+                    # A pending invocation already queued moves to the lane
+                    # of its new priority
+                    if isinstance(self.inner, PriorityQueue):
+                        self.inner.raise_priority(pending, item.priority)
+                    else:
+                        pending.priority = item.priority
+                self.coalesced += 1
+                return
+            self.pending[item.name] = item
+
+        if coalesce == CoalescingQueue.LATEST:
+            self.inner.put(item, block, timeout)
+        else:
+            self.windows.put(item, coalesce / 1000)
+
+    def get(self, block: bool = True, timeout: float | None = None, urgent: bool = False) -> Any:
+        """
+        :param urgent: only take the most urgent invocations, see :class:`PriorityQueue <common.queues.PriorityQueue>`
+        """
+        item = self.inner.get(block, timeout, urgent=True) if urgent else self.inner.get(block, timeout)
+        if getattr(item, "coalesce", None) is not None:
+            with self.lock:
+                if self.pending.get(item.name) is item:
+                    del self.pending[item.name]
+        return item
+
+    def qsize(self) -> int:
+        return self.inner.qsize() + len(self.windows)
@@ -0,0 +1,64 @@
+import time
+import itertools
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List
+
+import common
+
+
+class DeadLetterStore(object):
+    """
+    Keeps the invocations that could not be delivered, either because the
+    target rejected them or because they ran out of retries. Once
+    `capacity` invocations are stored, the oldest one is dropped.
+
+    :param capacity: maximum number of invocations kept
+    """
+
+    def __init__(self, capacity: int = 1000):
+        super(DeadLetterStore, self).__init__()
+        self.capacity = capacity
+        self.lock = Lock()
+        self.entries: OrderedDict[int, Dict[str, Any]] = OrderedDict()
+        self.ids = itertools.count(1)
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, inv: common.Invocation):
+        with self.lock:
+            self.entries[next(self.ids)] = {
+                "invocation": inv, "failed_at": int(time.time() * 1000)}
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.dropped += 1
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            entries = list(self.entries.items())
+        return [{
+            "id": idx,
+            "name": entry["invocation"].name,
+            "url": entry["invocation"].url,
+            "method": entry["invocation"].method,
+            "attempts": entry["invocation"].attempts,
+            "error": entry["invocation"].error,
+            "failed_at": entry["failed_at"],
+            "payload": entry["invocation"].payload(),
+        } for idx, entry in entries]
+
+    def take(self, ids: List[int] | None = None) -> List[common.Invocation]:
+        """
+        Removes the given invocations, or all of them, from the store
+
+        :param ids: identifiers of the invocations, as given by `list`
+        :returns: the removed invocations
+        """
+        with self.lock:
+            if ids is None:
+                ids = list(self.entries)
+            return [self.entries.pop(idx)["invocation"]
+                    for idx in ids if idx in self.entries]
@@ -0,0 +1,48 @@
+import heapq
+import time
+import itertools
+
+from threading import Thread, Condition
+from typing import Any, List, Tuple
+
+
+class DelayQueue(object):
+    """
+    Holds items back until their delay expires and then puts them into the
+    target queue. A single thread sleeps until the earliest due item, so
+    delayed items never occupy a dispatcher worker.
+
+    :param target: queue receiving the items once they are due
+    """
+
+    def __init__(self, target: Any):
+        super(DelayQueue, self).__init__()
+        self.target = target
+        self.cond = Condition()
+        self.heap: List[Tuple[float, int, Any]] = []
+        self.seq = itertools.count()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def put(self, item: Any, delay: float):
+        due = time.monotonic() + max(delay, 0.0)
+        with self.cond:
+            heapq.heappush(self.heap, (due, next(self.seq), item))
+            if self.heap[0][2] is item:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                due, _, item = self.heap[0]
+                remaining = due - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                heapq.heappop(self.heap)
+            self.target.put(item)
@@ -1,33 +1,254 @@
 from abc import ABC
-from threading import Thread
-from multiprocessing import Queue
+from threading import Thread, Lock
+from typing import Dict, List, Tuple
 
+import time
+import heapq
+import random
+import itertools
 import logging
+import urllib3
 import common
 
+from common.queues import BaseQueue, PriorityQueue, create_queue
+from common.metrics import REGISTRY, REQUEST_BUCKETS
+
+from .delay import DelayQueue
+from .coalesce import CoalescingQueue
+from .ratelimit import TokenBucket
+from .deadletter import DeadLetterStore
+
 logger = logging.getLogger("uvicorn.error")
 logging.getLogger("requests").setLevel(logging.INFO)
 
+dispatch_seconds = REGISTRY.histogram(
+    "sif_dispatch_seconds", "Duration of the requests sent to the functions",
+    ("function",), REQUEST_BUCKETS)
+dispatch_responses = REGISTRY.counter(
+    "sif_dispatch_responses_total", "Answers to the requests sent to the functions, by status code",
+    ("function", "code"))
+dispatch_retries = REGISTRY.counter(
+    "sif_dispatch_retries_total", "Invocations scheduled for another attempt", ("function",))
+dispatch_deadletters = REGISTRY.counter(
+    "sif_dispatch_deadletters_total", "Invocations moved to the dead-letter store", ("function",))
+
 
 class Dispatcher(ABC):
-    def __init__(self):
+    """
+    Sends the invocations generated by the scheduler to their targets.
+
+    A pool of `workers` threads pulls invocations from the local event loop
+    and sends them through a shared pool of keep-alive connections. No more
+    than `per_host` requests are in flight towards the same host; further
+    invocations for that host are parked and picked up as soon as one of
+    its requests finishes, so a slow target never holds up the others.
+
+    Failed invocations that may succeed later are put back into the event
+    loop after an exponential backoff with jitter, without occupying a
+    worker meanwhile. Those rejected by the target or out of retries end in
+    the dead-letter store, from where they can be inspected and replayed.
+
+    Invocations of functions asking for it are coalesced while they wait in
+    the queue, see :class:`CoalescingQueue <coalesce.CoalescingQueue>`, or
+    rate limited by a :class:`TokenBucket <ratelimit.TokenBucket>` per
+    function, in which case they wait in the delay queue for their turn.
+
+    Invocations are queued by priority, see :class:`PriorityQueue <common.queues.PriorityQueue>`,
+    and parked ones are picked up by priority too. On top of the `workers`,
+    `reserved` workers only send the most urgent invocations, so these never
+    wait for a worker busy with bulk traffic.
+
+    :param workers: maximum number of concurrent requests
+    :param per_host: maximum number of concurrent requests towards one host
+    :param timeout: time limit, in seconds, of every request
+    :param max_retries: number of retries before giving up on an invocation
+    :param backoff: delay, in seconds, before the first retry
+    :param max_backoff: upper bound, in seconds, of the delay between retries
+    :param deadletter_size: maximum number of invocations kept in the dead-letter store
+    :param queue_kind: kind of queue receiving the invocations, see :func:`create_queue <common.queues.create_queue>`
+    :param queue_size: maximum number of queued invocations
+    :param queue_max_wait: seconds after which a queued invocation is sent regardless of its priority
+    :param reserved: number of additional workers dedicated to the most urgent invocations
+    :param hosts: number of target hosts whose connections are kept alive at once
+    """
+
+    def __init__(self, workers: int = 16, per_host: int = 4, timeout: float = 10.0,
+                 max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 60.0,
+                 deadletter_size: int = 1000, queue_kind: str = "priority",
+                 queue_size: int = 100000, queue_max_wait: float = 1.0, reserved: int = 1,
+                 hosts: int = 10):
         super(Dispatcher, self).__init__()
 
-        self.event_loop: Queue[common.Invocation] = Queue()
+        self.event_loop: CoalescingQueue = CoalescingQueue(
+            create_queue(queue_kind, queue_size, queue_max_wait))
+        self.workers = workers
+        # Only a queue with priority lanes can hand the most urgent
+        # invocations to the reserved workers
+        self.reserved = reserved if isinstance(self.event_loop.inner, PriorityQueue) else 0
+        self.per_host = per_host
+        self.timeout = urllib3.Timeout(total=timeout)
+        # Retries are handled by the dispatcher, so a worker never sleeps
+        # between attempts
+        self.http = urllib3.PoolManager(num_pools=hosts, maxsize=per_host,
+                                        retries=urllib3.Retry(connect=0, read=0, other=0))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = DelayQueue(self.event_loop)
+        self.deadletter = DeadLetterStore(deadletter_size)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.throttled = 0
+        self.host_lock = Lock()
+        self.in_flight: Dict[str, int] = {}
+        # Invocations waiting for a request slot of their host, as heaps by
+        # priority then arrival
+        self.parked: Dict[str, List[Tuple[int, int, common.Invocation]]] = {}
+        self.parked_seq = itertools.count()
 
-    def return_event_loop(self) -> "Queue[common.Invocation]":
+    def return_event_loop(self) -> BaseQueue:
         """
         Returns the local event loop where the dispatcher listens for
         invocations
         """
         return self.event_loop
 
-    def wait_loop(self) -> Thread:
-        dispatcher_thread = Thread(target=self._wait_loop)
-        dispatcher_thread.start()
-        return dispatcher_thread
+    def stats(self):
+        with self.host_lock:
+            in_flight = sum(self.in_flight.values())
+            parked = sum(len(invs) for invs in self.parked.values())
+        inner = self.event_loop.inner
+        return {
+            "queued": self.event_loop.qsize(),
+            "queued_by_priority": dict(zip((p.name.lower() for p in common.Priority), inner.lengths()))
+            if isinstance(inner, PriorityQueue) else None,
+            "promoted": inner.promoted if isinstance(inner, PriorityQueue) else None,
+            "in_flight": in_flight,
+            "parked": parked,
+            "retrying": len(self.retries),
+            "coalesced": self.event_loop.coalesced,
+            "throttled": self.throttled,
+            "deadletter": len(self.deadletter),
+        }
+
+    def replay_deadletter(self, ids: List[int] | None = None) -> int:
+        """
+        Sends the given dead-lettered invocations, or all of them, again
+
+        :returns: number of invocations replayed
+        """
+        invs = self.deadletter.take(ids)
+        for inv in invs:
+            inv.attempts = 0
+            self.event_loop.put(inv, True)
+        return len(invs)
+
+    def __handle_failure(self, inv: common.Invocation):
+        if not inv.retryable or inv.attempts > self.max_retries:
+            logger.error(
+                f"Giving up on invocation of {inv.name} after {inv.attempts} attempt(s): {inv.error}")
+            self.deadletter.add(inv)
+            dispatch_deadletters.inc(inv.name or "")
+            return
+
+        delay = min(self.max_backoff, self.backoff * 2 ** (inv.attempts - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if inv.retry_after is not None:
+            delay = max(delay, inv.retry_after)
+        logger.info(f"Retrying invocation of {inv.name} in {delay:.2f}s")
+        dispatch_retries.inc(inv.name or "")
+        self.retries.put(inv, delay)
+
+    def __throttle(self, inv: common.Invocation) -> bool:
+        """
+        Holds the invocation back if its function exceeds its rate limit
+
+        :returns: whether the invocation has been delayed
+        """
+        if inv.rate_limit is None:
+            return False
+        if inv.rate_reserved:
+            inv.rate_reserved = False
+            return False
+
+        bucket = self.buckets.get(inv.name)
+        if bucket is None or bucket.rate != inv.rate_limit.rate or \
+                bucket.burst != inv.rate_limit.burst:
+            bucket = TokenBucket(inv.rate_limit.rate, inv.rate_limit.burst)
+            self.buckets[inv.name] = bucket
+
+        wait = bucket.reserve()
+        if wait <= 0:
+            return False
+        inv.rate_reserved = True
+        self.throttled += 1
+        self.retries.put(inv, wait)
+        return True
+
+    def wait_loop(self) -> List[Thread]:
+        dispatcher_threads = []
+        for idx in range(self.workers + self.reserved):
+            dispatcher_thread = Thread(target=self._wait_loop, args=(idx >= self.workers,), daemon=True)
+            dispatcher_thread.start()
+            dispatcher_threads.append(dispatcher_thread)
+        return dispatcher_threads
+
+    def __acquire_host(self, inv: common.Invocation, host: str) -> bool:
+        with self.host_lock:
+            if self.in_flight.get(host, 0) < self.per_host:
+                self.in_flight[host] = self.in_flight.get(host, 0) + 1
+                return True
+            heapq.heappush(self.parked.setdefault(host, []),
+                           (inv.priority, next(self.parked_seq), inv))
+            return False
+
+    def __release_host(self, host: str, urgent: bool = False) -> common.Invocation | None:
+        """
+        Frees a request slot of the host, unless an invocation was parked
+        for it, in which case the slot is handed over to the most urgent one.
+
+        A reserved worker only takes over the most urgent invocations. It
+        frees the slot otherwise and puts the parked invocation back into
+        the event loop, where it claims the slot again, so that bulk
+        traffic never holds up a reserved worker.
+
+        :param urgent: whether the worker is reserved for the most urgent invocations
+        """
+        inv = None
+        with self.host_lock:
+            parked = self.parked.get(host)
+            if parked:
+                _, _, inv = heapq.heappop(parked)
+                if not parked:
+                    del self.parked[host]
+                if not urgent or inv.priority == PriorityQueue.TOP:
+                    return inv
+            self.in_flight[host] -= 1
+            if self.in_flight[host] == 0:
+                del self.in_flight[host]
+        if inv is not None:
+            # It already got past its rate limit
+            inv.rate_reserved = inv.rate_limit is not None
+            self.retries.put(inv, 0)
+        return None
 
-    def _wait_loop(self):
-        while (event := self.event_loop.get(True)):
-            logger.info("event incoming for processing")
-            event.invoke()
+    def _wait_loop(self, urgent: bool = False):
+        while (event := self.event_loop.get(True, urgent=urgent)):
+            if self.__throttle(event):
+                continue
+            host = event.host
+            if not self.__acquire_host(event, host):
+                continue
+            while event is not None:
+                logger.info("event incoming for processing")
+                if event.trace is not None:
+                    event.trace.mark("dispatched")
+                start = time.perf_counter()
+                dispatched = event.invoke(self.http, self.timeout)
+                if not event.mock:
+                    name = event.name or ""
+                    dispatch_seconds.observe(time.perf_counter() - start, name)
+                    dispatch_responses.inc(
+                        name, str(event.status) if event.status is not None else "error")
+                if not dispatched:
+                    self.__handle_failure(event)
+                event = self.__release_host(host, urgent)
@@ -0,0 +1,36 @@
+import time
+
+from threading import Lock
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting the invocations of one function to `rate` per
+    second, with bursts of up to `burst` invocations.
+
+    Rather than rejecting an invocation when the bucket is empty, `reserve`
+    books the next free slot and returns how long the caller must wait for
+    it, so delayed invocations stay evenly spaced.
+
+    :param rate: number of invocations per second
+    :param burst: number of invocations allowed at once
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        super(TokenBucket, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.interval = 1 / rate
+        self.tolerance = (max(burst, 1) - 1) * self.interval
+        self.next_free = 0.0
+        self.lock = Lock()
+
+    def reserve(self) -> float:
+        """
+        :returns: seconds to wait before the invocation may be sent
+        """
+        now = time.monotonic()
+        with self.lock:
+            slot = max(self.next_free, now)
+            self.next_free = slot + self.interval
+            return max(slot - self.tolerance - now, 0.0)
@@ -1,17 +1,64 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter, ValidationError
+from typing import List
+from queue import Full
 
-from common import EventRequest, Event, BaseFunction, Function, DeleteFunction
+from common import EventRequest, Event, BaseFunction, Function, DeleteFunction, ReplayRequest, \
+    ClusterEvent, FunctionEntry, Handoff, Priority
+from common.queues import Watermark
+from common.metrics import REGISTRY, CONTENT_TYPE
+from common.trace import Trace
 
 from dispatcher import Dispatcher
-from scheduler import Scheduler
+from scheduler import Scheduler, ShardedScheduler
+from cluster import ClusterNode
+import os
+import json
 import builtins
 import traceback
 
 app = FastAPI()
 
-dispatcher = Dispatcher()
-sch = Scheduler(
-    dispatcher=dispatcher.return_event_loop())
+# Metrics are collected unless disabled, in which case /metrics is not served
+REGISTRY.enabled = os.environ.get("SIF_METRICS", "1").lower() not in ("0", "false", "no")
+
+sch_queue_size = int(os.environ.get("SCH_QUEUE_SIZE", 100000))
+# With the `priority` queue kind, events and invocations are served by
+# priority, those waiting longer than SIF_PRIORITY_MAX_WAIT_MS regardless
+queue_kind = os.environ.get("SIF_QUEUE_KIND", "priority")
+queue_max_wait = float(os.environ.get("SIF_PRIORITY_MAX_WAIT_MS", 1000)) / 1000
+
+dispatcher = Dispatcher(
+    workers=int(os.environ.get("DISPATCHER_WORKERS", 16)),
+    per_host=int(os.environ.get("DISPATCHER_PER_HOST", 4)),
+    timeout=float(os.environ.get("DISPATCHER_TIMEOUT_S", 10)),
+    max_retries=int(os.environ.get("DISPATCHER_MAX_RETRIES", 5)),
+    deadletter_size=int(os.environ.get("DISPATCHER_DEADLETTER_SIZE", 1000)),
+    queue_kind=queue_kind,
+    queue_size=int(os.environ.get("DISPATCHER_QUEUE_SIZE", 100000)),
+    queue_max_wait=queue_max_wait,
+    reserved=int(os.environ.get("DISPATCHER_RESERVED_WORKERS", 1)),
+    hosts=int(os.environ.get("DISPATCHER_HOSTS", 10)))
+sch_options = dict(
+    dispatcher=dispatcher.return_event_loop(),
+    base_path=os.environ.get("SCH_DATA_PATH", "/data"),
+    snapshot_every=int(os.environ.get("SCH_SNAPSHOT_EVERY", 10000)),
+    chk_interval=float(os.environ.get("SCH_CHK_INTERVAL_MS", 50)) / 1000,
+    chk_batch=int(os.environ.get("SCH_CHK_BATCH", 256)),
+    chk_max_pending=int(os.environ.get("SCH_CHK_MAX_PENDING", 4096)),
+    queue_kind=queue_kind,
+    queue_size=sch_queue_size,
+    queue_max_wait=queue_max_wait)
+
+# With more than one shard, functions are spread over as many scheduler
+# processes, each one checkpointed under SCH_DATA_PATH/shard-<idx>
+sch_shards = int(os.environ.get("SIF_SCHEDULER_SHARDS", 1))
+if sch_shards > 1:
+    sch = ShardedScheduler(shards=sch_shards, **sch_options)
+else:
+    sch = Scheduler(**sch_options)
 
 dispatcher.wait_loop()
 sch.wait_loop()
@@ -19,28 +66,247 @@ sch.wait_loop()
 sch_evt_loop = sch.return_event_loop()
 
 
+def submit_event(evt: Event, block: bool = True):
+    sch_evt_loop.put(evt, block)
+
+
+# In cluster mode, SIF_CLUSTER_SELF is the URL the other replicas, listed
+# in SIF_CLUSTER_PEERS, reach this one at
+cluster_url = os.environ.get("SIF_CLUSTER_SELF")
+node = None
+if cluster_url:
+    node = ClusterNode(
+        cluster_url,
+        [peer.strip() for peer in os.environ.get("SIF_CLUSTER_PEERS", "").split(",") if peer.strip()],
+        sch, submit_event,
+        base_path=sch_options["base_path"],
+        heartbeat=float(os.environ.get("SIF_CLUSTER_HEARTBEAT_S", 1)),
+        failures=int(os.environ.get("SIF_CLUSTER_FAILURES", 3)))
+
+
+def route_event(evt: Event, block: bool = True):
+    if node is not None:
+        node.handle_event(evt, block=block)
+    else:
+        submit_event(evt, block)
+
+# Past the high watermark, new events are rejected until the scheduler
+# drained its queue down to the low watermark
+sch_watermark = Watermark(
+    sch_evt_loop,
+    high=int(os.environ.get("SCH_QUEUE_HIGH_WATERMARK", sch_queue_size * 0.8)),
+    low=int(os.environ.get("SCH_QUEUE_LOW_WATERMARK", sch_queue_size * 0.5)))
+retry_after = os.environ.get("SCH_RETRY_AFTER_S", "1")
+
+REGISTRY.gauge("sif_scheduler_queue_depth", "Events waiting for the scheduler",
+               sch_evt_loop.qsize)
+REGISTRY.gauge("sif_dispatcher_queue_depth", "Invocations waiting for a dispatcher worker",
+               dispatcher.event_loop.qsize)
+REGISTRY.gauge("sif_dispatcher_retry_queue_depth", "Invocations waiting for another attempt or their rate limit",
+               lambda: len(dispatcher.retries))
+REGISTRY.gauge("sif_checkpoint_pending", "Changes waiting to be written to the checkpoint",
+               lambda: sch.checkpoint_stats()["pending"])
+received_events = REGISTRY.counter("sif_events_received_total", "Events accepted by the API")
+rejected_requests = REGISTRY.counter(
+    "sif_events_rejected_total", "Event requests rejected because the scheduler is overloaded")
+
+
+def check_backpressure():
+    if sch_watermark.is_overloaded():
+        rejected_requests.inc()
+        raise HTTPException(status_code=429, detail="Scheduler queue is overloaded",
+                            headers={"Retry-After": retry_after})
+
+
 @app.post("/api/event")
-def handle_event(evt_req: EventRequest):
-    evt = Event(evt_req.name, data=evt_req.data)
-    sch_evt_loop.put(evt, True)
+def handle_event(evt_req: EventRequest, request: Request):
+    # Critical events are still accepted while the scheduler is overloaded,
+    # they skip ahead of the events it is behind with
+    if evt_req.priority != Priority.CRITICAL:
+        check_backpressure()
+    trace = Trace.from_headers(request.headers)
+    if trace is not None:
+        trace.mark("received")
+    evt = Event(evt_req.name, data=evt_req.data, trace=trace, priority=evt_req.priority)
+    route_event(evt)
+    received_events.inc()
     return
 
 
+events_adapter = TypeAdapter(List[EventRequest])
+
+
+async def enqueue_event(evt: Event):
+    # Blocking on a full queue must not stall the server's event loop,
+    # while not reading further meanwhile pushes back on the client
+    try:
+        route_event(evt, False)
+    except Full:
+        await run_in_threadpool(route_event, evt, True)
+
+
+async def ingest_line(line: bytes, lineno: int, errors: List[dict]) -> int:
+    if not line.strip():
+        return 0
+    try:
+        evt_req = EventRequest.model_validate_json(line)
+    except ValidationError as err:
+        errors.append({"line": lineno, "error": str(err)})
+        return 0
+    await enqueue_event(Event(evt_req.name, data=evt_req.data, priority=evt_req.priority))
+    return 1
+
+
+@app.post("/api/events")
+async def handle_events(request: Request):
+    """
+    Accepts many events at once, either as a JSON array of `EventRequest`
+    or as a `application/x-ndjson` stream with one `EventRequest` per line.
+    Events are enqueued in the given order. A JSON array is validated as a
+    whole, while invalid lines of a stream are skipped and reported.
+    """
+    check_backpressure()
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        accepted, errors = 0, []
+        lineno, pending = 0, b""
+        async for chunk in request.stream():
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                lineno += 1
+                accepted += await ingest_line(line, lineno, errors)
+        accepted += await ingest_line(pending, lineno + 1, errors)
+        received_events.inc(amount=accepted)
+        return {"accepted": accepted, "rejected": len(errors), "errors": errors}
+
+    try:
+        evt_reqs = events_adapter.validate_json(await request.body())
+    except ValidationError as err:
+        raise HTTPException(status_code=422, detail=json.loads(err.json()))
+    for evt_req in evt_reqs:
+        await enqueue_event(Event(evt_req.name, data=evt_req.data, priority=evt_req.priority))
+    received_events.inc(amount=len(evt_reqs))
+    return {"accepted": len(evt_reqs), "rejected": 0, "errors": []}
+
+
 @app.post("/api/function")
 def register_fn(fn_data: BaseFunction):
+    if node is not None:
+        node.register(fn_data)
+        return
     fn = Function(fn_data.name, fn_data.subs, fn_data.url,
-                  fn_data.mock, fn_data.method)
+                  fn_data.mock, fn_data.method, fn_data.window, fn_data.coalesce,
+                  fn_data.rate_limit, fn_data.filters, fn_data.priority)
     sch.register_fn(fn)
     return
 
 
+@app.post("/api/functions")
+def register_fns(fn_datas: List[BaseFunction]):
+    """
+    Registers or replaces many functions at once. Either every function is
+    registered, with a single checkpoint record, or none of them is.
+    """
+    names = [fn_data.name for fn_data in fn_datas]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=422, detail="Function names must be distinct")
+    if node is not None:
+        node.register_many(fn_datas)
+    else:
+        sch.register_fns([Function(fn_data.name, fn_data.subs, fn_data.url,
+                                   fn_data.mock, fn_data.method, fn_data.window,
+                                   fn_data.coalesce, fn_data.rate_limit, fn_data.filters,
+                                   fn_data.priority)
+                          for fn_data in fn_datas])
+    return {"registered": len(fn_datas)}
+
+
 @app.delete("/api/function")
 def delete_fn(fn_data: DeleteFunction):
+    if node is not None:
+        node.delete(fn_data.name)
+        return
     sch.delete_fn(fn_data.name)
     return
 
 
 @app.get("/api/status")
-def status_fn():
-    return sch.status_sch()
+def status_fn(request: Request):
+    etag, _, encoded = sch.status_view.current()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(encoded, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/api/status/stream")
+def status_stream_fn():
+    return StreamingResponse(sch.status_view.stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
+
+@app.get("/api/status/checkpoint")
+def checkpoint_status_fn():
+    return sch.checkpoint_stats()
+
+
+@app.get("/api/status/dispatcher")
+def dispatcher_status_fn():
+    return dispatcher.stats()
+
+
+@app.get("/api/deadletter")
+def deadletter_fn():
+    return dispatcher.deadletter.list()
+
+
+@app.post("/api/deadletter/replay")
+def replay_deadletter_fn(replay: ReplayRequest | None = None):
+    ids = replay.ids if replay is not None else None
+    return {"replayed": dispatcher.replay_deadletter(ids)}
+
+
+@app.get("/metrics")
+def metrics_fn():
+    if not REGISTRY.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def cluster_node() -> ClusterNode:
+    if node is None:
+        raise HTTPException(status_code=404, detail="Cluster mode is disabled")
+    return node
+
+
+@app.get("/api/cluster/health")
+def cluster_health_fn():
+    return cluster_node().status()
+
+
+@app.get("/api/cluster/directory")
+def cluster_directory_fn():
+    return cluster_node().list_directory()
+
+
+@app.post("/api/cluster/function")
+def cluster_function_fn(entry: FunctionEntry):
+    return {"applied": cluster_node().apply(entry)}
+
+
+@app.post("/api/cluster/functions")
+def cluster_functions_fn(entries: List[FunctionEntry]):
+    return {"applied": cluster_node().merge(entries)}
+
+
+@app.post("/api/cluster/event")
+def cluster_event_fn(msg: ClusterEvent, request: Request):
+    trace = Trace.from_headers(request.headers)
+    if trace is not None:
+        trace.mark("forwarded")
+    cluster_node().receive_event(msg, trace)
+    return
+
+
+@app.post("/api/cluster/handoff")
+def cluster_handoff_fn(handoff: Handoff):
+    cluster_node().receive_handoff(handoff)
+    return
@@ -1,3 +1,4 @@
 from .sch import Scheduler
+from .shards import ShardedScheduler
 
-__all__ = ["Scheduler"]
+__all__ = ["Scheduler", "ShardedScheduler"]
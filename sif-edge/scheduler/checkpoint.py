@@ -0,0 +1,303 @@
+"""
+Binary checkpoint of the scheduler state.
+
+A checkpoint is laid out as::
+
+    header    magic, format version, number of functions
+    strings   JSON list of every distinct name, URL, method and topic
+    data      JSON list of the data of every buffered event
+    filters   JSON list of the conditions of every filter
+    sizes     number of topic subscriptions, topics and buffered events
+    functions one fixed-size record per function
+    topics    indexes in the strings of the topics of every function
+    counts    number of events buffered per topic of every function
+    created   creation time of every buffered event
+    names     indexes in the strings of the topic of every buffered event
+    priority  priority of every function, then of every buffered event
+    footer    CRC32 of everything before it
+
+Every section is decoded at once, strings and event data by the C JSON
+decoder and the records and arrays by :mod:`struct`, while functions are
+rebuilt without going through their constructors, which keeps restoring
+large registries fast. Every version of the format keeps its decoder in
+:data:`DECODERS`, so that older checkpoints stay readable once the format
+evolves.
+
+Version 2 added the topic of every buffered event, which differs from the
+topic it is buffered under once subscribed to a pattern, version 3 the
+filters of the functions and version 4 the priorities.
+"""
+import gc
+import json
+import time
+import zlib
+import struct
+
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List
+
+import common
+
+from common import RateLimit
+from common.join import JoinBuffer, EvictionPolicy
+from common.filters import EventFilter
+from common.priority import Priority
+from common.status import EventStatus
+from common.topics import is_pattern
+
+MAGIC = b"SIFC"
+VERSION = 4
+
+HEADER = struct.Struct(">4sHI")
+FOOTER = struct.Struct(">I")
+BLOB = struct.Struct(">I")
+SIZES = struct.Struct(">III")
+# Name, URL and method as indexes in the strings, flags, eviction policy,
+# coalesce, max events, max age, rate, burst, last invocation, number of
+# evicted events, of subscriptions and of distinct topics
+FUNCTION = struct.Struct(">IIIBBiIddIqIHH")
+
+MOCK = 0x01
+MAX_EVENTS = 0x02
+MAX_AGE = 0x04
+RATE_LIMIT = 0x08
+LAST_INVOKE = 0x10
+FILTER = 0x20
+
+POLICIES = list(EvictionPolicy)
+PRIORITIES = list(Priority)
+COALESCE_LATEST = -1
+
+
+class CheckpointError(ValueError):
+    """
+    The checkpoint is corrupt, truncated or of an unknown version
+    """
+
+
+def _blob(values: List[Any]) -> bytes:
+    data = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return BLOB.pack(len(data)) + data
+
+
+def dumps(fns: List[common.Function]) -> bytes:
+    """
+    Encodes the functions, buffered events included, as a checkpoint of the
+    current version
+    """
+    strings: Dict[str, int] = {}
+    data: List[Any] = []
+    records: List[bytes] = []
+    subs: List[int] = []
+    counts: List[int] = []
+    created: List[int] = []
+    names: List[int] = []
+    filters: List[Any] = []
+    priorities: List[int] = []
+    evt_priorities: List[int] = []
+
+    def index(value: str) -> int:
+        idx = strings.get(value)
+        if idx is None:
+            idx = strings[value] = len(strings)
+        return idx
+
+    for fn in fns:
+        join = fn.join
+        flags = (MOCK if fn.mock else 0) | \
+            (MAX_EVENTS if join.max_events is not None else 0) | \
+            (MAX_AGE if join.max_age is not None else 0) | \
+            (RATE_LIMIT if fn.rate_limit is not None else 0) | \
+            (LAST_INVOKE if fn.last_invoke is not None else 0) | \
+            (FILTER if fn.filter is not None else 0)
+        if fn.filter is not None:
+            filters.append(fn.filter.specs)
+        priorities.append(fn.priority)
+        coalesce = COALESCE_LATEST if fn.coalesce == "latest" else (fn.coalesce or 0)
+        records.append(FUNCTION.pack(
+            index(fn.name), index(fn.ref), index(fn.method), flags,
+            POLICIES.index(join.policy), coalesce, join.max_events or 0, join.max_age or 0.0,
+            fn.rate_limit.rate if fn.rate_limit else 0.0,
+            fn.rate_limit.burst if fn.rate_limit else 0,
+            fn.last_invoke or 0, join.evicted, len(fn.subs), len(join.topics)))
+        subs.extend(index(topic) for topic in fn.subs)
+        for topic in join.topics:
+            buf = join.buffers[topic]
+            counts.append(len(buf))
+            for evt in buf:
+                created.append(evt.created_ns)
+                names.append(index(evt.name))
+                evt_priorities.append(evt.priority)
+                data.append(evt.data)
+
+    body = b"".join([
+        HEADER.pack(MAGIC, VERSION, len(fns)), _blob(list(strings)), _blob(data), _blob(filters),
+        SIZES.pack(len(subs), len(counts), len(created)), *records,
+        struct.pack(f">{len(subs)}I", *subs), struct.pack(f">{len(counts)}I", *counts),
+        struct.pack(f">{len(created)}q", *created), struct.pack(f">{len(names)}I", *names),
+        bytes(priorities), bytes(evt_priorities)])
+    return body + FOOTER.pack(zlib.crc32(body))
+
+
+class _Reader(object):
+    def __init__(self, data: bytes, pos: int = 0):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def records(self, fmt: struct.Struct, count: int) -> Iterator[tuple]:
+        start = self.pos
+        self.pos += fmt.size * count
+        return fmt.iter_unpack(self.data[start:self.pos])
+
+    def array(self, code: str, size: int) -> tuple:
+        values = struct.unpack_from(f">{size}{code}", self.data, self.pos)
+        self.pos += size * struct.calcsize(code)
+        return values
+
+    def blob(self) -> List[Any]:
+        (size,) = self.unpack(BLOB)
+        start = self.pos
+        self.pos += size
+        return json.loads(str(self.data[start:self.pos], "utf-8"))
+
+
+def _decode(reader: _Reader, count: int, version: int) -> List[common.Function]:
+    """
+    Rebuilds the functions without going through the constructors, as they
+    validate what was already validated before checkpointing
+    """
+    named = version >= 2
+    strings = reader.blob()
+    data = reader.blob()
+    filters = iter(reader.blob()) if version >= 3 else iter(())
+    n_subs, n_topics, n_events = reader.unpack(SIZES)
+    records = reader.records(FUNCTION, count)
+    subs = [strings[idx] for idx in reader.array("I", n_subs)]
+    counts = reader.array("I", n_topics)
+    created = reader.array("q", n_events)
+    names = [strings[idx] for idx in reader.array("I", n_events)] if named else None
+    if version >= 4:
+        priorities = [PRIORITIES[value] for value in reader.array("B", count)]
+        evt_priorities = [PRIORITIES[value] for value in reader.array("B", n_events)]
+    else:
+        priorities = evt_priorities = None
+    if reader.pos != len(reader.data) or len(data) != n_events:
+        raise CheckpointError("Checkpoint sections do not match their sizes")
+
+    # Buffered events keep their age across restarts
+    offset = time.monotonic_ns() - time.time_ns()
+    new_event, new_join, new_fn = common.Event.__new__, JoinBuffer.__new__, common.Function.__new__
+    Event, Function, status = common.Event, common.Function, EventStatus.CREATED
+    normal = Priority.NORMAL
+    sub_pos = topic_pos = evt_pos = 0
+    fns = []
+    for fn_pos, (name, ref, method, flags, policy, coalesce, max_events, max_age, rate, burst, \
+            last_invoke, evicted, fn_subs, fn_topics) in enumerate(records):
+        fn_sub_names = subs[sub_pos:sub_pos + fn_subs]
+        sub_pos += fn_subs
+        topics = list(dict.fromkeys(fn_sub_names))
+        if len(topics) != fn_topics:
+            raise CheckpointError(f"Function {strings[name]} has inconsistent topics")
+
+        join = new_join(JoinBuffer)
+        join.topics = topics
+        join.buffers = buffers = {}
+        missing = 0
+        for topic in topics:
+            buf = deque()
+            for _ in range(counts[topic_pos]):
+                evt = new_event(Event)
+                evt.name = names[evt_pos] if named else topic
+                evt.data = data[evt_pos]
+                evt.status = status
+                evt.created_ns = created[evt_pos]
+                evt.monotonic_ns = created[evt_pos] + offset
+                evt.trace = None
+                evt.fragment = None
+                evt.priority = evt_priorities[evt_pos] if evt_priorities else normal
+                buf.append(evt)
+                evt_pos += 1
+            if not buf:
+                missing += 1
+            buffers[topic] = buf
+            topic_pos += 1
+        join.missing = missing
+        join.policy = POLICIES[policy]
+        if flags & MAX_EVENTS:
+            join.max_events = max_events
+        if flags & MAX_AGE:
+            join.max_age = max_age
+        join.evicted = evicted
+        join.patterns = frozenset(topic for topic in topics if is_pattern(topic))
+
+        fn = new_fn(Function)
+        fn.__dict__.update(
+            name=strings[name], ref=strings[ref], method=strings[method], subs=fn_sub_names,
+            join=join, mock=bool(flags & MOCK),
+            coalesce="latest" if coalesce == COALESCE_LATEST else (coalesce or None),
+            rate_limit=RateLimit(rate=rate, burst=burst) if flags & RATE_LIMIT else None,
+            last_invoke=last_invoke if flags & LAST_INVOKE else None,
+            filter=EventFilter(next(filters)) if flags & FILTER else None,
+            priority=priorities[fn_pos] if priorities else normal)
+        fns.append(fn)
+    return fns
+
+
+def _decode_v1(reader: _Reader, count: int) -> List[common.Function]:
+    return _decode(reader, count, 1)
+
+
+def _decode_v2(reader: _Reader, count: int) -> List[common.Function]:
+    return _decode(reader, count, 2)
+
+
+def _decode_v3(reader: _Reader, count: int) -> List[common.Function]:
+    return _decode(reader, count, 3)
+
+
+def _decode_v4(reader: _Reader, count: int) -> List[common.Function]:
+    return _decode(reader, count, 4)
+
+
+# Decoders of every version of the format
+DECODERS: Dict[int, Callable[[_Reader, int], List[common.Function]]] = {1: _decode_v1, 2: _decode_v2, 3: _decode_v3, 4: _decode_v4}
+
+
+def loads(data: bytes) -> List[common.Function]:
+    """
+    Decodes a checkpoint of any known version
+
+    :raises CheckpointError: the checkpoint is corrupt or of an unknown version
+    """
+    if len(data) < HEADER.size + FOOTER.size:
+        raise CheckpointError("Checkpoint is truncated")
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise CheckpointError("Not a scheduler checkpoint")
+    if version not in DECODERS:
+        raise CheckpointError(f"Unsupported checkpoint version {version}")
+    body = data[:-FOOTER.size]
+    (crc,) = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    if zlib.crc32(body) != crc:
+        raise CheckpointError("Checkpoint checksum mismatch")
+
+    # The decoded objects all stay alive, so collecting while allocating
+    # them is wasted time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return DECODERS[version](_Reader(body, HEADER.size), count)
+    except (struct.error, UnicodeDecodeError, ValueError, IndexError, StopIteration) as err:
+        raise CheckpointError(f"Checkpoint is malformed: {err}")
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def is_checkpoint(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, Mapping, Tuple
+
+import common
+
+from common.topics import TopicTrie, is_pattern
+
+
+class RoutingTable(object):
+    """
+    Immutable snapshot of the functions subscribed to every topic, so routing
+    one event only touches the subscribers of its topic instead of the whole
+    registry.
+
+    Subscriptions to exact topics are kept in a map, those to patterns with
+    wildcards in a :class:`TopicTrie <common.topics.TopicTrie>`, so that
+    looking up a topic costs a dictionary access plus a walk along its levels
+    rather than a match against every pattern.
+
+    Readers use a table without locking. Writers derive a new table with
+    :meth:`replace` and publish it by swapping a single reference, hence a
+    reader sees either the old or the new table as a whole. Deriving a table
+    copies the topic map and the subscribers of the touched topics only, and
+    registering many functions at once costs a single copy.
+
+    :param subscribers: functions subscribed to every exact topic
+    :param patterns: functions subscribed to every pattern
+    """
+
+    __slots__ = ("subscribers", "patterns")
+
+    def __init__(self, subscribers: Mapping[str, Tuple[common.Function, ...]] | None = None,
+                 patterns: TopicTrie | None = None):
+        super(RoutingTable, self).__init__()
+        self.subscribers: Mapping[str, Tuple[common.Function, ...]] = subscribers or {}
+        self.patterns: TopicTrie = patterns or TopicTrie()
+
+    def lookup(self, topic: str) -> Tuple[common.Function, ...]:
+        fns = self.subscribers.get(topic, ())
+        if not self.patterns:
+            return fns
+        matched = self.patterns.match(topic)
+        if not matched:
+            return fns
+        # A function subscribed to several matching topics is routed once
+        return tuple({id(fn): fn for fn in (*fns, *matched)}.values())
+
+    def get(self, topic: str) -> Tuple[common.Function, ...]:
+        """
+        Functions subscribed to the topic or pattern as such
+        """
+        if is_pattern(topic):
+            return self.patterns.get(topic)
+        return self.subscribers.get(topic, ())
+
+    def replace(self, added: Iterable[common.Function] = (),
+                removed: Iterable[common.Function] = ()) -> "RoutingTable":
+        """
+        Derives the table where the `removed` functions no longer receive
+        events and the `added` ones do
+        """
+        touched: Dict[str, Dict[int, common.Function]] = {}
+
+        def subscribers(topic: str) -> Dict[int, common.Function]:
+            subs = touched.get(topic)
+            if subs is None:
+                subs = touched[topic] = {id(fn): fn for fn in self.get(topic)}
+            return subs
+
+        for fn in removed:
+            for topic in set(fn.subs):
+                subscribers(topic).pop(id(fn), None)
+        for fn in added:
+            for topic in set(fn.subs):
+                subscribers(topic)[id(fn)] = fn
+
+        topics = dict(self.subscribers)
+        patterns = {}
+        for topic, subs in touched.items():
+            if is_pattern(topic):
+                patterns[topic] = subs.values()
+            elif subs:
+                topics[topic] = tuple(subs.values())
+            else:
+                topics.pop(topic, None)
+        return RoutingTable(topics, self.patterns.update(patterns) if patterns else self.patterns)
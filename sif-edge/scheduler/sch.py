@@ -1,129 +1,381 @@
 from abc import ABC
-from typing import List
+from typing import Dict, List, Tuple
 from threading import Thread, Lock
-from multiprocessing import Queue
 
+import gc
 import os
+import time
 import pickle
 import common
 import traceback
 import logging
 
+from common.queues import BaseQueue, create_queue
+from common.metrics import REGISTRY
+
+from . import checkpoint
+from .index import RoutingTable
+from .status import StatusView
+from .wal import WriteAheadLog
+from .writer import CheckpointWriter
+
 logger = logging.getLogger("uvicorn.error")
 
 logging.getLogger("requests").setLevel(logging.INFO)
 
+update_event_seconds = REGISTRY.histogram(
+    "sif_scheduler_update_event_seconds", "Time spent handing an event over to a function")
+lock_hold_seconds = REGISTRY.histogram(
+    "sif_scheduler_lock_hold_seconds", "Time the routing lock is held to route an event")
+routed_events = REGISTRY.counter(
+    "sif_scheduler_events_total", "Events routed to at least one function")
+filtered_events = REGISTRY.counter(
+    "sif_scheduler_filtered_events_total", "Events dropped by the filters of a subscribed function")
+
+# Snapshot written before the binary checkpoint format, migrated on start
+LEGACY_CHK_NAME = "scheduler.pkl"
+
 class Scheduler(ABC):
-    def __init__(self, dispatcher: "Queue[common.Invocation]",
-                 base_path: str = "/data", chk_name: str = "scheduler.pkl"):
+    """
+    Routes incoming events to the subscribed functions and hands the
+    resulting invocations over to the dispatcher.
+
+    The subscribers of every topic are published as an immutable
+    :class:`RoutingTable <index.RoutingTable>`. Registrations change the
+    registry and derive a new table under `lock`, which serializes the
+    writers, then swap the table in, so neither building a table nor reading
+    the status ever stalls routing.
+    `route_lock` is held while one event is handed over to the functions,
+    and taken by writers only to log their change and swap the table, so
+    that the write-ahead log follows the order in which changes and events
+    were applied.
+
+    The state is persisted as a snapshot (`chk_name`) plus a write-ahead log
+    (`wal_name`) of the changes applied since. Once the log holds
+    `snapshot_every` records, a new snapshot is taken and the log truncated.
+    Writing happens in a background :class:`CheckpointWriter <writer.CheckpointWriter>`,
+    which groups the changes of `chk_interval` seconds, or `chk_batch`
+    changes, into a single write.
+
+    Snapshots use the versioned binary format of :mod:`checkpoint <scheduler.checkpoint>`.
+    A pickled snapshot, as written by earlier releases to `scheduler.pkl`,
+    is migrated on start: it is restored, written anew in the binary format
+    and set aside with a `.migrated` suffix.
+
+    :param dispatcher: queue where the invocations are submitted
+    :param base_path: directory holding the checkpoint files
+    :param chk_name: name of the snapshot file
+    :param wal_name: name of the write-ahead log file
+    :param snapshot_every: number of log records triggering a new snapshot
+    :param chk_interval: maximum number of seconds a change waits to be written
+    :param chk_batch: number of pending changes triggering a write
+    :param chk_max_pending: maximum number of changes that may be lost upon a crash
+    :param queue_kind: kind of queue receiving the events, see :func:`create_queue <common.queues.create_queue>`
+    :param queue_size: maximum number of queued events
+    :param queue_max_wait: seconds after which a queued event is routed regardless of its priority
+    """
+
+    def __init__(self, dispatcher: BaseQueue,
+                 base_path: str = "/data", chk_name: str = "scheduler.chk",
+                 wal_name: str = "scheduler.wal", snapshot_every: int = 10000,
+                 chk_interval: float = 0.05, chk_batch: int = 256,
+                 chk_max_pending: int = 4096, queue_kind: str = "priority",
+                 queue_size: int = 100000, queue_max_wait: float = 1.0):
         self.chk_name = chk_name
+        self.wal_name = wal_name
         self.base_path = base_path
-        self.function_loop: List[common.Function] = []
-        self.event_loop: Queue[common.Event] = Queue()
-        self.dispatcher: Queue[common.Invocation] = dispatcher
+        self.snapshot_every = snapshot_every
+        # Number of records submitted to the writer when the last snapshot
+        # was taken
+        self.snapshot_at = 0
+        self.snapshot_due = False
+        # Registered functions by name, in registration order, changed and
+        # read under `lock`, while routing only reads `table`
+        self.functions: Dict[str, common.Function] = {}
+        self.table = RoutingTable()
+        self.status_view = StatusView()
+        self.event_loop: BaseQueue = create_queue(queue_kind, queue_size, queue_max_wait)
+        self.dispatcher: BaseQueue = dispatcher
         self.lock = Lock()
-        self.fn_names = []
+        self.route_lock = Lock()
         super(Scheduler, self).__init__()
         self.restore_chk(os.path.join(base_path, chk_name))
+        self.writer = CheckpointWriter(WriteAheadLog(os.path.join(base_path, wal_name)),
+                                       os.path.join(base_path, chk_name),
+                                       interval=chk_interval, max_batch=chk_batch,
+                                       max_pending=chk_max_pending)
 
-    def return_event_loop(self) -> Queue:
+    def return_event_loop(self) -> BaseQueue:
         return self.event_loop
 
-    def __reg_fn(self, fn: common.Function):
-        logger.info(f"Registering function with name {fn.name}")
-        self.function_loop.append(fn)
-        self.fn_names.append(fn.name)
-        path = os.path.join(self.base_path, self.chk_name)
-        self.handle_chk(path)
+    def __publish(self, table: RoutingTable, *record):
+        """
+        Logs the change and swaps in the table reflecting it, once the
+        routing of the current event, if any, is done
+
+        Requires `lock`
+        """
+        with self.route_lock:
+            self.log(*record)
+            self.table = table
+        if self.snapshot_due:
+            with self.route_lock:
+                self.__snapshot()
 
     def register_fn(self, fn: common.Function):
-        self.lock.acquire(blocking=True)
-        if fn.name not in self.fn_names:
-            self.__reg_fn(fn)
-        else:
-            logger.warning(
-                f"Function with name {fn.name} already exists... Recreating...")
-            self.__del_fn(fn.name)
-            self.__reg_fn(fn)
-            logger.info(f"Function with name {fn.name} has been recreated!")
-        self.lock.release()
+        self.register_fns([fn])
+
+    def register_fns(self, fns: List[common.Function]):
+        """
+        Registers the functions, replacing those of the same name, as a
+        single change of the state: a single record of the write-ahead log
+        holds them all, so either all or none of them survive a crash
+
+        :raises ValueError: two functions share the same name
+        """
+        names = [fn.name for fn in fns]
+        if len(set(names)) != len(names):
+            raise ValueError("Functions registered at once must have distinct names")
+        if not fns:
+            return
+        record = checkpoint.dumps(fns)
+        with self.lock:
+            replaced = []
+            for fn in fns:
+                old = self.functions.pop(fn.name, None)
+                if old is not None:
+                    logger.warning(f"Function with name {fn.name} already exists... Recreating...")
+                    replaced.append(old)
+                else:
+                    logger.info(f"Registering function with name {fn.name}")
+                self.functions[fn.name] = fn
+            table = self.table.replace(added=fns, removed=replaced)
+            self.__publish(table, WriteAheadLog.REGISTER, record)
+            for fn in fns:
+                self.status_view.update(fn)
+
+    @staticmethod
+    def load_chk(path: str) -> Tuple[List[common.Function], bool]:
+        """
+        Reads a snapshot, whether binary or pickled by an earlier release
+
+        :returns: the functions and whether the snapshot needs to be migrated
+        """
+        with open(path, "rb") as chk:
+            data = chk.read()
+        if checkpoint.is_checkpoint(data):
+            return checkpoint.loads(data), False
+        return pickle.loads(data), True
 
     def restore_chk(self, path: str):
+        # Every restored object stays alive, so collecting while restoring
+        # large registries is wasted time
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.__restore_chk(path)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def __restore_chk(self, path: str):
+        legacy_path = os.path.join(self.base_path, LEGACY_CHK_NAME)
+        migrated = None
+        start = time.perf_counter()
         if os.path.isfile(path):
-            with open(path, "rb") as chk:
-                self.function_loop = pickle.load(chk)
+            fns, legacy = Scheduler.load_chk(path)
+            migrated = path if legacy else None
+        elif os.path.isfile(legacy_path):
+            fns, _ = Scheduler.load_chk(legacy_path)
+            migrated = legacy_path
+        else:
+            fns = []
+        functions = {fn.name: fn for fn in fns}
+        if fns:
+            logger.info(f"Restored {len(fns)} functions from {migrated or path} "
+                        f"in {time.perf_counter() - start:.3f}s")
+
+        replayed = 0
+        wal_path = os.path.join(self.base_path, self.wal_name)
+        for record in WriteAheadLog.replay(wal_path):
+            Scheduler.apply(functions, record)
+            replayed += 1
+
+        self.functions = functions
+        self.table = RoutingTable().replace(added=functions.values())
+        for fn in functions.values():
+            self.status_view.update(fn)
+        if self.functions:
             print("The following functions have been restored:")
-            for fn in self.function_loop:
-                self.fn_names.append(fn.name)
+            for fn in self.functions.values():
                 logger.info(fn.print())
 
-    def __del_fn(self, name: str):
-        del_idx = -1
-        for idx, fn in enumerate(self.function_loop):
-            if fn.name == name:
-                del_idx = idx
-
-        if del_idx >= 0:
-            del self.function_loop[del_idx]
-            self.fn_names.remove(name)
-            path = os.path.join(self.base_path, self.chk_name)
+        if replayed:
+            logger.info(f"Replayed {replayed} records from {wal_path}")
+        if replayed or migrated:
             self.handle_chk(path)
+        if replayed:
+            os.truncate(wal_path, 0)
+        if migrated is not None:
+            if migrated != path:
+                os.replace(migrated, f"{migrated}.migrated")
+            logger.info(f"Migrated pickled checkpoint {migrated} to {path}")
+
+    @staticmethod
+    def apply(functions: Dict[str, common.Function], record: tuple):
+        """
+        Replays a record of the write-ahead log on the registry being restored
+        """
+        kind, *args = record
+        if kind == WriteAheadLog.REGISTER:
+            # Logs written by earlier releases pickled the function itself
+            fns = [args[0]] if isinstance(args[0], common.Function) else checkpoint.loads(args[0])
+            for fn in fns:
+                functions.pop(fn.name, None)
+                functions[fn.name] = fn
+        elif kind == WriteAheadLog.DELETE:
+            functions.pop(args[0], None)
+        elif kind == WriteAheadLog.EVENT:
+            evt, names = args
+            for name in names:
+                fn = functions.get(name)
+                if fn is not None:
+                    fn.update_event(evt)
+        elif kind == WriteAheadLog.INVOKE:
+            fn = functions.get(args[0])
+            if fn is not None and fn.join.is_complete():
+                fn.join.pop()
+                # Logs written by earlier releases only hold the name
+                if len(args) > 1:
+                    fn.last_invoke = args[1]
+
+    def log(self, *record):
+        """
+        Appends a state change to the write-ahead log. Once it grows past
+        `snapshot_every` records, a new snapshot is due, taken as soon as
+        both `lock` and `route_lock` can be held
+
+        Requires `route_lock`
+        """
+        self.writer.append(WriteAheadLog.encode(*record))
+        if self.writer.submitted - self.snapshot_at >= self.snapshot_every:
+            self.snapshot_due = True
+
+    def __snapshot(self):
+        """
+        Requires `lock` and `route_lock`, so that the snapshot holds every
+        change logged before it
+        """
+        if not self.snapshot_due:
+            return
+        self.writer.snapshot(checkpoint.dumps(list(self.functions.values())))
+        self.snapshot_at = self.writer.submitted
+        self.snapshot_due = False
 
     def delete_fn(self, name: str):
-        self.lock.acquire(True)
-        self.__del_fn(name)
-        self.lock.release()
+        self.take_fn(name)
+
+    def take_fn(self, name: str) -> common.Function | None:
+        """
+        Deletes the function and returns it, with its buffered events, e.g.,
+        to move it to another replica
+        """
+        with self.lock:
+            fn = self.functions.pop(name, None)
+            if fn is None:
+                return None
+            self.__publish(self.table.replace(removed=[fn]), WriteAheadLog.DELETE, name)
+            self.status_view.remove(name)
+        return fn
 
     def generate_invocation(self, fn: common.Function):
-        path = os.path.join(self.base_path, self.chk_name)
-        # self.function_loop.remove(fn)
-        self.handle_chk(path)
         inv = fn.generate_invocation()
+        self.log(WriteAheadLog.INVOKE, fn.name, fn.last_invoke)
         self.dispatcher.put(inv, True)
 
     def handle_chk(self, path: str):
-        with open(path, "wb") as chk:
-            pickle.dump(self.function_loop, chk)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as chk:
+            chk.write(checkpoint.dumps(list(self.functions.values())))
+            chk.flush()
+            os.fsync(chk.fileno())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        """
+        Writes the pending state changes and stops the checkpoint writer
+        """
+        self.writer.close()
+
+    def checkpoint_stats(self):
+        return self.writer.stats()
+
+    def function_names(self) -> List[str]:
+        """
+        Names of the registered functions
+        """
+        with self.lock:
+            return list(self.functions)
 
     def status_sch(self):
-        status = []
-        self.lock.acquire(True)
-        for fn in self.function_loop:
-            fn_status = {}
-            fn_status["subs"] = fn.subs
-            fn_status["last_invoke"] = fn.last_invoke
-            fn_status["events"] = []
-            for rdy in fn.ready:
-                evts = {"ready": [], "waiting": []}
-                for idx, evt in enumerate(rdy):
-                    if evt is None:
-                        evts["waiting"].append(fn.subs[idx])
-                    else:
-                        evts["ready"].append(fn.subs[idx])
-                fn_status["events"].append(evts)
-            fn_status["name"] = fn.name
-            status.append(fn_status)
-        self.lock.release()
+        _, status, _ = self.status_view.current()
         return status
 
     def submit_event(self):
         pass
 
     def wait_loop(self) -> Thread:
-        scheduler_thr = Thread(target=self._wait_loop)
+        scheduler_thr = Thread(target=self._wait_loop, daemon=True)
         scheduler_thr.start()
         return scheduler_thr
 
+    def route_event(self, event: common.Event) -> float:
+        """
+        Hands the event over to the functions subscribed to its topic and
+        generates the invocations of those whose requirements are fulfilled
+
+        :returns: the number of seconds `route_lock` was held
+        """
+        with self.route_lock:
+            start = time.perf_counter()
+            self.__route(event)
+            held = time.perf_counter() - start
+        if self.snapshot_due:
+            with self.lock, self.route_lock:
+                self.__snapshot()
+        return held
+
+    def __route(self, event: common.Event):
+        if event.trace is not None:
+            event.trace.mark("routed")
+        fns = self.table.lookup(event.name)
+        if not fns:
+            return
+        # Filters run before the join, and only the functions accepting the
+        # event are logged, so that replaying the log filters nothing anew
+        accepted = [fn for fn in fns if fn.filter is None or fn.filter.accepts(event)]
+        if len(accepted) != len(fns):
+            filtered_events.inc(amount=len(fns) - len(accepted))
+            for fn in set(fns).difference(accepted):
+                self.status_view.update(fn)
+            fns = accepted
+            if not fns:
+                return
+        self.log(WriteAheadLog.EVENT, event, [fn.name for fn in fns])
+        routed_events.inc()
+        for fn in fns:
+            try:
+                start = time.perf_counter()
+                ready_inv = fn.update_event(event)
+                update_event_seconds.observe(time.perf_counter() - start)
+                if ready_inv:
+                    self.generate_invocation(fn)
+                self.status_view.update(fn)
+            except Exception as errf:
+                logger.info(f"Error during generating invocations {errf}")
+                traceback.print_exc()
+
     def _wait_loop(self):
         while True:
             event = self.event_loop.get(True)
-            self.lock.acquire(blocking=True)
-            for fn in self.function_loop:
-                try:
-                    ready_inv = fn.update_event(event)
-                    if ready_inv:
-                        self.generate_invocation(fn)
-                except Exception as errf:
-                    logger.info(f"Error during generating invocations {errf}")
-                    traceback.print_exc()
-            self.lock.release()
+            lock_hold_seconds.observe(self.route_event(event))
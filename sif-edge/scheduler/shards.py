@@ -0,0 +1,381 @@
+import os
+import zlib
+import queue
+import atexit
+import logging
+import traceback
+import multiprocessing
+
+from threading import Thread, Lock, Event
+from typing import Any, Dict, List, Set, Tuple
+
+import common
+
+from common.queues import BaseQueue, LocalQueue, create_queue
+from common.topics import TopicTrie, is_pattern
+
+from .sch import Scheduler, LEGACY_CHK_NAME
+from .status import StatusView
+
+logger = logging.getLogger("uvicorn.error")
+
+# Checkpoint settings handed over to the scheduler of every shard
+SHARD_OPTIONS = ("chk_name", "wal_name", "snapshot_every", "chk_interval",
+                 "chk_batch", "chk_max_pending")
+
+
+def shard_of(name: str, shards: int) -> int:
+    """
+    Shard owning the function, stable across processes and restarts unlike
+    the builtin `hash`
+    """
+    return zlib.crc32(name.encode()) % shards
+
+
+def _run_shard(idx: int, shards: int, base_path: str, options: Dict[str, Any],
+               inbox: multiprocessing.Queue, invocations: multiprocessing.Queue,
+               updates: multiprocessing.Queue):
+    """
+    Entry point of a shard process: a regular scheduler restored from the
+    shard's own checkpoint, fed with the commands of the front-end
+    """
+    logging.basicConfig(level=logging.INFO, format=f"shard-{idx}: %(levelname)s %(message)s")
+    sch = Scheduler(dispatcher=invocations, base_path=base_path, **options)
+
+    # Functions checkpointed by this shard under another number of shards
+    # are handed back to the front-end, which registers them on their owner
+    for fn in list(sch.functions.values()):
+        if shard_of(fn.name, shards) != idx:
+            updates.put(("moved", fn))
+            sch.delete_fn(fn.name)
+
+    # The status of the restored functions precedes the notice, so that the
+    # front-end is ready with its status view complete
+    for entry in list(sch.status_view.entries.values()):
+        updates.put(("status", {"op": "update", "name": entry[0], "entry": entry}))
+    updates.put(("restored", idx, [(fn.name, fn.subs) for fn in sch.functions.values()]))
+    sch.status_view.listen(lambda delta: updates.put(("status", delta)))
+
+    while True:
+        cmd, *args = inbox.get(True)
+        try:
+            if cmd == "event":
+                sch.route_event(args[0])
+            elif cmd == "register":
+                sch.register_fns(args[0])
+            elif cmd == "delete":
+                sch.delete_fn(args[0])
+            elif cmd == "take":
+                updates.put(("reply", idx, sch.take_fn(args[0])))
+            elif cmd == "stats":
+                updates.put(("reply", idx, sch.checkpoint_stats()))
+            elif cmd == "close":
+                sch.close()
+                updates.put(("closed", idx))
+                return
+        except Exception as err:
+            logger.error(f"Failure while handling {cmd}: {err}")
+            traceback.print_exc()
+
+
+class ShardedScheduler(object):
+    """
+    Scheduler partitioning the functions across `shards` worker processes,
+    so that matching events uses as many cores as there are shards.
+
+    Functions are owned by the shard given by a stable hash of their name,
+    see :func:`shard_of`. Every shard runs a regular :class:`Scheduler <sch.Scheduler>`,
+    checkpointed under its own `shard-<idx>` directory. The front-end keeps
+    the topics each shard subscribes to and hands every event only to the
+    shards having subscribers for its topic. Invocations and status changes
+    flow back through process queues; the status view and the checkpoint
+    statistics are aggregated across shards.
+
+    On start, a checkpoint of the unsharded scheduler, or of shards beyond
+    `shards`, is loaded and its functions spread over the shards.
+
+    :param dispatcher: queue where the invocations are submitted
+    :param shards: number of worker processes
+    :param base_path: directory holding the checkpoints of the shards
+    :param queue_kind: kind of queue receiving the events, see :func:`create_queue <common.queues.create_queue>`
+    :param queue_size: maximum number of queued events
+    :param inbox_size: maximum number of events and commands waiting for every shard, a tenth of `queue_size` if not given
+    :param queue_max_wait: seconds after which a queued event is routed regardless of its priority
+    :param start_timeout: seconds to wait for the shards to restore their state
+    :param options: checkpoint settings of the shards, see :class:`Scheduler <sch.Scheduler>`
+    """
+
+    def __init__(self, dispatcher: BaseQueue, shards: int, base_path: str = "/data",
+                 queue_kind: str = "priority", queue_size: int = 100000,
+                 queue_max_wait: float = 1.0, start_timeout: float = 60.0,
+                 inbox_size: int | None = None, **options):
+        super(ShardedScheduler, self).__init__()
+        self.shards = shards
+        self.base_path = base_path
+        self.options = {key: value for key, value in options.items() if key in SHARD_OPTIONS}
+        self.event_loop: BaseQueue = create_queue(queue_kind, queue_size, queue_max_wait)
+        self.dispatcher: BaseQueue = dispatcher
+        self.status_view = StatusView()
+        self.lock = Lock()
+        # Subscriptions of every function, and per topic the number of
+        # subscribed functions of every shard, both changed under `lock`
+        self.functions: Dict[str, List[str]] = {}
+        self.topics: Dict[str, Dict[int, int]] = {}
+        # Shards subscribed to every topic and pattern, replaced as a whole
+        # on changes so that events are routed without locking
+        self.routes: Dict[str, Tuple[int, ...]] = {}
+        self.patterns = TopicTrie()
+
+        # Requests answered by the shards are sent one at a time
+        self.reply_lock = Lock()
+        self.replies: queue.Queue = queue.Queue()
+        self.restored = 0
+        self.ready = Event()
+
+        ctx = multiprocessing.get_context("spawn")
+        self.invocations = ctx.Queue()
+        self.updates = ctx.Queue()
+        # The inboxes are bounded, so that the backlog of a shard falling
+        # behind stays in the front queue, served by priority and watched
+        # for backpressure, rather than piling up in its inbox
+        if inbox_size is None:
+            inbox_size = max(queue_size // 10, 1) if queue_size > 0 else 0
+        self.inboxes = [ctx.Queue(inbox_size) for _ in range(shards)]
+        self.processes = []
+        for idx in range(shards):
+            path = os.path.join(base_path, f"shard-{idx}")
+            os.makedirs(path, exist_ok=True)
+            proc = ctx.Process(target=_run_shard, daemon=True, name=f"sif-shard-{idx}",
+                               args=(idx, shards, path, self.options, self.inboxes[idx],
+                                     self.invocations, self.updates))
+            proc.start()
+            self.processes.append(proc)
+
+        Thread(target=self._collect, daemon=True).start()
+        Thread(target=self._forward, daemon=True).start()
+        if not self.ready.wait(start_timeout):
+            raise RuntimeError(f"Only {self.restored} of {shards} shards started in time")
+        self.__adopt_orphans()
+        atexit.register(self.close)
+
+    def return_event_loop(self) -> BaseQueue:
+        return self.event_loop
+
+    def __subscribe(self, name: str, subs: List[str], touched: Set[str]):
+        idx = shard_of(name, self.shards)
+        self.__unsubscribe(name, touched)
+        self.functions[name] = subs
+        for topic in set(subs):
+            counts = self.topics.setdefault(topic, {})
+            counts[idx] = counts.get(idx, 0) + 1
+            touched.add(topic)
+
+    def __unsubscribe(self, name: str, touched: Set[str]):
+        subs = self.functions.pop(name, None)
+        if subs is None:
+            return
+        idx = shard_of(name, self.shards)
+        for topic in set(subs):
+            counts = self.topics[topic]
+            counts[idx] -= 1
+            if not counts[idx]:
+                del counts[idx]
+            if not counts:
+                del self.topics[topic]
+            touched.add(topic)
+
+    def __publish(self, touched: Set[str]):
+        """
+        Swaps in the routes of the touched topics
+
+        Requires `lock`
+        """
+        routes = dict(self.routes)
+        patterns = {}
+        for topic in touched:
+            counts = self.topics.get(topic)
+            if is_pattern(topic):
+                patterns[topic] = tuple(counts or ())
+            elif counts:
+                routes[topic] = tuple(counts)
+            else:
+                routes.pop(topic, None)
+        if patterns:
+            self.patterns = self.patterns.update(patterns)
+        self.routes = routes
+
+    def register_fn(self, fn: common.Function):
+        self.register_fns([fn])
+
+    def register_fns(self, fns: List[common.Function]):
+        """
+        Registers the functions, replacing those of the same name. Each shard
+        registers its share of them as a single change of its state
+
+        :raises ValueError: two functions share the same name
+        """
+        names = [fn.name for fn in fns]
+        if len(set(names)) != len(names):
+            raise ValueError("Functions registered at once must have distinct names")
+        per_shard: Dict[int, List[common.Function]] = {}
+        for fn in fns:
+            per_shard.setdefault(shard_of(fn.name, self.shards), []).append(fn)
+        touched: Set[str] = set()
+        with self.lock:
+            # Events routed with the new routes reach the shards once they
+            # registered the functions
+            for idx, shard_fns in per_shard.items():
+                self.inboxes[idx].put(("register", shard_fns))
+            for fn in fns:
+                self.__subscribe(fn.name, fn.subs, touched)
+            self.__publish(touched)
+
+    def delete_fn(self, name: str):
+        touched: Set[str] = set()
+        with self.lock:
+            self.__unsubscribe(name, touched)
+            self.__publish(touched)
+            self.inboxes[shard_of(name, self.shards)].put(("delete", name))
+
+    def take_fn(self, name: str, timeout: float = 5.0) -> common.Function | None:
+        """
+        Deletes the function and returns it, with its buffered events
+        """
+        touched: Set[str] = set()
+        with self.lock:
+            self.__unsubscribe(name, touched)
+            self.__publish(touched)
+        with self.reply_lock:
+            self.__drain_replies()
+            self.inboxes[shard_of(name, self.shards)].put(("take", name))
+            try:
+                _, fn = self.replies.get(True, timeout)
+            except queue.Empty:
+                return None
+        return fn
+
+    def __drain_replies(self):
+        # Replies arriving after an earlier request timed out are stale
+        while not self.replies.empty():
+            self.replies.get_nowait()
+
+    def __adopt(self, base_path: str, chk_name: str, wal_name: str):
+        """
+        Spreads the functions of a checkpoint not owned by any shard over
+        the shards, then sets its files aside
+        """
+        options = dict(self.options, chk_name=chk_name, wal_name=wal_name)
+        sch = Scheduler(dispatcher=LocalQueue(), base_path=base_path, **options)
+        fns = list(sch.functions.values())
+        sch.close()
+        self.register_fns(fns)
+        for name in (chk_name, wal_name):
+            path = os.path.join(base_path, name)
+            if os.path.exists(path):
+                os.replace(path, f"{path}.migrated")
+        logger.info(f"Spread {len(fns)} functions from {base_path} over {self.shards} shards")
+
+    def __adopt_orphans(self):
+        chk_name = self.options.get("chk_name", "scheduler.chk")
+        wal_name = self.options.get("wal_name", "scheduler.wal")
+        dirs = [self.base_path]
+        for name in sorted(os.listdir(self.base_path)):
+            if name.startswith("shard-") and name[6:].isdigit() and int(name[6:]) >= self.shards:
+                dirs.append(os.path.join(self.base_path, name))
+        for path in dirs:
+            if any(os.path.isfile(os.path.join(path, name))
+                   for name in (chk_name, wal_name, LEGACY_CHK_NAME)):
+                self.__adopt(path, chk_name, wal_name)
+
+    def close(self):
+        """
+        Stops the shards once they wrote their pending state changes
+        """
+        for idx, proc in enumerate(self.processes):
+            if proc.is_alive():
+                self.inboxes[idx].put(("close",))
+        for proc in self.processes:
+            proc.join(10)
+
+    def checkpoint_stats(self) -> Dict[str, Any]:
+        with self.reply_lock:
+            self.__drain_replies()
+            for inbox in self.inboxes:
+                inbox.put(("stats",))
+            shards: Dict[int, Dict[str, Any]] = {}
+            while len(shards) < self.shards:
+                try:
+                    idx, stats = self.replies.get(True, 5)
+                except queue.Empty:
+                    break
+                shards[idx] = stats
+
+        stats = [shards[idx] for idx in sorted(shards)]
+        writes = sum(stat["writes"] for stat in stats)
+        records = sum(stat["records"] for stat in stats)
+        return {
+            "writes": writes,
+            "records": records,
+            "snapshots": sum(stat["snapshots"] for stat in stats),
+            "pending": sum(stat["pending"] for stat in stats),
+            "max_duration_ms": max((stat["max_duration_ms"] for stat in stats), default=0.0),
+            "avg_duration_ms": (sum(stat["avg_duration_ms"] * stat["writes"] for stat in stats)
+                                / writes) if writes else 0.0,
+            "avg_records_per_write": (records / writes) if writes else 0.0,
+            "shards": stats,
+        }
+
+    def function_names(self) -> List[str]:
+        """
+        Names of the functions registered on the shards
+        """
+        with self.lock:
+            return list(self.functions)
+
+    def status_sch(self):
+        _, status, _ = self.status_view.current()
+        return status
+
+    def wait_loop(self) -> Thread:
+        scheduler_thr = Thread(target=self._wait_loop, daemon=True)
+        scheduler_thr.start()
+        return scheduler_thr
+
+    def _wait_loop(self):
+        while True:
+            event = self.event_loop.get(True)
+            shards = self.routes.get(event.name, ())
+            if self.patterns:
+                shards = set(shards).union(self.patterns.match(event.name))
+            for idx in shards:
+                self.inboxes[idx].put(("event", event))
+
+    def _forward(self):
+        while True:
+            self.dispatcher.put(self.invocations.get(True), True)
+
+    def _collect(self):
+        pending: Set[int] = set(range(self.shards))
+        while True:
+            kind, *args = self.updates.get(True)
+            if kind == "status":
+                delta = args[0]
+                if delta["op"] == "update":
+                    self.status_view.put(delta["entry"])
+                else:
+                    self.status_view.remove(delta["name"])
+            elif kind == "restored":
+                idx, fns = args
+                touched: Set[str] = set()
+                with self.lock:
+                    for name, subs in fns:
+                        self.__subscribe(name, subs, touched)
+                    self.__publish(touched)
+                pending.discard(idx)
+                self.restored += 1
+                if not pending:
+                    self.ready.set()
+            elif kind == "moved":
+                self.register_fn(args[0])
+            elif kind == "reply":
+                self.replies.put(tuple(args))
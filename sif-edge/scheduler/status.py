@@ -0,0 +1,203 @@
+import json
+import uuid
+import asyncio
+import logging
+
+from threading import Lock
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+import common
+
+from common.join import JoinBuffer
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class StatusSubscriber(object):
+    """
+    Receiver of the status changes, living in an asyncio event loop
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        super(StatusSubscriber, self).__init__()
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.resync = False
+
+    def offer(self, delta: Dict[str, Any]):
+        try:
+            self.queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            # The subscriber fell behind, it gets a full snapshot instead
+            self.resync = True
+
+
+class StatusView(object):
+    """
+    Status of the registered functions, kept up to date as they change
+    instead of being rebuilt on every request.
+
+    Every change replaces the compact entry of the affected function and
+    bumps the version, under a lock serializing the writers, so that the
+    entry of a function changed from several threads is the latest one.
+    Readers do not take that lock unless the status changed: the rendered
+    status and its JSON encoding are built at most once per version and
+    shared by all requests, re-rendering only the entries changed since,
+    and the version, prefixed by a per-process identifier, serves as ETag. Changes are also pushed as deltas to the subscribers, and to
+    the listeners, e.g., to mirror the view in another process.
+
+    :param subscriber_queue: maximum number of deltas waiting per subscriber
+    """
+
+    def __init__(self, subscriber_queue: int = 1000):
+        super(StatusView, self).__init__()
+        self.boot = uuid.uuid4().hex[:8]
+        self.entries: Dict[str, Tuple[Any, ...]] = {}
+        self.version = 0
+        self.rendered: Tuple[int, List[Dict[str, Any]], bytes] = (0, [], b"[]")
+        # Rendered status and JSON encoding of every entry, and the entries
+        # changed since they were last rendered
+        self.fragments: Dict[str, Tuple[Dict[str, Any], bytes]] = {}
+        self.changed: Set[str] = set()
+        self.render_lock = Lock()
+        self.subscriber_queue = subscriber_queue
+        self.subscribers: List[StatusSubscriber] = []
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self.sub_lock = Lock()
+        self.lock = Lock()
+
+    @staticmethod
+    def render(entry: Tuple[Any, ...]) -> Dict[str, Any]:
+        name, subs, topics, lengths, last_invoke, evicted, filtered = entry
+        return {"subs": subs, "last_invoke": last_invoke,
+                "events": JoinBuffer.describe(topics, lengths), "name": name,
+                "evicted": evicted, "filtered": filtered}
+
+    def update(self, fn: common.Function):
+        # The entry is built under the lock, so that an older state of the
+        # function never replaces a newer one
+        with self.lock:
+            self.__put((fn.name, fn.subs, fn.join.topics,
+                        fn.join.lengths(), fn.last_invoke, fn.join.evicted,
+                        fn.filter.dropped if fn.filter is not None else 0))
+
+    def put(self, entry: Tuple[Any, ...]):
+        """
+        Replaces the entry of a function, as built by `update`
+        """
+        with self.lock:
+            self.__put(entry)
+
+    def __put(self, entry: Tuple[Any, ...]):
+        name = entry[0]
+        if self.entries.get(name) == entry:
+            return
+        self.entries[name] = entry
+        self.changed.add(name)
+        self.version += 1
+        self.__publish({"op": "update", "name": name, "entry": entry})
+
+    def remove(self, name: str):
+        with self.lock:
+            if self.entries.pop(name, None) is None:
+                return
+            self.changed.add(name)
+            self.version += 1
+            self.__publish({"op": "delete", "name": name})
+
+    def etag(self, version: int) -> str:
+        return f'"{self.boot}-{version}"'
+
+    def current(self) -> Tuple[str, List[Dict[str, Any]], bytes]:
+        """
+        :returns: the ETag, the status and its JSON encoding
+        """
+        version, status, encoded = self.rendered
+        if version != self.version:
+            with self.render_lock:
+                version, status, encoded = self.rendered
+                if version != self.version:
+                    version, status, encoded = self.__render()
+        return self.etag(version), status, encoded
+
+    def __render(self) -> Tuple[int, List[Dict[str, Any]], bytes]:
+        """
+        Requires `render_lock`
+        """
+        with self.lock:
+            version = self.version
+            names = list(self.entries)
+            changed = {name: self.entries.get(name) for name in self.changed}
+            self.changed = set()
+        for name, entry in changed.items():
+            if entry is None:
+                self.fragments.pop(name, None)
+            else:
+                status = StatusView.render(entry)
+                self.fragments[name] = (status, json.dumps(status).encode())
+        fragments = [self.fragments[name] for name in names]
+        self.rendered = (version, [status for status, _ in fragments],
+                         b"[" + b", ".join(encoded for _, encoded in fragments) + b"]")
+        return self.rendered
+
+    def subscribe(self) -> StatusSubscriber:
+        sub = StatusSubscriber(asyncio.get_running_loop(), self.subscriber_queue)
+        with self.sub_lock:
+            self.subscribers = self.subscribers + [sub]
+        return sub
+
+    def unsubscribe(self, sub: StatusSubscriber):
+        with self.sub_lock:
+            self.subscribers = [other for other in self.subscribers if other is not sub]
+
+    def listen(self, listener: Callable[[Dict[str, Any]], None]):
+        """
+        Calls `listener` with every delta, from the thread changing the view
+        """
+        with self.sub_lock:
+            self.listeners = self.listeners + [listener]
+
+    async def stream(self, keepalive: float = 15.0):
+        """
+        Server-sent events stream of the status: a `snapshot` event with the
+        full status, followed by `update` and `delete` events as functions
+        change. A subscriber falling behind gets a new snapshot.
+
+        :param keepalive: seconds of inactivity before sending a comment line
+        """
+        sub = self.subscribe()
+        try:
+            resync = True
+            while True:
+                if resync or sub.resync:
+                    sub.resync = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    etag, _, encoded = self.current()
+                    yield b"event: snapshot\nid: " + etag.encode() + \
+                        b"\ndata: " + encoded + b"\n\n"
+                    resync = False
+
+                try:
+                    delta = await asyncio.wait_for(sub.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+
+                if delta["op"] == "update":
+                    data = StatusView.render(delta["entry"])
+                else:
+                    data = {"name": delta["name"]}
+                yield f"event: {delta['op']}\ndata: {json.dumps(data)}\n\n".encode()
+        finally:
+            self.unsubscribe(sub)
+
+    def __publish(self, delta: Dict[str, Any]):
+        for listener in self.listeners:
+            listener(delta)
+        for sub in self.subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, delta)
+            except RuntimeError:
+                # The event loop of the subscriber has been closed
+                self.unsubscribe(sub)
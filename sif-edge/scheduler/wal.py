@@ -0,0 +1,79 @@
+import os
+import pickle
+import struct
+import logging
+
+from typing import Any, Iterator, List, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+HEADER = struct.Struct(">I")
+
+
+class WriteAheadLog(object):
+    """
+    Append-only log of the changes applied to the scheduler state.
+
+    Every record is a length-prefixed pickle of a tuple whose first element
+    is the kind of change. Records are encoded by the caller with `encode`
+    and written in batches, each batch followed by a single fsync.
+
+    :param path: file backing the log
+    """
+
+    REGISTER = "register"
+    DELETE = "delete"
+    EVENT = "event"
+    INVOKE = "invoke"
+
+    def __init__(self, path: str):
+        super(WriteAheadLog, self).__init__()
+        self.path = path
+        self.file = open(path, "ab")
+
+    @staticmethod
+    def encode(*record: Any) -> bytes:
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        return HEADER.pack(len(data)) + data
+
+    def write(self, records: List[bytes]):
+        self.file.writelines(records)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def reset(self):
+        """
+        Drops every record, once a snapshot has made them redundant
+        """
+        self.file.flush()
+        self.file.truncate(0)
+        self.file.seek(0)
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def replay(path: str) -> Iterator[Tuple[Any, ...]]:
+        """
+        Yields the records stored at the given path in the order they were
+        appended. A torn record at the tail, e.g., due to a crash while
+        writing, ends the replay.
+        """
+        if not os.path.isfile(path):
+            return
+        with open(path, "rb") as log:
+            while True:
+                header = log.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                size, = HEADER.unpack(header)
+                data = log.read(size)
+                if len(data) < size:
+                    logger.warning(f"Ignoring torn record at the tail of {path}")
+                    return
+                try:
+                    yield pickle.loads(data)
+                except Exception as err:
+                    logger.warning(f"Ignoring corrupted record in {path}: {err}")
+                    return
@@ -0,0 +1,188 @@
+import os
+import time
+import atexit
+import logging
+
+from threading import Thread, Condition
+from typing import Any, Dict, List, Tuple
+
+from common.metrics import REGISTRY
+
+from .wal import WriteAheadLog
+
+logger = logging.getLogger("uvicorn.error")
+
+write_seconds = REGISTRY.histogram(
+    "sif_checkpoint_write_seconds", "Time spent writing a batch of checkpoint changes, snapshot included")
+snapshot_seconds = REGISTRY.histogram(
+    "sif_checkpoint_snapshot_seconds", "Time spent writing a checkpoint snapshot")
+written_records = REGISTRY.counter(
+    "sif_checkpoint_records_total", "Changes appended to the write-ahead log")
+
+
+class CheckpointWriter(object):
+    """
+    Background thread persisting the scheduler state changes.
+
+    The scheduler hands over already encoded log records and snapshots,
+    which are coalesced into a single write and fsync. A write happens once
+    `interval` seconds have passed since the oldest pending record or
+    `max_batch` records are pending, whatever comes first. At most
+    `max_pending` records wait for the writer; past that, the callers block
+    until the write completes. Hence, a crash loses at most `max_pending`
+    records, or the records of the last `interval` seconds.
+
+    :param wal: write-ahead log receiving the records
+    :param snapshot_path: file receiving the snapshots
+    :param interval: maximum number of seconds a record waits to be written
+    :param max_batch: number of pending records triggering a write
+    :param max_pending: maximum number of records waiting to be written
+    """
+
+    RECORD = "record"
+    SNAPSHOT = "snapshot"
+
+    def __init__(self, wal: WriteAheadLog, snapshot_path: str, interval: float = 0.05,
+                 max_batch: int = 256, max_pending: int = 4096):
+        super(CheckpointWriter, self).__init__()
+        self.wal = wal
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_pending = max(max_pending, max_batch)
+
+        self.cond = Condition()
+        self.pending: List[Tuple[str, bytes]] = []
+        self.oldest = 0.0
+        self.submitted = 0
+        self.written = 0
+        self.closed = False
+
+        self.writes = 0
+        self.records = 0
+        self.snapshots = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_snapshot_duration = 0.0
+
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, record: bytes):
+        self.__submit(CheckpointWriter.RECORD, record)
+
+    def snapshot(self, data: bytes):
+        """
+        Persists a snapshot of the state, which replaces every record
+        appended before it
+        """
+        self.__submit(CheckpointWriter.SNAPSHOT, data)
+
+    def __submit(self, kind: str, data: bytes):
+        with self.cond:
+            while len(self.pending) >= self.max_pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                self.oldest = time.monotonic()
+            self.pending.append((kind, data))
+            self.submitted += 1
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                self.cond.notify_all()
+
+    def flush(self):
+        """
+        Blocks until every change submitted so far has been written
+        """
+        with self.cond:
+            target = self.submitted
+            self.cond.notify_all()
+            while self.written < target and self.thread.is_alive():
+                self.cond.wait(self.interval)
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.wal.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "writes": self.writes,
+            "records": self.records,
+            "snapshots": self.snapshots,
+            "pending": len(self.pending),
+            "last_duration_ms": self.last_duration * 1000,
+            "max_duration_ms": self.max_duration * 1000,
+            "avg_duration_ms": (self.total_duration / self.writes * 1000) if self.writes else 0.0,
+            "avg_records_per_write": (self.records / self.writes) if self.writes else 0.0,
+            "last_snapshot_duration_ms": self.last_snapshot_duration * 1000,
+        }
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                deadline = self.oldest + self.interval
+                while len(self.pending) < self.max_batch and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch, self.pending = self.pending, []
+                closed = self.closed
+
+            if batch:
+                try:
+                    self.__write(batch)
+                except Exception as err:
+                    logger.error(f"Failure while writing the checkpoint: {err}")
+
+            with self.cond:
+                self.written += len(batch)
+                self.cond.notify_all()
+            if closed:
+                return
+
+    def __write(self, batch: List[Tuple[str, bytes]]):
+        start = time.perf_counter()
+        last_snapshot = None
+        for idx, (kind, _) in enumerate(batch):
+            if kind == CheckpointWriter.SNAPSHOT:
+                last_snapshot = idx
+
+        if last_snapshot is not None:
+            # Records appended before the snapshot are already part of it
+            self.__write_snapshot(batch[last_snapshot][1])
+            batch = batch[last_snapshot + 1:]
+
+        records = [data for _, data in batch]
+        if records:
+            self.wal.write(records)
+            self.records += len(records)
+            written_records.inc(amount=len(records))
+
+        duration = time.perf_counter() - start
+        self.writes += 1
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        write_seconds.observe(duration)
+
+    def __write_snapshot(self, data: bytes):
+        start = time.perf_counter()
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as chk:
+            chk.write(data)
+            chk.flush()
+            os.fsync(chk.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.wal.reset()
+        self.snapshots += 1
+        self.last_snapshot_duration = time.perf_counter() - start
+        snapshot_seconds.observe(self.last_snapshot_duration)
@@ -0,0 +1,55 @@
+"""
+Checks that the event API pushes back once a scheduler shard falls behind.
+
+Run from the ``sif-edge`` directory::
+
+    python -m pytest tests
+"""
+import os
+import signal
+import importlib
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from scheduler.shards import shard_of
+
+QUEUE_SIZE = 100
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    env = {"SIF_SCHEDULER_SHARDS": "2", "SCH_DATA_PATH": str(tmp_path_factory.mktemp("data")),
+           "SCH_QUEUE_SIZE": str(QUEUE_SIZE), "SIF_METRICS": "0"}
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield importlib.import_module("main")
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def test_stalled_shard_rejects_events(main):
+    client = TestClient(main.app)
+    fn = {"name": "occupancy", "subs": ["OccupancyEvent", "TemperatureEvent"], "url": "127.0.0.1/api", "mock": True}
+    assert client.post("/api/function", json=fn).status_code == 200
+
+    # The shard owning the function stops routing
+    proc = main.sch.processes[shard_of("occupancy", 2)]
+    os.kill(proc.pid, signal.SIGSTOP)
+    try:
+        statuses = [client.post("/api/event", json={"name": "OccupancyEvent", "data": {"idx": idx}}).status_code
+                    for idx in range(3 * QUEUE_SIZE)]
+        assert statuses[0] == 200 and statuses[-1] == 429
+        # The backlog waits in the front queue, bounded, rather than in the inbox
+        assert QUEUE_SIZE * 0.8 <= main.sch_evt_loop.qsize() <= QUEUE_SIZE
+        # Critical events are still accepted
+        critical = {"name": "OccupancyEvent", "priority": "critical"}
+        assert client.post("/api/event", json=critical).status_code == 200
+    finally:
+        os.kill(proc.pid, signal.SIGCONT)
@@ -0,0 +1,61 @@
+"""
+Checks of :class:`CoalescingQueue <dispatcher.coalesce.CoalescingQueue>`
+over priority lanes.
+
+Run from the ``sif-edge`` directory::
+
+    python -m pytest tests
+"""
+import queue
+
+import pytest
+
+from common import Invocation, Priority
+from common.queues import PriorityQueue
+from dispatcher.coalesce import CoalescingQueue
+
+
+def invocation(name: str, priority: Priority, coalesce: str | None = None, **kwargs) -> Invocation:
+    return Invocation("127.0.0.1/api", "POST", True, name=name, coalesce=coalesce,
+                      priority=priority, **kwargs)
+
+
+def backlog() -> CoalescingQueue:
+    """
+    Bulk invocations queued ahead of a pending coalesced one, all `NORMAL`
+    """
+    evt_loop = CoalescingQueue(PriorityQueue(max_wait=60))
+    for idx in range(2):
+        evt_loop.put(invocation(f"bulk{idx}", Priority.NORMAL))
+    evt_loop.put(invocation("alarm", Priority.NORMAL, CoalescingQueue.LATEST, json={"level": 1}))
+    return evt_loop
+
+
+def test_merged_priority_moves_pending_to_its_lane():
+    evt_loop = backlog()
+    evt_loop.put(invocation("alarm", Priority.CRITICAL, CoalescingQueue.LATEST, json={"level": 2}))
+
+    served = [evt_loop.get(False) for _ in range(3)]
+    assert [inv.name for inv in served] == ["alarm", "bulk0", "bulk1"]
+    assert served[0].priority == Priority.CRITICAL and served[0].kwargs["json"] == {"level": 2}
+    assert evt_loop.coalesced == 1
+
+
+def test_merged_priority_reaches_urgent_consumers():
+    evt_loop = backlog()
+    with pytest.raises(queue.Empty):
+        evt_loop.get(False, urgent=True)
+    evt_loop.put(invocation("alarm", Priority.CRITICAL, CoalescingQueue.LATEST, json={"level": 2}))
+
+    inv = evt_loop.get(False, urgent=True)
+    assert inv.name == "alarm" and inv.kwargs["json"] == {"level": 2}
+    # The invocation is no longer pending, the next one is queued anew
+    evt_loop.put(invocation("alarm", Priority.NORMAL, CoalescingQueue.LATEST))
+    assert evt_loop.coalesced == 1 and evt_loop.qsize() == 3
+
+
+def test_less_urgent_merge_keeps_priority():
+    evt_loop = CoalescingQueue(PriorityQueue(max_wait=60))
+    evt_loop.put(invocation("alarm", Priority.CRITICAL, CoalescingQueue.LATEST))
+    evt_loop.put(invocation("alarm", Priority.LOW, CoalescingQueue.LATEST))
+    assert evt_loop.get(False, urgent=True).priority == Priority.CRITICAL
@@ -0,0 +1,178 @@
+"""
+Randomized checks of :class:`JoinBuffer <common.join.JoinBuffer>` against
+the join it replaced and against the intended behaviour.
+
+Run from the ``sif-edge`` directory::
+
+    python -m pytest tests
+"""
+import random
+
+from collections import deque
+from typing import Dict, List, Tuple
+
+from common import Event
+from common.join import JoinBuffer
+
+SEEDS = range(20)
+RUNS = 250
+STEPS = 12
+
+
+class LegacyJoin(object):
+    """
+    Join of `Function` before the join buffers, i.e., `update_event` and
+    `reset_fn`, kept as it was
+    """
+
+    def __init__(self, subs: List[str]):
+        self.subs = subs
+        self.events = {}
+        self.ready = []
+        self.last_pos = None
+        self.reset_fn()
+
+    def update_event(self, evt: Event) -> bool:
+        if evt.name not in self.subs:
+            return False
+        if len(self.ready) == 0:
+            self.events[evt.name] = [evt]
+            idx = self.subs.index(evt.name)
+            vals = [None for _ in range(len(self.subs))]
+            vals[idx] = evt.name
+            self.ready.append(vals)
+            if None not in self.ready[-1]:
+                self.last_pos = 0
+                return True
+            return False
+
+        for idx, evt_tr in enumerate(self.ready):
+            if evt.name in evt_tr:
+                if None not in evt_tr:
+                    self.last_pos = idx
+                evts = [None for _ in range(len(self.subs))]
+                evts[self.subs.index(evt.name)] = evt.name
+                self.ready.insert(len(self.ready), evts)
+                if self.events[evt.name]:
+                    self.events[evt.name].insert(len(self.ready), evt)
+                else:
+                    self.events[evt.name] = [
+                        None for _ in range(len(self.ready)+1)]
+                    self.events[evt.name][len(self.ready)] = evt
+
+                if None not in self.ready[-1]:
+                    self.last_pos = len(self.ready) - 1
+                    return True
+                return (self.last_pos is not None) or False
+            else:
+                jdx = self.subs.index(evt.name)
+                if self.events[evt.name] is None:
+                    self.events[evt.name] = [
+                        None for _ in range(len(self.ready))]
+                if idx > (len(self.events[evt.name]) - 1):
+                    self.events[evt.name].insert(idx, evt)
+                else:
+                    self.events[evt.name][idx] = evt
+                evt_tr[jdx] = evt.name
+                if None not in evt_tr:
+                    self.last_pos = idx
+                    return True
+                return False
+        return False
+
+    def reset_fn(self):
+        if self.last_pos is None:
+            for topic in self.subs:
+                self.events[topic] = None
+            return
+
+        if len(self.ready) > self.last_pos:
+            self.ready.pop(self.last_pos)
+            for topic in self.subs:
+                if len(self.events[topic]) > self.last_pos:
+                    self.events[topic].pop(self.last_pos)
+            self.last_pos = None
+
+    def pop(self) -> Dict[str, int]:
+        """
+        Tuple of `generate_invocation`
+        """
+        tup = {topic: evts[self.last_pos].data for topic, evts in self.events.items()}
+        self.reset_fn()
+        return tup
+
+
+class ModelJoin(object):
+    """
+    Intended behaviour: a FIFO per topic, a tuple is complete as soon as
+    every topic holds an event and takes the oldest event of every topic
+    """
+
+    def __init__(self, subs: List[str]):
+        self.buffers = {topic: deque() for topic in subs}
+
+    def update_event(self, evt: Event) -> bool:
+        if evt.name not in self.buffers:
+            return False
+        self.buffers[evt.name].append(evt.data)
+        return all(self.buffers.values())
+
+    def pop(self) -> Dict[str, int]:
+        return {topic: buf.popleft() for topic, buf in self.buffers.items()}
+
+
+def feed(join, sequence: List[str]) -> List[Tuple[int, Dict[str, int]]]:
+    """
+    Pushes events numbered by arrival and returns the tuples completed,
+    with the step completing them
+    """
+    tuples = []
+    for step, topic in enumerate(sequence):
+        complete = join.push(Event(topic, step)) if isinstance(join, JoinBuffer) \
+            else join.update_event(Event(topic, step))
+        if complete:
+            tup = join.pop()
+            tuples.append((step, {topic: evt.data for topic, evt in tup.items()}
+                           if isinstance(join, JoinBuffer) else tup))
+    return tuples
+
+
+def sequences(seed: int, topics: List[str]):
+    rnd = random.Random(seed)
+    for _ in range(RUNS):
+        # Some events target topics the function is not subscribed to
+        yield [rnd.choice(topics + ["other"]) for _ in range(STEPS)]
+
+
+def test_matches_legacy_join_up_to_two_topics():
+    for seed in SEEDS:
+        for subs in (["A"], ["A", "B"]):
+            for sequence in sequences(seed, subs):
+                assert feed(JoinBuffer(subs), sequence) == feed(LegacyJoin(subs), sequence), sequence
+
+
+def test_matches_model_for_any_number_of_topics():
+    for seed in SEEDS:
+        for subs in (["A"], ["A", "B"], ["A", "B", "C"], ["A", "B", "C", "D"]):
+            for sequence in sequences(seed, subs):
+                assert feed(JoinBuffer(subs), sequence) == feed(ModelJoin(subs), sequence), sequence
+
+
+def test_duplicate_subscriptions_join_once():
+    assert feed(JoinBuffer(["A", "B", "A"]), ["A", "B"]) == [(1, {"A": 0, "B": 1})]
+
+
+def test_legacy_join_loses_events_from_three_topics():
+    """
+    With three topics and more, the legacy join shifted its per-topic lists
+    out of line with the partial tuples once a tuple was removed while
+    another one was pending. Events of a pending tuple were then skipped and
+    completing it waited for later events. The join buffers always use the
+    oldest event of every topic, hence complete that tuple as soon as its
+    last topic arrives.
+    """
+    sequence = ["A", "C", "A", "C", "B", "B", "C"]
+    assert feed(LegacyJoin(["A", "B", "C"]), sequence) == [
+        (4, {"A": 0, "B": 4, "C": 1}), (6, {"A": 2, "B": 5, "C": 6})]
+    assert feed(JoinBuffer(["A", "B", "C"]), sequence) == [
+        (4, {"A": 0, "B": 4, "C": 1}), (5, {"A": 2, "B": 5, "C": 3})]